@@ -0,0 +1,102 @@
+# ab_compare.py
+"""
+A/B comparison of the summary modes (`main.py ab-compare`).
+
+Runs the multi-call and the combined pipeline on the same sample of already summarized
+decisions and reports, per mode, the token usage, cost, end-to-end latency and the share
+of supporting quotes found verbatim in the decision text (`quote_verified`). Nothing is
+written to the collection; the per-document results go to a JSON report. The summary
+cache is turned off first, so every document reaches the model in both modes.
+"""
+import json
+import statistics
+import time
+from typing import Dict, List
+
+from cleaners import get_cleaner
+from instrumentation import DocumentTrace
+from model_router import document_cost
+from summary_cache import disable_summary_cache
+
+AB_MODES = ("multi", "combined")
+_SOURCED_KEYS = ("sourced_facts", "sourced_rationale", "sourced_issues", "sourced_holdings")
+
+
+def sample_decisions(decisions_collection, sample_size: int) -> List[dict]:
+    """The most recently summarized decisions: known criminal cases the pipeline has handled before."""
+    return list(
+        decisions_collection.find({"summary_status": {"$in": ["success", "partial"]}}, {"html": 1})
+        .sort("summarized_at", -1)
+        .limit(sample_size)
+    )
+
+
+def _quote_counts(brief: dict) -> Dict[str, int]:
+    items = [item for key in _SOURCED_KEYS for item in brief.get(key, [])]
+    return {"quotes": len(items), "verified": sum(1 for item in items if item.get("quote_verified"))}
+
+
+def _run_one(full_text: str, api_key: str, mode: str) -> dict:
+    from summarizer_logic import generate_structured_brief
+
+    trace = DocumentTrace()
+    started = time.perf_counter()
+    try:
+        brief, totals = generate_structured_brief(full_text, api_key, trace=trace, summary_mode=mode)
+        error = None if brief else "no result"
+    except Exception as e:
+        brief, totals, error = None, trace.totals(), str(e)
+    result = {
+        "mode": mode,
+        "ran_as": trace.extra.get("summary_mode"),
+        "seconds": time.perf_counter() - started,
+        "calls": len(trace.llm_calls),
+        "input_tokens": totals["prompt_token_count"],
+        "output_tokens": totals["candidates_token_count"],
+        "cost_usd": document_cost(trace.llm_calls),
+        "failed_stages": trace.extra.get("failed_stages", []),
+        "error": error,
+    }
+    result.update(_quote_counts(brief) if brief else {"quotes": 0, "verified": 0})
+    return result
+
+
+def summarize_mode(results: List[dict]) -> dict:
+    """Aggregates one mode's per-document results."""
+    completed = [r for r in results if not r["error"]]
+    seconds = sorted(r["seconds"] for r in completed)
+    quotes = sum(r["quotes"] for r in completed)
+    return {
+        "documents": len(results),
+        "errors": len(results) - len(completed),
+        "partial": sum(1 for r in completed if r["failed_stages"]),
+        "fell_back": sum(1 for r in results if r["ran_as"] != r["mode"]),
+        "calls": sum(r["calls"] for r in results),
+        "input_tokens": sum(r["input_tokens"] for r in results),
+        "output_tokens": sum(r["output_tokens"] for r in results),
+        "cost_usd": sum(r["cost_usd"] for r in results),
+        "p50_seconds": statistics.median(seconds) if seconds else 0.0,
+        "max_seconds": seconds[-1] if seconds else 0.0,
+        "quotes": quotes,
+        "quote_match_rate": sum(r["verified"] for r in completed) / quotes if quotes else 0.0,
+    }
+
+
+def run_ab_comparison(decisions_collection, api_key: str, sample_size: int, report_path: str) -> Dict[str, dict]:
+    """Runs both modes on each sampled decision, writes the JSON report and returns the per-mode summaries."""
+    disable_summary_cache()
+    clean = get_cleaner()
+    sample = sample_decisions(decisions_collection, sample_size)
+    documents = []
+    for i, decision in enumerate(sample):
+        full_text = clean(decision["html"])
+        # Alternate which mode goes first, so neither one always meets a fresher rate-limit budget.
+        modes = AB_MODES if i % 2 == 0 else AB_MODES[::-1]
+        print(f"A/B [{i + 1}/{len(sample)}] {decision['_id']}: {len(full_text)} characters")
+        runs = {mode: _run_one(full_text, api_key, mode) for mode in modes}
+        documents.append({"doc_id": str(decision["_id"]), "characters": len(full_text), **runs})
+
+    summary = {mode: summarize_mode([d[mode] for d in documents]) for mode in AB_MODES}
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump({"summary": summary, "documents": documents}, f, indent=2)
+    return summary
@@ -0,0 +1,313 @@
+# batch_mode.py
+"""
+Offline batch submission for the backlog.
+
+Pending decisions become JSONL request files. These are submitted through a pluggable
+`BatchBackend`, polled until complete, and parsed with the same parsers as the online
+pipeline. The run happens in two waves: the step-1 briefs first, then every sourcing
+request that depends on them. Writing the results back to Mongo is left to the caller
+(see `main.run_batch_command`), which does it with one bulk write.
+
+Each run keeps a job file (`job.json`) in its work directory with the claim token, the
+request key of every document and the id of each submitted batch. A run that fails or dies
+while a paid batch is pending can be resumed from it (`main.py batch --resume <work_dir>`):
+submitted waves are collected instead of being submitted again.
+"""
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bson import json_util
+
+from compaction import COMPACTION_ENABLED, compact
+from instrumentation import DocumentTrace
+from prompts import legal_brief_prompt, legal_brief_parser
+from model_router import STRONG_MODEL
+from quote_index import QUOTE_SOURCING_MODE, QuoteIndex
+from summarizer_logic import (
+    SOURCING_STAGES, assemble_structured_data, set_format_note, source_locally, sourcing_items_json, sourcing_text,
+    stage_items
+)
+
+BATCH_POLL_SECONDS = int(os.environ.get("BATCH_POLL_SECONDS", "60"))
+BATCH_TIMEOUT_HOURS = float(os.environ.get("BATCH_TIMEOUT_HOURS", "24"))
+
+_KEY_SEPARATOR = "|"
+JOB_FILE = "job.json"
+
+
+# --- Job file ---
+
+def load_job(work_dir: str) -> Optional[Dict[str, Any]]:
+    """The job file of the run in `work_dir`, or None if it has none."""
+    path = os.path.join(work_dir, JOB_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json_util.loads(f.read())
+
+
+def save_job(work_dir: str, job: Dict[str, Any]):
+    """Writes the job file atomically, so a crash never leaves it half written."""
+    os.makedirs(work_dir, exist_ok=True)
+    path = os.path.join(work_dir, JOB_FILE)
+    with open(f"{path}.tmp", "w") as f:
+        f.write(json_util.dumps(job, indent=2))
+    os.replace(f"{path}.tmp", path)
+
+
+def request_key(doc_id: Any) -> str:
+    return str(doc_id)
+
+
+# --- Backends ---
+
+class BatchBackend:
+    """Interface for a batch LLM service. States are "pending", "succeeded" or "failed"."""
+
+    def submit(self, requests_path: str, display_name: str) -> str:
+        raise NotImplementedError
+
+    def state(self, batch_id: str) -> str:
+        raise NotImplementedError
+
+    def download_results(self, batch_id: str, results_path: str):
+        raise NotImplementedError
+
+
+class LocalFileBatchBackend(BatchBackend):
+    """
+    File-based stand-in for a batch service. Each batch is a directory under `root_dir`
+    holding `requests.jsonl`; it is complete once `results.jsonl` appears there. With a
+    `responder` (request dict -> Gemini-style response dict) batches complete on submit,
+    which makes the whole batch flow testable offline.
+    """
+
+    def __init__(self, root_dir: str, responder: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None):
+        self.root_dir = root_dir
+        self.responder = responder
+        os.makedirs(root_dir, exist_ok=True)
+
+    def submit(self, requests_path: str, display_name: str) -> str:
+        batch_id = f"{display_name}-{uuid.uuid4().hex[:8]}"
+        batch_dir = os.path.join(self.root_dir, batch_id)
+        os.makedirs(batch_dir)
+        shutil.copyfile(requests_path, os.path.join(batch_dir, "requests.jsonl"))
+        if self.responder:
+            with open(requests_path) as requests_file, open(os.path.join(batch_dir, "results.jsonl"), "w") as out:
+                for line in requests_file:
+                    entry = json.loads(line)
+                    try:
+                        result = {"key": entry["key"], "response": self.responder(entry["request"])}
+                    except Exception as e:
+                        result = {"key": entry["key"], "error": {"message": str(e)}}
+                    out.write(json.dumps(result) + "\n")
+        return batch_id
+
+    def state(self, batch_id: str) -> str:
+        batch_dir = os.path.join(self.root_dir, batch_id)
+        if os.path.exists(os.path.join(batch_dir, "results.jsonl")):
+            return "succeeded"
+        if os.path.exists(os.path.join(batch_dir, "failed")):
+            return "failed"
+        return "pending"
+
+    def download_results(self, batch_id: str, results_path: str):
+        shutil.copyfile(os.path.join(self.root_dir, batch_id, "results.jsonl"), results_path)
+
+
+class GeminiBatchBackend(BatchBackend):
+    """Gemini Batch API backend (requires the `google-genai` package)."""
+
+    _SUCCEEDED = {"JOB_STATE_SUCCEEDED"}
+    _FAILED = {"JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+
+    def __init__(self, api_key: str, model: str = STRONG_MODEL):
+        from google import genai
+        self.client = genai.Client(api_key=api_key)
+        self.model = model
+
+    def submit(self, requests_path: str, display_name: str) -> str:
+        uploaded = self.client.files.upload(file=requests_path, config={"display_name": display_name, "mime_type": "jsonl"})
+        job = self.client.batches.create(model=self.model, src=uploaded.name, config={"display_name": display_name})
+        return job.name
+
+    def state(self, batch_id: str) -> str:
+        job_state = self.client.batches.get(name=batch_id).state.name
+        if job_state in self._SUCCEEDED:
+            return "succeeded"
+        if job_state in self._FAILED:
+            return "failed"
+        return "pending"
+
+    def download_results(self, batch_id: str, results_path: str):
+        job = self.client.batches.get(name=batch_id)
+        content = self.client.files.download(file=job.dest.file_name)
+        with open(results_path, "wb") as f:
+            f.write(content)
+
+
+def make_response(text: str, input_tokens: int = 0, output_tokens: int = 0) -> Dict[str, Any]:
+    """A Gemini-style response dict, for stand-in responders."""
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}],
+        "usageMetadata": {"promptTokenCount": input_tokens, "candidatesTokenCount": output_tokens},
+    }
+
+
+# --- Request files ---
+
+def _request_line(key: str, prompt_text: str) -> str:
+    return json.dumps({
+        "key": key,
+        "request": {
+            "contents": [{"role": "user", "parts": [{"text": prompt_text}]}],
+            "generationConfig": {"temperature": 0.1},
+        },
+    })
+
+
+def _render(prompt, **inputs) -> str:
+    return prompt.format_messages(**inputs)[0].content
+
+
+def _submit_and_wait(backend: BatchBackend, lines: List[str], work_dir: str, wave: str,
+                     poll_seconds: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Writes `lines` to a request file, submits it, polls until done and returns {key: result entry}.
+    A wave whose batch id is already in the job file was submitted by an earlier run and is only collected.
+    """
+    job = load_job(work_dir) or {}
+    batches = job.setdefault("batches", {})
+    batch_id = batches.get(wave)
+    if batch_id:
+        print(f"Collecting {wave} batch {batch_id}, submitted by an earlier run.")
+    else:
+        requests_path = os.path.join(work_dir, f"{wave}_requests.jsonl")
+        with open(requests_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        batch_id = backend.submit(requests_path, display_name=f"nypti-{wave}-{os.path.basename(work_dir)}")
+        batches[wave] = batch_id
+        save_job(work_dir, job)
+        print(f"Submitted {wave} batch {batch_id} with {len(lines)} requests. Polling every {poll_seconds}s...")
+
+    deadline = time.time() + BATCH_TIMEOUT_HOURS * 3600
+    while True:
+        state = backend.state(batch_id)
+        if state == "succeeded":
+            break
+        if state == "failed":
+            # Nothing to collect: a resumed run submits this wave again.
+            del batches[wave]
+            save_job(work_dir, job)
+            raise RuntimeError(f"Batch {batch_id} ({wave}) failed.")
+        if time.time() > deadline:
+            raise TimeoutError(f"Batch {batch_id} ({wave}) did not finish within {BATCH_TIMEOUT_HOURS}h.")
+        time.sleep(poll_seconds)
+
+    results_path = os.path.join(work_dir, f"{wave}_results.jsonl")
+    backend.download_results(batch_id, results_path)
+    results = {}
+    with open(results_path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                results[entry["key"]] = entry
+    print(f"Batch {batch_id} ({wave}) complete: {len(results)} results.")
+    return results
+
+
+def _parse_result(entry: Optional[Dict[str, Any]], parser, trace: DocumentTrace, stage: str):
+    """Parses one result line with the stage's parser, recording its token usage. Raises on a missing or failed result."""
+    if entry is None:
+        raise ValueError(f"No batch result for stage '{stage}'.")
+    if "error" in entry:
+        raise ValueError(f"Batch request for stage '{stage}' failed: {entry['error']}")
+    response = entry["response"]
+    usage = response.get("usageMetadata", {})
+    trace.record_llm_call(stage, usage.get("promptTokenCount", 0), usage.get("candidatesTokenCount", 0), model=STRONG_MODEL)
+    parts = response["candidates"][0]["content"]["parts"]
+    return parser.parse("".join(part.get("text", "") for part in parts))
+
+
+# --- The two-wave flow ---
+
+def run_batch_waves(documents: Dict[Any, str], backend: BatchBackend, work_dir: str,
+                    poll_seconds: int = BATCH_POLL_SECONDS) -> Dict[Any, Tuple[Optional[Dict[str, Any]], Optional[str], DocumentTrace]]:
+    """
+    Summarizes {doc_id: cleaned_text} through two batch waves.
+    Returns {doc_id: (structured data or None, error message or None, trace)}.
+    Raises if a wave fails or times out; waves already submitted are recorded in the job file.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    keys = {request_key(doc_id): doc_id for doc_id in documents}
+    traces = {doc_id: DocumentTrace(doc_id) for doc_id in documents}
+    outcomes = {}
+
+    # The requests carry the compacted text, as online; quote offsets still refer to the cleaned text.
+    compacted = {doc_id: compact(text) for doc_id, text in documents.items()}
+    if COMPACTION_ENABLED:
+        for doc_id, result in compacted.items():
+            traces[doc_id].extra["compaction"] = result.report()
+    documents = {doc_id: result.text for doc_id, result in compacted.items()}
+
+    # Wave 1: the unsourced briefs
+    brief_lines = [
+        _request_line(f"{key}{_KEY_SEPARATOR}brief", _render(legal_brief_prompt, court_decision_full_text=documents[doc_id]))
+        for key, doc_id in keys.items()
+    ]
+    brief_results = _submit_and_wait(backend, brief_lines, work_dir, "brief", poll_seconds)
+
+    briefs = {}
+    for key, doc_id in keys.items():
+        try:
+            brief = _parse_result(brief_results.get(f"{key}{_KEY_SEPARATOR}brief"), legal_brief_parser, traces[doc_id], "brief")
+            set_format_note(brief)
+            briefs[doc_id] = brief
+        except Exception as e:
+            outcomes[doc_id] = (None, f"Brief generation failed: {e}", traces[doc_id])
+
+    # Wave 2: every sourcing request that depends on a successful brief
+    indexes = {doc_id: QuoteIndex(documents[doc_id], compacted[doc_id].to_original_span, compacted[doc_id].original) for doc_id in briefs}
+    sourced = {doc_id: {} for doc_id in briefs}
+    sourcing_lines = []
+    for doc_id, brief in briefs.items():
+        for stage, items in stage_items(brief).items():
+            if not items:
+                sourced[doc_id][stage] = []
+            elif QUOTE_SOURCING_MODE == "local":
+                sourced[doc_id][stage] = source_locally(stage, items, indexes[doc_id])
+            else:
+                prompt, items_variable = SOURCING_STAGES[stage].prompt, SOURCING_STAGES[stage].items_variable
+                stage_text = sourcing_text(items, documents[doc_id], indexes[doc_id])
+                sourcing_lines.append(_request_line(
+                    f"{request_key(doc_id)}{_KEY_SEPARATOR}{stage}",
+                    _render(prompt, full_text=stage_text, **{items_variable: sourcing_items_json(items)})
+                ))
+
+    sourcing_results = _submit_and_wait(backend, sourcing_lines, work_dir, "sourcing", poll_seconds) if sourcing_lines else {}
+
+    for doc_id, brief in briefs.items():
+        trace = traces[doc_id]
+        for stage, sourcing_stage in SOURCING_STAGES.items():
+            if stage in sourced[doc_id]:
+                continue
+            try:
+                parsed = _parse_result(sourcing_results.get(f"{request_key(doc_id)}{_KEY_SEPARATOR}{stage}"),
+                                       sourcing_stage.parser, trace, stage)
+                sourced[doc_id][stage] = getattr(parsed, sourcing_stage.attribute)
+            except Exception as e:
+                print(f"ERROR during batch {stage} sourcing for {doc_id}: {e}")
+                sourced[doc_id][stage] = None
+        failed_stages = [stage for stage, result in sourced[doc_id].items() if result is None]
+        if failed_stages:
+            trace.extra["failed_stages"] = failed_stages
+        try:
+            outcomes[doc_id] = (assemble_structured_data(brief, sourced[doc_id], indexes[doc_id], trace), None, trace)
+        except Exception as e:
+            outcomes[doc_id] = (None, f"Assembling the brief failed: {e}", trace)
+    return outcomes
+
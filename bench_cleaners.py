@@ -0,0 +1,143 @@
+# bench_cleaners.py
+"""
+Equivalence check and microbenchmark for the HTML cleaners in cleaners.py.
+
+    python bench_cleaners.py                 # check + benchmark on the built-in fixture corpus
+    python bench_cleaners.py --corpus DIR    # ...on every *.html file under DIR instead
+    python bench_cleaners.py --check-only
+
+The check compares every backend's output (or raised exception type) with the eyecite path.
+The benchmark runs each backend in its own process and reports throughput in MB/s, the
+tracemalloc peak (Python allocations) and the process's max RSS (which also covers
+libxml2's own allocations, such as eyecite's full lxml tree; the corpus itself is the same in every process).
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from cleaners import CLEANERS, clean_html_eyecite
+
+# Inputs that exercise the parser's edge cases rather than typical decisions.
+EDGE_CASES = [
+    "", "   ", "<!-- only a comment -->", "<!DOCTYPE html>", "People v Smith",
+    "</b> \x0c <p>People v Smith</p>", "\xa0<p>x</p>", "<p>x</p>\xa0", "<p>a&nbsp;&nbsp;b</p>",
+    "<p>zero\u200bwidth</p>", "<html><head><title>People v Doe</title><style>p {}</style></head><body>x</body></html>",
+    "<p>a<!-- c -->b<?pi x?>c</p>", "<div class=\"star-pagination\">*12</div><p>text</p>", "<page-number>3</page-number>",
+    "<table><tr><td>a<td>b</table>", "<p>unclosed <b>bold <i>italic", "<script>var x = '<p>';</script><p>y</p>",
+]
+
+
+def synthetic_decision(rng: random.Random, paragraphs: int, caption: str = None) -> str:
+    """A slip-opinion-like document: head with style/script, caption, star paging, footnotes and entities."""
+    caption = caption or rng.choice(["People v Smith", "The People of the State of New York v Jones", "Matter of Doe v Town of Islip"])
+    parts = [
+        "<!DOCTYPE html><html><head><title>", caption, "</title>",
+        "<style>body { font-family: serif; }</style><script>var page = 1;</script></head><body>",
+        f"<p>{caption}</p><p>2024 NY Slip Op {rng.randint(10000, 99999)}</p>",
+    ]
+    words = "the defendant court held that evidence was suppressed because officers lacked reasonable suspicion".split()
+    for i in range(paragraphs):
+        sentence = " ".join(rng.choice(words) for _ in range(rng.randint(20, 80)))
+        parts.append(f"<p>{sentence.capitalize()}.&nbsp; See <i>People v De Bour</i>, 40 NY2d 210 [1976].</p>\n")
+        if i % 7 == 0:
+            parts.append(f"<span class=\"star-pagination\">*{i}</span><page-number>{i}</page-number>")
+        if i % 11 == 0:
+            parts.append(f"<p><a href=\"#fn{i}\">[FN{i}]</a>   \t Footnote &amp; text\u200b here.</p>")
+    parts.append("<p>This opinion is uncorrected and subject to revision before publication in the Official Reports.</p></body></html>")
+    return "".join(parts)
+
+
+def fixture_corpus(seed: int = 7, documents: int = 40):
+    rng = random.Random(seed)
+    corpus = list(EDGE_CASES)
+    corpus.extend(synthetic_decision(rng, rng.choice([5, 50, 400, 2000])) for _ in range(documents))
+    return corpus
+
+
+def load_corpus(corpus_dir):
+    if not corpus_dir:
+        return fixture_corpus()
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(corpus_dir, "**", "*.html"), recursive=True)):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            corpus.append(f.read())
+    return corpus
+
+
+def _outcome(cleaner, html):
+    try:
+        return cleaner(html)
+    except Exception as e:
+        return f"<raised {type(e).__name__}>"
+
+
+def check_equivalence(corpus) -> bool:
+    ok = True
+    for name, cleaner in CLEANERS.items():
+        if cleaner is clean_html_eyecite:
+            continue
+        mismatches = [i for i, html in enumerate(corpus) if _outcome(cleaner, html) != _outcome(clean_html_eyecite, html)]
+        print(f"[check] {name}: {len(corpus) - len(mismatches)}/{len(corpus)} documents identical to eyecite")
+        for i in mismatches[:5]:
+            print(f"    document {i}: {corpus[i][:120]!r}")
+        ok = ok and not mismatches
+    return ok
+
+
+def measure(backend: str, corpus_dir, repeat: int) -> dict:
+    """Runs one backend over the corpus in this process and returns its numbers."""
+    cleaner = CLEANERS[backend]
+    # Also warms up the backend's imports.
+    corpus = [html for html in load_corpus(corpus_dir) if not _outcome(cleaner, html).startswith("<raised ")]
+    total_mb = repeat * sum(len(html.encode("utf-8")) for html in corpus) / 1e6
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for html in corpus:
+            cleaner(html)
+    elapsed = time.perf_counter() - started
+    max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # tracemalloc slows allocation down a lot, so memory gets its own pass after the timed ones.
+    tracemalloc.start()
+    for html in corpus:
+        cleaner(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"backend": backend, "mb": total_mb, "seconds": elapsed, "mb_per_s": total_mb / elapsed,
+            "tracemalloc_peak_mb": peak / 1e6, "max_rss_mb": max_rss_kb / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and benchmark the HTML cleaner backends.")
+    parser.add_argument("--corpus", help="Directory of *.html files (default: built-in fixture corpus).")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the corpus per backend.")
+    parser.add_argument("--check-only", action="store_true")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.corpus, args.repeat)))
+        return
+
+    if args.check_only:
+        sys.exit(0 if check_equivalence(load_corpus(args.corpus)) else 1)
+
+    for backend in CLEANERS:
+        # A fresh process per backend keeps the max RSS numbers independent. Linux carries max RSS
+        # across exec, so this runs before this process has loaded or cleaned anything.
+        command = [sys.executable, __file__, "--measure", backend, "--repeat", str(args.repeat)]
+        if args.corpus:
+            command += ["--corpus", args.corpus]
+        result = json.loads(subprocess.run(command, capture_output=True, text=True, check=True).stdout.strip().splitlines()[-1])
+        print(f"[bench] {backend:>9}: {result['mb_per_s']:7.1f} MB/s over {result['mb']:.1f} MB, "
+              f"tracemalloc peak {result['tracemalloc_peak_mb']:6.1f} MB, max RSS {result['max_rss_mb']:6.1f} MB")
+    sys.exit(0 if check_equivalence(load_corpus(args.corpus)) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+# benchmark.py
+"""
+Offline throughput benchmark for the worker pool, without Gemini or a production database.
+
+    python benchmark.py                              # 200 synthetic decisions, 4 workers, mongomock
+    python benchmark.py --docs 1000 --workers 16 --latency 1.5
+    python benchmark.py --responses recorded.json    # replay recorded model responses
+    python benchmark.py --mongo-url mongodb://localhost:27017   # an ephemeral mongod instead of mongomock
+    python benchmark.py --cache --passes 2           # second pass measures the warm summary cache
+
+Decisions flow through the same code as `main.py run`: claims by the prefetcher,
+`process_decision` in every worker, and buffered bulk writes. The model is replaced by
+`ReplayChatModel`, which answers every stage after a configurable latency with configurable
+token counts. The database is mongomock, or a scratch database on `--mongo-url`, behind a
+proxy that counts round trips.
+
+Reports docs/sec, per-stage p50/p95 latency, calls and estimated cost per model, the
+process's max RSS and DB round trips by operation. `--json PATH` also writes the numbers, so runs before and after a change can be diffed.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from bench_cleaners import synthetic_decision
+
+# The repository modules read their settings from the environment when imported,
+# so they are imported in main() once the benchmark has set it up.
+
+BENCHMARK_DB_NAME = "summarizer_benchmark"
+
+# Share of non-criminal decisions in the synthetic corpus, about what the live collection shows.
+NON_CRIMINAL_SHARE = 0.35
+CRIMINAL_CAPTIONS = ("People v Smith", "The People of the State of New York v Jones")
+
+
+# --- Synthetic corpus ---
+
+def synthetic_corpus(documents: int, seed: int = 7) -> List[str]:
+    """
+    Decisions with a long-tailed size distribution: mostly short memoranda, some full
+    opinions, and rarely one long enough to be chunked. Paragraph counts are log-normal
+    (median 25 paragraphs, about 13 KB of HTML), capped at 4000.
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(documents):
+        paragraphs = min(4000, max(2, int(rng.lognormvariate(3.2, 1.1))))
+        criminal = rng.random() >= NON_CRIMINAL_SHARE
+        caption = rng.choice(CRIMINAL_CAPTIONS) if criminal else "Matter of Doe v Town of Islip"
+        corpus.append(synthetic_decision(rng, paragraphs, caption))
+    return corpus
+
+
+# --- Fake model ---
+
+_DECISION_TEXT = re.compile(r"--- (?:BEGIN COURT DECISION TEXT|FULL COURT DECISION TEXT) ---\n(.*?)\n--- END", re.S)
+_ITEMS = re.compile(r"LIST \(in JSON format\) ---\n(.*?)\n--- END", re.S)
+
+
+def _stage_of(prompt: str) -> str:
+    if "brief_step_3_key_facts_sourced" in prompt:
+        return "combined"
+    if "`sourced_takeaways`" in prompt:
+        return "sourcing"
+    if "`sourced_issues`" in prompt:
+        return "issues"
+    if "`sourced_holdings`" in prompt:
+        return "holdings"
+    return "brief"
+
+
+def _quote_from(text: str, seed: str, words: int = 12) -> str:
+    """A verbatim run of words from the decision, picked deterministically, so quote verification finds it."""
+    tokens = text.split()
+    if len(tokens) <= words:
+        return text
+    start = random.Random(seed).randrange(len(tokens) - words)
+    return " ".join(tokens[start:start + words])
+
+
+def fake_response(stage: str, prompt: str, items_per_list: int = 4) -> Dict[str, Any]:
+    """A schema-valid response for `stage`, built from the prompt the way the real model would answer it."""
+    match = _DECISION_TEXT.search(prompt)
+    text = match.group(1) if match else ""
+    if stage in ("sourcing", "issues", "holdings"):
+        items = json.loads(_ITEMS.search(prompt).group(1))
+        if stage == "sourcing":
+            return {"sourced_takeaways": [{"takeaway": t, "supporting_quote": _quote_from(text, t)} for t in items]}
+        if stage == "issues":
+            return {"sourced_issues": [{"issue_question": q, "supporting_quote": _quote_from(text, q)} for q in items]}
+        return {"sourced_holdings": [dict(h, supporting_quote=_quote_from(text, h["legal_principle"])) for h in items]}
+
+    caption = " ".join(text.split()[:3]) or "People v Smith"
+    facts = [f"Fact {i} of {caption}." for i in range(items_per_list)]
+    issues = [f"Was ruling {i} correct?" for i in range(items_per_list)]
+    holdings = [{"issue_question": q, "answer": "Yes", "legal_principle": f"Principle {i}."} for i, q in enumerate(issues)]
+    rationale = [f"Reason {i}." for i in range(items_per_list)]
+    brief = {
+        "brief_step_1_format_note": "Standard brief.",
+        "brief_step_2_caption": {"case_name": caption, "court": "Supreme Court, Appellate Division, Second Department", "year_decided": 2024},
+        "brief_step_4_procedural_history": "Judgment of conviction after a jury trial.",
+        "brief_step_8_disposition": "Affirmed",
+        "brief_step_9_other_opinions_summary": None,
+    }
+    if stage == "combined":
+        brief["brief_step_3_key_facts_sourced"] = [{"takeaway": f, "supporting_quote": _quote_from(text, f)} for f in facts]
+        brief["brief_step_5_issues_sourced"] = [{"issue_question": q, "supporting_quote": _quote_from(text, q)} for q in issues]
+        brief["brief_step_6_holdings_sourced"] = [dict(h, supporting_quote=_quote_from(text, h["legal_principle"])) for h in holdings]
+        brief["brief_step_7_rationale_sourced"] = [{"takeaway": r, "supporting_quote": _quote_from(text, r)} for r in rationale]
+    else:
+        brief["brief_step_3_key_facts_takeaways"] = facts
+        brief["brief_step_5_issues_as_questions"] = issues
+        brief["brief_step_6_holdings_summary"] = holdings
+        brief["brief_step_7_rationale_takeaways"] = rationale
+    return brief
+
+
+def make_replay_model(responses: Optional[Dict[str, Any]] = None, latency: float = 0.0,
+                      latency_per_1k_tokens: float = 0.0, output_tokens: int = 600):
+    """
+    A LangChain chat model that answers after `latency` + `latency_per_1k_tokens` per 1,000 input
+    tokens and reports `output_tokens` output tokens (input tokens are characters / 4). Stages
+    present in `responses` ({"brief", "combined", "sourcing", "issues", "holdings"}) replay
+    that recorded JSON verbatim; the others get a generated answer (see `fake_response`).
+    """
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage
+    from langchain_core.outputs import ChatGeneration, ChatResult
+
+    class ReplayChatModel(BaseChatModel):
+        @property
+        def _llm_type(self) -> str:
+            return "replay"
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            prompt = messages[-1].content
+            stage = _stage_of(prompt)
+            input_tokens = len(prompt) // 4
+            time.sleep(latency + latency_per_1k_tokens * input_tokens / 1000)
+            body = responses[stage] if responses and stage in responses else fake_response(stage, prompt)
+            message = AIMessage(content=json.dumps(body), usage_metadata={
+                "input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens,
+            })
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+    return ReplayChatModel()
+
+
+# --- Database stand-in ---
+
+class CountingCollection:
+    """Forwards to a pymongo (or mongomock) collection and counts one round trip per operation."""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self._lock = threading.Lock()
+        self.round_trips = Counter()
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if not callable(attribute):
+            return attribute
+
+        def counted(*args, **kwargs):
+            with self._lock:
+                self.round_trips[name] += 1
+            return attribute(*args, **kwargs)
+        return counted
+
+
+def _allow_bulk_sort_in_mongomock():
+    """
+    pymongo >= 4.11 passes `sort` to the bulk builder for UpdateOne and ReplaceOne, which
+    mongomock 4.x does not accept, so its bulk_write raises TypeError. Accept `sort` when it is
+    unset, which is all BulkUpdateBuffer sends.
+    """
+    import inspect
+    from mongomock.collection import BulkOperationBuilder
+
+    for name in ("add_update", "add_replace"):
+        method = getattr(BulkOperationBuilder, name)
+        if "sort" in inspect.signature(method).parameters:
+            continue
+
+        def without_sort(self, *args, sort=None, _method=method, **kwargs):
+            if sort is not None:
+                raise NotImplementedError("mongomock does not support sort in bulk writes.")
+            return _method(self, *args, **kwargs)
+        setattr(BulkOperationBuilder, name, without_sort)
+
+
+def open_collection(mongo_url: Optional[str]):
+    """A fresh, empty decisions collection: in mongomock, or a scratch database on a real server."""
+    if mongo_url:
+        import pymongo
+        client = pymongo.MongoClient(mongo_url)
+        client.drop_database(BENCHMARK_DB_NAME)
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            raise SystemExit("mongomock is not installed: pip install -r requirements-dev.txt, or pass --mongo-url.")
+        _allow_bulk_sort_in_mongomock()
+        client = mongomock.MongoClient()
+    return client, client[BENCHMARK_DB_NAME]["Documents"]
+
+
+# --- Benchmark ---
+
+def run_pass(main_module, collection: CountingCollection, workers: int, summary_mode: Optional[str], work_dir: str,
+             pass_no: int) -> Dict[str, Any]:
+    """Summarizes every pending decision in `collection` through the worker pool and returns the numbers."""
+    from instrumentation import MetricsRecorder
+
+    metrics = MetricsRecorder(os.path.join(work_dir, f"metrics_{pass_no}.jsonl"), os.path.join(work_dir, f"metrics_{pass_no}.prom"))
+    ctx = main_module.RunContext(collection, "offline", os.path.join(work_dir, f"run_log_{pass_no}.txt"), metrics, summary_mode=summary_mode)
+    round_trips_before = Counter(collection.round_trips)
+    started = time.perf_counter()
+    try:
+        main_module.run_worker_pool(ctx, f"benchmark:{pass_no}", num_workers=workers)
+    finally:
+        ctx.close()
+    elapsed = time.perf_counter() - started
+    stats = ctx.stats
+    documents = stats.decisions_processed + stats.decisions_partial + stats.decisions_skipped + stats.decisions_failed
+    return {
+        "pass": pass_no,
+        "seconds": elapsed,
+        "documents": documents,
+        "docs_per_second": documents / elapsed if elapsed else 0.0,
+        "summarized": stats.decisions_processed + stats.decisions_partial,
+        "skipped": stats.decisions_skipped,
+        "failed": stats.decisions_failed,
+        "stages": metrics.stage_summary(),
+        "usage_by_model": stats.usage_by_model,
+        "compaction_tokens_before": stats.tokens_before_compaction,
+        "compaction_tokens_saved": stats.tokens_saved_by_compaction,
+        "db_round_trips": dict(collection.round_trips - round_trips_before),
+        "claim_round_trips": ctx.prefetcher.round_trips,
+        "bulk_flushes": ctx.updates.flushes,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def print_pass(result: Dict[str, Any]):
+    print(f"\n--- Pass {result['pass']}: {result['documents']} documents in {result['seconds']:.2f}s "
+          f"({result['docs_per_second']:.1f} docs/s) ---")
+    print(f"Summarized {result['summarized']}, skipped {result['skipped']}, failed {result['failed']}")
+    for stage, values in sorted(result["stages"].items()):
+        print(f"Stage [{stage}]: p50 {values['p50_seconds'] * 1000:.1f}ms, p95 {values['p95_seconds'] * 1000:.1f}ms, "
+              f"avg input tokens {values['mean_input_tokens']:.0f}")
+    for model, usage in sorted(result["usage_by_model"].items()):
+        print(f"Model [{model}]: {usage['calls']} calls, {usage['input_tokens']} input tokens, ${usage['cost_usd']:.4f} estimated")
+    if result["compaction_tokens_before"]:
+        print(f"Input compaction: {result['compaction_tokens_saved']} of {result['compaction_tokens_before']} decision tokens removed "
+              f"({result['compaction_tokens_saved'] / result['compaction_tokens_before']:.1%})")
+    round_trips = result["db_round_trips"]
+    print(f"DB round trips: {sum(round_trips.values())} ({', '.join(f'{op} {n}' for op, n in sorted(round_trips.items()))}); "
+          f"{result['claim_round_trips']} for claims, {result['bulk_flushes']} bulk update flushes")
+    print(f"Max RSS: {result['max_rss_mb']:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark with a fake model and an in-memory database.")
+    parser.add_argument("--docs", type=int, default=200, help="Synthetic decisions in the corpus.")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds the fake model takes per call.")
+    parser.add_argument("--latency-per-1k-tokens", type=float, default=0.0, help="Extra seconds per 1,000 input tokens.")
+    parser.add_argument("--output-tokens", type=int, default=600, help="Output tokens the fake model reports per call.")
+    parser.add_argument("--responses", help="JSON file of recorded responses by stage (brief, combined, sourcing, issues, holdings).")
+    parser.add_argument("--summary-mode", choices=["multi", "combined"], help="Default: SUMMARY_MODE.")
+    parser.add_argument("--cache", action="store_true", help="Use a fresh summary cache (default: off).")
+    parser.add_argument("--passes", type=int, default=1, help="Runs over the same corpus; later passes hit the cache with --cache.")
+    parser.add_argument("--mongo-url", help="Use a scratch database on this server instead of mongomock.")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="summarizer_benchmark_")
+    os.environ["SUMMARY_CACHE_ENABLED"] = "true" if args.cache else "false"
+    os.environ["SUMMARY_CACHE_PATH"] = os.path.join(work_dir, "summary_cache.sqlite3")
+    # The quota limiter would otherwise measure Gemini's limits, not this code.
+    os.environ.setdefault("GEMINI_RPM_LIMIT", "1000000")
+    os.environ.setdefault("GEMINI_TPM_LIMIT", "1000000000")
+
+    import main as main_module
+    import model_router
+    from mongo_io import ensure_indexes
+
+    main_module.check_settings()
+
+    responses = None
+    if args.responses:
+        with open(args.responses, encoding="utf-8") as f:
+            responses = json.load(f)
+    model_router.use_client(make_replay_model(responses, args.latency, args.latency_per_1k_tokens, args.output_tokens))
+
+    corpus = synthetic_corpus(args.docs, args.seed)
+    sizes = sorted(len(html) for html in corpus)
+    print(f"Corpus: {len(corpus)} decisions, {sum(sizes) / 1e6:.1f} MB of HTML, "
+          f"median {sizes[len(sizes) // 2] / 1000:.0f} KB, max {sizes[-1] / 1000:.0f} KB")
+
+    client, raw_collection = open_collection(args.mongo_url)
+    collection = CountingCollection(raw_collection)
+    ensure_indexes(raw_collection)
+    raw_collection.insert_many([{"_id": i, "is_summarized": False, "html": html} for i, html in enumerate(corpus)])
+    del corpus
+
+    results = []
+    try:
+        for pass_no in range(1, args.passes + 1):
+            if pass_no > 1:
+                raw_collection.update_many({}, {"$set": {"is_summarized": False}, "$unset": {"summary_status": "", "ai_generated_brief": ""}})
+            result = run_pass(main_module, collection, args.workers, args.summary_mode, work_dir, pass_no)
+            print_pass(result)
+            results.append(result)
+    finally:
+        if args.mongo_url:
+            client.drop_database(BENCHMARK_DB_NAME)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"arguments": vars(args), "passes": results}, f, indent=2)
+        print(f"Results saved to: {args.json}")
+
+if __name__ == "__main__":
+    main()
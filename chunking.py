@@ -0,0 +1,157 @@
+# chunking.py
+"""
+Splitting oversized decisions into chunks and merging the per-chunk briefs back into one.
+
+Long Court of Appeals decisions with dissents can exceed the cheaper price tier
+(and sometimes the context window) in a single prompt. The router sends those through
+a chunked map-reduce path instead: split on opinion and section boundaries, brief
+each chunk, merge the partial briefs, and source each item only against the chunk
+it came from.
+"""
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from model_router import PRICE_TIER_TOKEN_THRESHOLD
+from models import LegalBrief, OpinionSummary
+from rate_limiter import estimate_tokens
+
+# Room left for the prompt template and the items JSON of the sourcing calls.
+PROMPT_OVERHEAD_TOKENS = int(os.environ.get("PROMPT_OVERHEAD_TOKENS", "8000"))
+CHUNK_TOKEN_BUDGET = int(os.environ.get("CHUNK_TOKEN_BUDGET", str(PRICE_TIER_TOKEN_THRESHOLD - PROMPT_OVERHEAD_TOKENS)))
+# "auto" picks per document by size; "single" and "chunked" force one path.
+PIPELINE_ROUTING = os.environ.get("PIPELINE_ROUTING", "auto").lower()
+PIPELINE_ROUTINGS = ("auto", "single", "chunked")
+
+# The cleaned text has no newlines left, so boundaries are recognized inline.
+_OPINION_BOUNDARY = re.compile(
+    r"(?=\b[A-Z][A-Za-z'.-]+,\s+(?:J|Ch\.\s*J|P\.\s*J|JJ)\.\s*\((?:dissenting|concurring)"
+    r"|\b(?:DISSENTING|CONCURRING) OPINION\b"
+    r"|\b(?:Dissenting|Concurring) Opinion\b"
+    r"|\b[A-Z][A-Za-z'.-]+,\s+J\.\s*,?\s*(?:dissents|concurs)\b)"
+)
+_SECTION_BOUNDARY = re.compile(r"(?<=[.?!:\]\"])\s+(?=(?:POINT\s+)?[IVX]{1,5}\.\s+[A-Z\[])")
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.?!])\s+(?=[A-Z\[(\"])")
+
+
+def check_pipeline_routing(routing: str) -> str:
+    """Returns `routing` if it is one of PIPELINE_ROUTINGS; raises ValueError otherwise."""
+    if routing not in PIPELINE_ROUTINGS:
+        raise ValueError(f"Unknown PIPELINE_ROUTING '{routing}'. Choose one of: {', '.join(PIPELINE_ROUTINGS)}.")
+    return routing
+
+
+def choose_pipeline(text: str) -> str:
+    """Routes a document to "single" (one full-text prompt per stage) or "chunked" so every call stays under the cheaper tier."""
+    if PIPELINE_ROUTING in ("single", "chunked"):
+        return PIPELINE_ROUTING
+    return "single" if estimate_tokens(text) <= CHUNK_TOKEN_BUDGET else "chunked"
+
+
+def _split_at(pattern: re.Pattern, text: str, start: int, end: int) -> List[Tuple[int, int]]:
+    cuts = [start] + [start + m.start() for m in pattern.finditer(text[start:end]) if m.start() > 0] + [end]
+    return [(a, b) for a, b in zip(cuts, cuts[1:]) if b > a]
+
+
+def _split_span(text: str, start: int, end: int, budget: int, patterns: List[re.Pattern]) -> List[Tuple[int, int]]:
+    """Recursively splits a span with progressively finer boundaries until every piece fits the budget."""
+    if estimate_tokens(text[start:end]) <= budget:
+        return [(start, end)]
+    if not patterns:
+        # No boundary left to use: cut on whitespace near the character estimate.
+        step = max(1, budget * 4)
+        pieces, cursor = [], start
+        while cursor < end:
+            cut = min(end, cursor + step)
+            if cut < end:
+                space = text.rfind(" ", cursor, cut)
+                cut = space if space > cursor else cut
+            pieces.append((cursor, cut))
+            cursor = cut
+        return pieces
+    pieces = []
+    for a, b in _split_at(patterns[0], text, start, end):
+        pieces.extend(_split_span(text, a, b, budget, patterns[1:]))
+    return pieces
+
+
+def split_into_chunks(text: str, budget: int = CHUNK_TOKEN_BUDGET) -> List[str]:
+    """
+    Splits `text` into chunks of at most `budget` tokens. Separate opinions (majority,
+    dissents, concurrences) come first, then numbered sections, then sentences.
+    Adjacent small pieces are packed back together, so the chunk count stays minimal.
+    """
+    pieces = _split_span(text, 0, len(text), budget, [_OPINION_BOUNDARY, _SECTION_BOUNDARY, _SENTENCE_BOUNDARY])
+    chunks, current_start, current_end, current_tokens = [], None, None, 0
+    for a, b in pieces:
+        tokens = estimate_tokens(text[a:b])
+        if current_start is not None and current_tokens + tokens <= budget:
+            current_end, current_tokens = b, current_tokens + tokens
+            continue
+        if current_start is not None:
+            chunks.append(text[current_start:current_end].strip())
+        current_start, current_end, current_tokens = a, b, tokens
+    if current_start is not None:
+        chunks.append(text[current_start:current_end].strip())
+    return [c for c in chunks if c]
+
+
+def _dedupe_key(value: str) -> str:
+    return " ".join(value.lower().split())
+
+
+def merge_briefs(partials: List[LegalBrief]) -> Tuple[LegalBrief, Dict[str, List[int]]]:
+    """
+    Merges per-chunk briefs into one LegalBrief. Returns the merged brief and, for every
+    list field, the chunk index each merged item came from, so sourcing can be limited
+    to that chunk.
+    """
+    origins = {"facts": [], "rationale": [], "issues": [], "holdings": []}
+    facts, rationale, issues, holdings = [], [], [], []
+    seen = {name: set() for name in origins}
+
+    def _add(name, target, item, key, chunk_no):
+        if key and key not in seen[name]:
+            seen[name].add(key)
+            target.append(item)
+            origins[name].append(chunk_no)
+
+    opinions: Dict[Tuple[str, str], OpinionSummary] = {}
+    for chunk_no, brief in enumerate(partials):
+        for fact in brief.brief_step_3_key_facts_takeaways:
+            _add("facts", facts, fact, _dedupe_key(fact), chunk_no)
+        for point in brief.brief_step_7_rationale_takeaways:
+            _add("rationale", rationale, point, _dedupe_key(point), chunk_no)
+        for issue in brief.brief_step_5_issues_as_questions:
+            _add("issues", issues, issue, _dedupe_key(issue), chunk_no)
+        for holding in brief.brief_step_6_holdings_summary:
+            _add("holdings", holdings, holding, _dedupe_key(holding.issue_question), chunk_no)
+        for opinion in brief.brief_step_9_other_opinions_summary or []:
+            key = (_dedupe_key(opinion.opinion_type), _dedupe_key(opinion.author_judge or ""))
+            if key in opinions:
+                existing = opinions[key]
+                existing.summary_of_analysis.extend(
+                    p for p in opinion.summary_of_analysis if p not in existing.summary_of_analysis
+                )
+            else:
+                opinions[key] = opinion.model_copy(deep=True)
+
+    first = partials[0]
+    procedural = next((b.brief_step_4_procedural_history for b in partials if b.brief_step_4_procedural_history.strip()), "")
+    dispositions = [b.brief_step_8_disposition.strip() for b in partials if b.brief_step_8_disposition.strip()]
+    # The most common disposition across chunks wins; ties go to the earliest chunk.
+    disposition = Counter(dispositions).most_common(1)[0][0] if dispositions else first.brief_step_8_disposition
+
+    merged = LegalBrief(
+        brief_step_1_format_note=first.brief_step_1_format_note,
+        brief_step_2_caption=first.brief_step_2_caption,
+        brief_step_3_key_facts_takeaways=facts,
+        brief_step_4_procedural_history=procedural,
+        brief_step_5_issues_as_questions=issues,
+        brief_step_6_holdings_summary=holdings,
+        brief_step_7_rationale_takeaways=rationale,
+        brief_step_8_disposition=disposition,
+        brief_step_9_other_opinions_summary=list(opinions.values()) or None,
+    )
+    return merged, origins
@@ -0,0 +1,136 @@
+# cleaners.py
+"""
+HTML-to-text cleaners, selected with CLEANER_BACKEND.
+
+- "eyecite" (default): `eyecite.clean_text(html, ['html', 'all_whitespace'])`. This parses
+  the whole document into an lxml tree, collects its visible text nodes, joins them and
+  collapses whitespace with a regex over the joined string.
+- "streaming": feeds the HTML through an lxml parser target without building a tree.
+  It keeps the same text nodes and collapses whitespace as each node arrives, so the
+  only large allocation is the output itself. The output is identical to eyecite's.
+
+`bench_cleaners.py` checks that the backends agree and measures their throughput and memory.
+"""
+import os
+import re
+from typing import Callable, Dict
+
+CLEANER_BACKEND = os.environ.get("CLEANER_BACKEND", "eyecite").lower()
+STREAMING_FEED_CHARS = 64 * 1024
+
+# Same as eyecite.clean.all_whitespace.
+WHITESPACE = re.compile(r"[\u200b\s]+")
+# XPath's normalize-space() only treats these as whitespace.
+_XPATH_WHITESPACE = " \t\r\n"
+
+
+class VisibleTextTarget:
+    """
+    lxml parser target keeping the text nodes eyecite's `html` cleaner keeps: text that is not a
+    direct child of style/link/head/page-number/script or of a star-pagination element.
+    Text is only committed to `nodes` once the next event shows the text node is complete.
+    """
+
+    _HIDDEN_PARENTS = {"style", "link", "head", "page-number", "script"}
+
+    def __init__(self):
+        self.nodes = []
+        self.elements = 0
+        self._hidden = []
+        self._pending = []
+
+    def _flush(self):
+        if not self._pending:
+            return
+        text = "".join(self._pending)
+        self._pending = []
+        # Text outside any element (e.g. after a stray end tag at the start) never reaches lxml's tree.
+        if text.strip(_XPATH_WHITESPACE) and self._hidden and not self._hidden[-1]:
+            self._emit(text)
+
+    def _emit(self, text: str):
+        self.nodes.append(text)
+
+    def start(self, tag, attrib):
+        self._flush()
+        self.elements += 1
+        self._hidden.append(tag in self._HIDDEN_PARENTS or attrib.get("class") == "star-pagination")
+
+    def end(self, tag):
+        self._flush()
+        if self._hidden:
+            self._hidden.pop()
+
+    def data(self, data):
+        self._pending.append(data)
+
+    def comment(self, text):
+        self._flush()
+
+    def pi(self, target, data=None):
+        self._flush()
+
+    def close(self):
+        self._flush()
+        return " ".join(self.nodes)
+
+
+class _CollapsingTextTarget(VisibleTextTarget):
+    """Collapses whitespace node by node, producing `WHITESPACE.sub(" ", " ".join(nodes))` directly."""
+
+    def __init__(self):
+        super().__init__()
+        self._trailing_space = False
+
+    def _emit(self, text: str):
+        text = WHITESPACE.sub(" ", text)
+        if self.nodes:
+            # The joining space merges with whitespace on either side of it.
+            if text.startswith(" "):
+                text = text[1:]
+            if not self._trailing_space:
+                text = " " + text
+        if text:
+            self.nodes.append(text)
+            self._trailing_space = text.endswith(" ")
+
+    def close(self):
+        self._flush()
+        return "".join(self.nodes)
+
+
+def clean_html_eyecite(html: str) -> str:
+    from eyecite import clean_text
+    return clean_text(html, ['html', 'all_whitespace'])
+
+
+def clean_html_streaming(html: str) -> str:
+    from lxml import etree
+
+    target = _CollapsingTextTarget()
+    parser = etree.HTMLParser(target=target)
+    for offset in range(0, len(html), STREAMING_FEED_CHARS):
+        parser.feed(html[offset:offset + STREAMING_FEED_CHARS])
+    try:
+        text = parser.close()
+    except etree.XMLSyntaxError:
+        if target.elements:
+            raise
+    if not target.elements:
+        # lxml.html raises on documents without any element; keep the same behaviour.
+        raise etree.ParserError("Document is empty")
+    return text
+
+
+CLEANERS: Dict[str, Callable[[str], str]] = {
+    "eyecite": clean_html_eyecite,
+    "streaming": clean_html_streaming,
+}
+
+
+def get_cleaner(name: str = None) -> Callable[[str], str]:
+    """Returns the cleaner for `name` (default: CLEANER_BACKEND)."""
+    name = name or CLEANER_BACKEND
+    if name not in CLEANERS:
+        raise ValueError(f"Unknown CLEANER_BACKEND '{name}'. Choose one of: {', '.join(CLEANERS)}.")
+    return CLEANERS[name]
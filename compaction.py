@@ -0,0 +1,178 @@
+# compaction.py
+"""
+Input compaction: shrinks a cleaned decision before it reaches the LLM.
+
+Slip opinions carry text that costs tokens without helping the brief: the Law Reporting
+Bureau's publication notices, star-paging and footnote markers, running headers repeated on
+every page and long string cites. Each rule in COMPACTION_RULES finds spans to drop:
+
+- "boilerplate": publication and navigation notices (BOILERPLATE_PATTERNS);
+- "markers": star-paging ("[*3]") and footnote ("[FN2]") markers;
+- "repeats" (opt-in): a sentence that occurs COMPACTION_REPEAT_MIN or more times is kept only where it
+  first appears. A court's recurring formula ("The judgment is affirmed.") can be dropped along with
+  running headers, so it is off by default;
+- "citations" (opt-in): a run of more than COMPACTION_MAX_CITATIONS back-to-back case citations,
+  as found by eyecite, is cut after the first COMPACTION_MAX_CITATIONS.
+
+Rules only ever delete, so the compacted text is the original's kept spans joined together,
+and every offset in it maps back to the original text. `QuoteIndex` uses that map to report
+quote offsets against the `clean_html` output, as it did before compaction existed.
+`check_rules` rejects unknown rule names; main.py calls it at startup.
+"""
+import bisect
+import hashlib
+import os
+import re
+from typing import Dict, List, Tuple
+
+from rate_limiter import estimate_tokens
+
+COMPACTION_ENABLED = os.environ.get("COMPACTION_ENABLED", "true").lower() == "true"
+COMPACTION_RULES = [r.strip() for r in os.environ.get("COMPACTION_RULES", "boilerplate,markers").split(",") if r.strip()]
+COMPACTION_REPEAT_MIN = int(os.environ.get("COMPACTION_REPEAT_MIN", "3"))
+COMPACTION_MAX_CITATIONS = int(os.environ.get("COMPACTION_MAX_CITATIONS", "2"))
+
+# Repeated sentences outside these lengths are left alone: very short ones ("So ordered.")
+# are not worth tracking, and very long ones are almost never running headers.
+_REPEAT_MIN_CHARS = 30
+_REPEAT_MAX_CHARS = 300
+
+BOILERPLATE_PATTERNS = [
+    r"This opinion is uncorrected and (?:subject to revision before publication in the Official Reports"
+    r"|will not be published in the printed Official Reports)\.",
+    r"Published by New York State Law Reporting Bureau pursuant to Judiciary Law § 431\.",
+    r"Return to Decision List",
+]
+_BOILERPLATE = re.compile(r"\s*(?:" + "|".join(BOILERPLATE_PATTERNS) + r")", re.IGNORECASE)
+_MARKERS = re.compile(r" ?\[(?:\*\d+|FN\d+)\]")
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.?!])\s+")
+# What may separate two citations of the same string cite: a semicolon or comma and an introductory signal.
+_CITATION_TAIL = re.compile(r"(?:,\s*\d[\d\-\u2013]*(?:\s*n\s*\d+)?)*(?:\s*[\[(][^\[\]()]{0,40}\d{4}[\])])?")
+_CITATION_SEPARATOR = re.compile(r"\s*[;,]\s*(?:(?:see also|see|but see|cf\.|accord|compare|contra)\s+)?", re.IGNORECASE)
+
+
+class CompactedText:
+    """The compacted text of one decision, with the map from its offsets back to the original."""
+
+    def __init__(self, original: str, kept_spans: List[Tuple[int, int]], removed_chars: Dict[str, int]):
+        self.original = original
+        self.spans = kept_spans
+        self.text = "".join(original[s:e] for s, e in kept_spans)
+        self.removed_chars = removed_chars
+        self._starts = []
+        position = 0
+        for s, e in kept_spans:
+            self._starts.append(position)
+            position += e - s
+
+    def to_original(self, offset: int) -> int:
+        """The original offset of the compacted character at `offset`."""
+        if not self.spans:
+            return offset
+        i = max(bisect.bisect_right(self._starts, offset) - 1, 0)
+        return self.spans[i][0] + (offset - self._starts[i])
+
+    def to_original_span(self, start: int, end: int) -> Tuple[int, int]:
+        """Maps a [start, end) span of the compacted text back to the original text."""
+        return self.to_original(start), self.to_original(end - 1) + 1
+
+    def report(self) -> Dict[str, object]:
+        """Token and character savings, for `DocumentTrace.extra`."""
+        tokens_before = estimate_tokens(self.original)
+        tokens_after = estimate_tokens(self.text)
+        return {
+            "tokens_before": tokens_before,
+            "tokens_after": tokens_after,
+            "tokens_saved": tokens_before - tokens_after,
+            "removed_chars": dict(self.removed_chars),
+        }
+
+
+# --- Rules ---
+# Each rule returns the (start, end) spans of the original text it would delete.
+
+def _boilerplate_spans(text: str) -> List[Tuple[int, int]]:
+    return [m.span() for m in _BOILERPLATE.finditer(text)]
+
+
+def _marker_spans(text: str) -> List[Tuple[int, int]]:
+    return [m.span() for m in _MARKERS.finditer(text)]
+
+
+def _repeat_spans(text: str) -> List[Tuple[int, int]]:
+    # Each sentence is deleted together with the whitespace in front of it.
+    boundaries = [(0, 0)] + [m.span() for m in _SENTENCE_BOUNDARY.finditer(text)] + [(len(text), len(text))]
+    seen: Dict[str, List[Tuple[int, int]]] = {}
+    for (gap_start, start), (end, _) in zip(boundaries, boundaries[1:]):
+        if not _REPEAT_MIN_CHARS <= end - start <= _REPEAT_MAX_CHARS:
+            continue
+        # Page markers inside a running header would otherwise make every copy look different.
+        key = _MARKERS.sub("", text[start:end]).lower()
+        seen.setdefault(key, []).append((gap_start, end))
+    return [span for spans in seen.values() if len(spans) >= COMPACTION_REPEAT_MIN for span in spans[1:]]
+
+
+def _citation_spans(text: str) -> List[Tuple[int, int]]:
+    from eyecite import get_citations
+    from eyecite.models import FullCaseCitation
+
+    # eyecite raises on an empty document.
+    if not text:
+        return []
+    runs: List[List[Tuple[int, int]]] = []
+    for citation in get_citations(text):
+        if not isinstance(citation, FullCaseCitation):
+            continue
+        # eyecite's full_span() can run on past a closing parenthesis, so the end is found here instead.
+        end = _CITATION_TAIL.match(text, citation.span()[1]).end()
+        span = (citation.full_span()[0], end)
+        if runs and _CITATION_SEPARATOR.fullmatch(text, runs[-1][-1][1], span[0]):
+            runs[-1].append(span)
+        else:
+            runs.append([span])
+    return [(run[COMPACTION_MAX_CITATIONS - 1][1], run[-1][1]) for run in runs if len(run) > COMPACTION_MAX_CITATIONS]
+
+
+_RULES = {
+    "boilerplate": _boilerplate_spans,
+    "markers": _marker_spans,
+    "repeats": _repeat_spans,
+    "citations": _citation_spans,
+}
+
+# Part of every cache key when compaction is on, so briefs of compacted and uncompacted text never mix.
+COMPACTION_FINGERPRINT = hashlib.sha256(
+    repr((COMPACTION_RULES, COMPACTION_REPEAT_MIN, COMPACTION_MAX_CITATIONS, _REPEAT_MIN_CHARS, _REPEAT_MAX_CHARS,
+          BOILERPLATE_PATTERNS, _MARKERS.pattern, _CITATION_TAIL.pattern, _CITATION_SEPARATOR.pattern)).encode("utf-8")
+).hexdigest()[:16]
+
+
+def check_rules():
+    """Raises ValueError if COMPACTION_RULES names a rule that does not exist."""
+    unknown = [name for name in COMPACTION_RULES if name not in _RULES]
+    if unknown:
+        raise ValueError(f"Unknown COMPACTION_RULES {', '.join(unknown)}. Choose from: {', '.join(_RULES)}.")
+
+
+def compact(text: str, enabled: bool = None) -> CompactedText:
+    """Applies COMPACTION_RULES to `text`. With compaction disabled, the text is kept whole."""
+    enabled = COMPACTION_ENABLED if enabled is None else enabled
+    if enabled:
+        check_rules()
+    removed = []
+    removed_chars = {}
+    for name in (COMPACTION_RULES if enabled else []):
+        spans = _RULES[name](text)
+        removed.extend(spans)
+        removed_chars[name] = sum(e - s for s, e in spans)
+
+    # Rules are run on the original text independently, so their spans may overlap.
+    kept = []
+    position = 0
+    for start, end in sorted(removed):
+        if start > position:
+            kept.append((position, start))
+        position = max(position, end)
+    if position < len(text):
+        kept.append((position, len(text)))
+    return CompactedText(text, kept, removed_chars)
@@ -0,0 +1,162 @@
+# daemon.py
+"""
+Daemon mode (`main.py run --daemon`): keep the worker pool alive once the backlog is drained.
+
+`DecisionWatcher` wakes the prefetcher when decisions are inserted or reset to
+`is_summarized: false`. It watches a MongoDB change stream and checkpoints the stream's
+resume token in a side collection, so a restart picks up where the last run stopped
+instead of missing or rescanning events. Standalone servers have no change streams; there
+the watcher falls back to polling. Either way the prefetcher also re-checks periodically,
+because expired leases of crashed workers produce no change event.
+
+`install_stop_handlers` turns SIGTERM/SIGINT into a graceful drain: no new claims, in-flight
+documents finish, queued claims are released and buffered writes are flushed. A second signal
+releases every claim, flushes and exits without waiting for in-flight documents.
+"""
+import os
+import signal
+import sys
+import threading
+import time
+from typing import Callable, Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+DAEMON_POLL_SECONDS = float(os.environ.get("DAEMON_POLL_SECONDS", "5"))
+DAEMON_RECHECK_SECONDS = float(os.environ.get("DAEMON_RECHECK_SECONDS", "60"))
+DAEMON_CHECKPOINT_COLLECTION = os.environ.get("DAEMON_CHECKPOINT_COLLECTION", "summarizer_checkpoints")
+DAEMON_ID = os.environ.get("DAEMON_ID", "default")
+CHECKPOINT_INTERVAL_SECONDS = 5
+# How long a second signal waits for claims to be released and writes flushed before exiting anyway.
+FORCED_EXIT_TIMEOUT_SECONDS = 10
+
+# "The $changeStream stage is only supported on replica sets"
+_CHANGE_STREAMS_UNSUPPORTED = {40573}
+# The checkpointed token is unusable (invalid, or older than the oplog).
+_RESUME_TOKEN_UNUSABLE = {260, 280, 286}
+
+# New decisions, and decisions reset for another attempt. Only the fields needed here are
+# shipped, so inserts do not carry their HTML over the stream.
+CHANGE_PIPELINE = [
+    {"$match": {"$or": [
+        {"operationType": "insert", "fullDocument.is_summarized": {"$ne": True}},
+        {"operationType": "update", "updateDescription.updatedFields.is_summarized": False},
+        {"operationType": "replace", "fullDocument.is_summarized": False},
+    ]}},
+    {"$project": {"operationType": 1, "documentKey": 1, "fullDocument._id": 1, "fullDocument.is_summarized": 1}},
+]
+
+
+class DecisionWatcher:
+    """Signals the prefetcher when new work may have arrived. `wait_for_work` is its prefetcher hook."""
+
+    def __init__(self, decisions_collection, stop_event: threading.Event):
+        self.decisions_collection = decisions_collection
+        self.checkpoints = decisions_collection.database[DAEMON_CHECKPOINT_COLLECTION]
+        self.checkpoint_id = f"{decisions_collection.name}:{DAEMON_ID}"
+        self.stop_event = stop_event
+        self.mode = "starting"
+        self.events = 0
+        self._wake = threading.Event()
+        self._announced = False
+        self._thread = threading.Thread(target=self._run, name="decision-watcher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def wait_for_work(self):
+        """Blocks until a change event arrives, the re-check interval passes or the run stops."""
+        if not self._announced:
+            print(f"No more pending decisions to claim. Waiting for new ones ({self.mode.replace('_', ' ')}).")
+            self._announced = True
+        timeout = DAEMON_RECHECK_SECONDS if self.mode == "change_stream" else DAEMON_POLL_SECONDS
+        deadline = time.monotonic() + timeout
+        while not self.stop_event.is_set() and time.monotonic() < deadline:
+            if self._wake.wait(min(1.0, max(0.0, deadline - time.monotonic()))):
+                break
+        self._wake.clear()
+        if self.mode == "polling":
+            # Without a change stream, inserted decisions lacking the flag are only found this way.
+            from mongo_io import backfill_new_decisions
+            backfill_new_decisions(self.decisions_collection)
+
+    # --- Change stream ---
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                self._watch()
+            except OperationFailure as e:
+                if e.code in _CHANGE_STREAMS_UNSUPPORTED:
+                    print(f"Change streams are unavailable on this server; polling every {DAEMON_POLL_SECONDS:g}s instead.")
+                    self.mode = "polling"
+                    return
+                if e.code in _RESUME_TOKEN_UNUSABLE:
+                    # Nothing is lost: the prefetcher claims by database state, not by events.
+                    print(f"Resume token checkpoint is no longer usable ({e}); starting a new change stream.")
+                    self.checkpoints.delete_one({"_id": self.checkpoint_id})
+                    continue
+                print(f"ERROR in change stream, retrying: {e}")
+            except PyMongoError as e:
+                print(f"ERROR in change stream, retrying: {e}")
+            self.mode = "polling"
+            self.stop_event.wait(DAEMON_POLL_SECONDS)
+
+    def _watch(self):
+        checkpoint = self.checkpoints.find_one({"_id": self.checkpoint_id})
+        resume_token = checkpoint["resume_token"] if checkpoint else None
+        with self.decisions_collection.watch(CHANGE_PIPELINE, resume_after=resume_token, max_await_time_ms=1000) as stream:
+            self.mode = "change_stream"
+            print("Watching for new decisions with a change stream" + (" (resumed from checkpoint)." if resume_token else "."))
+            saved_at = time.monotonic()
+            while not self.stop_event.is_set():
+                change = stream.try_next()
+                if change:
+                    self._on_change(change)
+                # The post-batch token advances even when no matching event arrives.
+                if stream.resume_token and (change or time.monotonic() - saved_at >= CHECKPOINT_INTERVAL_SECONDS):
+                    self._save_checkpoint(stream.resume_token)
+                    saved_at = time.monotonic()
+
+    def _on_change(self, change):
+        self.events += 1
+        document = change.get("fullDocument") or {}
+        if change["operationType"] == "insert" and "is_summarized" not in document:
+            # Decisions inserted without the flag would never be claimed; give them the default that 'migrate' gives older ones.
+            self.decisions_collection.update_one(
+                {"_id": change["documentKey"]["_id"], "is_summarized": {"$exists": False}},
+                {"$set": {"is_summarized": False}}
+            )
+        self._wake.set()
+
+    def _save_checkpoint(self, resume_token):
+        self.checkpoints.update_one(
+            {"_id": self.checkpoint_id},
+            {"$set": {"resume_token": resume_token, "updated_at": time.time()}},
+            upsert=True
+        )
+
+
+def install_stop_handlers(stop_event: threading.Event, on_forced_exit: Optional[Callable[[], None]] = None):
+    """
+    SIGTERM and SIGINT stop claiming and let in-flight documents finish. A second signal runs
+    `on_forced_exit` (release claims, flush writes) and ends the process with status 1 at once.
+    Raising SystemExit would not do: the worker pool and interpreter exit both wait for the workers.
+    """
+
+    def _handle(signum, frame):
+        if stop_event.is_set():
+            print(f"Received a second {signal.Signals(signum).name}. Releasing claims and exiting without waiting for in-flight documents.")
+            if on_forced_exit:
+                # On its own thread, in case the signal interrupted the main thread while it held a lock the cleanup needs.
+                cleanup = threading.Thread(target=on_forced_exit, name="forced-exit", daemon=True)
+                cleanup.start()
+                cleanup.join(FORCED_EXIT_TIMEOUT_SECONDS)
+            sys.stdout.flush()
+            os._exit(1)
+        print(f"Received {signal.Signals(signum).name}. Finishing in-flight documents, then shutting down...")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, _handle)
+    signal.signal(signal.SIGINT, _handle)
@@ -0,0 +1,192 @@
+# instrumentation.py
+"""
+Per-document timing and token accounting, exported as JSONL records plus an
+aggregated Prometheus text-format metrics file.
+"""
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+QUANTILES = (0.5, 0.95)
+
+# Rewrite the Prometheus file after this many documents, so it stays fresh during long runs.
+PROMETHEUS_WRITE_EVERY_N_DOCS = 25
+
+
+class DocumentTrace:
+    """Collects stage latencies and LLM token usage for one document. Safe to share between threads."""
+
+    def __init__(self, doc_id: Any = None):
+        self.doc_id = doc_id
+        self.started_at = time.time()
+        self.status: Optional[str] = None
+        self.stages: Dict[str, Dict[str, float]] = defaultdict(
+            lambda: {"seconds": 0.0, "input_tokens": 0, "output_tokens": 0, "calls": 0}
+        )
+        self.llm_calls: List[Dict[str, Any]] = []
+        self.extra: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Times the enclosed block and adds it to the stage's total."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stages[name]["seconds"] += elapsed
+
+    def record_llm_call(self, stage: str, input_tokens: int, output_tokens: int, model: Optional[str] = None):
+        with self._lock:
+            entry = self.stages[stage]
+            entry["input_tokens"] += input_tokens
+            entry["output_tokens"] += output_tokens
+            entry["calls"] += 1
+            self.llm_calls.append({
+                "stage": stage, "model": model,
+                "input_tokens": input_tokens, "output_tokens": output_tokens,
+            })
+
+    def totals(self) -> Dict[str, int]:
+        """Token totals in the shape `generate_structured_brief` has always returned."""
+        with self._lock:
+            return {
+                "prompt_token_count": sum(c["input_tokens"] for c in self.llm_calls),
+                "candidates_token_count": sum(c["output_tokens"] for c in self.llm_calls),
+            }
+
+    def to_record(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "doc_id": str(self.doc_id),
+                "status": self.status,
+                "started_at": self.started_at,
+                "total_seconds": time.time() - self.started_at,
+                "stages": {name: dict(values) for name, values in self.stages.items()},
+                "llm_calls": list(self.llm_calls),
+                **self.extra,
+            }
+
+
+def _quantile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, math.ceil(q * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+class MetricsRecorder:
+    """Appends one JSONL record per document and maintains the aggregated Prometheus metrics file."""
+
+    def __init__(self, jsonl_path: str, prometheus_path: str):
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._latencies = defaultdict(list)
+        self._input_tokens = defaultdict(list)
+        self._output_tokens = defaultdict(list)
+        self._doc_seconds: List[float] = []
+        self._status_counts = defaultdict(int)
+        self._flush_seconds: List[float] = []
+        self._flushed_operations = 0
+        self._records_since_write = 0
+        # Opened on the first record and kept open, like the run log (see mongo_io.RunLogAppender).
+        self._jsonl = None
+        self._closed = False
+
+    def record(self, trace: DocumentTrace):
+        record = trace.to_record()
+        with self._lock:
+            if not self._closed:
+                if self._jsonl is None:
+                    self._jsonl = open(self.jsonl_path, "a", buffering=64 * 1024)
+                self._jsonl.write(json.dumps(record, default=str) + "\n")
+            self._status_counts[record["status"] or "unknown"] += 1
+            self._doc_seconds.append(record["total_seconds"])
+            for name, values in record["stages"].items():
+                self._latencies[name].append(values["seconds"])
+                if values["calls"]:
+                    self._input_tokens[name].append(values["input_tokens"])
+                    self._output_tokens[name].append(values["output_tokens"])
+            self._records_since_write += 1
+            should_write = self._records_since_write >= PROMETHEUS_WRITE_EVERY_N_DOCS
+        if should_write:
+            self.write_prometheus()
+
+    def record_db_flush(self, seconds: float, operations: int):
+        """Times one bulk write of buffered status updates. These are per flush, not per document."""
+        with self._lock:
+            self._flush_seconds.append(seconds)
+            self._flushed_operations += operations
+
+    def close(self):
+        """Closes the JSONL file. Later records still count towards the Prometheus metrics."""
+        with self._lock:
+            self._closed = True
+            if self._jsonl is not None:
+                self._jsonl.close()
+                self._jsonl = None
+
+    def write_prometheus(self):
+        """Writes summaries (p50/p95, sum, count) per stage in Prometheus text exposition format."""
+        with self._lock:
+            self._records_since_write = 0
+            lines = []
+            lines += _summary_lines("summarizer_stage_latency_seconds", "Wall time spent in each pipeline stage per document.", self._latencies)
+            lines += _summary_lines("summarizer_stage_input_tokens", "LLM input tokens per stage per document.", self._input_tokens)
+            lines += _summary_lines("summarizer_stage_output_tokens", "LLM output tokens per stage per document.", self._output_tokens)
+            lines += _summary_lines("summarizer_document_seconds", "End-to-end processing time per document.", {"": self._doc_seconds})
+            lines += _summary_lines("summarizer_db_flush_seconds", "Latency of each bulk write of buffered status updates.", {"": self._flush_seconds})
+            lines.append("# HELP summarizer_db_flushed_operations_total Status updates written by bulk flushes.")
+            lines.append("# TYPE summarizer_db_flushed_operations_total counter")
+            lines.append(f"summarizer_db_flushed_operations_total {self._flushed_operations}")
+            lines.append("# HELP summarizer_documents_total Documents processed, by final status.")
+            lines.append("# TYPE summarizer_documents_total counter")
+            for status, count in sorted(self._status_counts.items()):
+                lines.append(f'summarizer_documents_total{{status="{status}"}} {count}')
+            body = "\n".join(lines) + "\n"
+        tmp_path = self.prometheus_path + ".tmp"
+        with self._write_lock:
+            with open(tmp_path, "w") as f:
+                f.write(body)
+            # Atomic replace, so a textfile collector never reads a half-written file.
+            os.replace(tmp_path, self.prometheus_path)
+
+    def stage_summary(self) -> Dict[str, Dict[str, float]]:
+        """p50/p95 latency and mean tokens per stage, for the end-of-run report."""
+        with self._lock:
+            summary = {}
+            for name, values in self._latencies.items():
+                ordered = sorted(values)
+                tokens = self._input_tokens.get(name, [])
+                summary[name] = {
+                    "p50_seconds": _quantile(ordered, 0.5),
+                    "p95_seconds": _quantile(ordered, 0.95),
+                    "mean_input_tokens": sum(tokens) / len(tokens) if tokens else 0.0,
+                }
+            if self._flush_seconds:
+                ordered = sorted(self._flush_seconds)
+                summary["db_flush"] = {"p50_seconds": _quantile(ordered, 0.5), "p95_seconds": _quantile(ordered, 0.95),
+                                       "mean_input_tokens": 0.0}
+            return summary
+
+
+def _summary_lines(metric: str, help_text: str, samples_by_stage: Dict[str, List[float]]) -> List[str]:
+    lines = [f"# HELP {metric} {help_text}", f"# TYPE {metric} summary"]
+    for stage, samples in sorted(samples_by_stage.items()):
+        ordered = sorted(samples)
+        label = f'stage="{stage}",' if stage else ""
+        for q in QUANTILES:
+            lines.append(f'{metric}{{{label}quantile="{q}"}} {_quantile(ordered, q)}')
+        suffix = f'{{stage="{stage}"}}' if stage else ""
+        lines.append(f"{metric}_sum{suffix} {sum(ordered)}")
+        lines.append(f"{metric}_count{suffix} {len(ordered)}")
+    return lines
@@ -1,165 +1,604 @@
 # main.py (FINAL, CORRECTED INDENTATION)
+import argparse
 import os
+import socket
+import threading
 import pymongo
 import time
 from datetime import datetime
-from eyecite import clean_text
-from summarizer_logic import generate_structured_brief
+from concurrent.futures import ThreadPoolExecutor
+from chunking import PIPELINE_ROUTING, check_pipeline_routing
+from cleaners import get_cleaner
+from compaction import COMPACTION_ENABLED, check_rules
+from daemon import DecisionWatcher, install_stop_handlers
+from instrumentation import DocumentTrace, MetricsRecorder
+from rate_limiter import RateLimitExhausted, get_scheduler
+from quote_index import QUOTE_SOURCING_MODE, check_quote_sourcing_mode
+from model_router import SUMMARY_MODE, SUMMARY_MODES, check_summary_mode, document_cost, model_usage
+from mongo_io import (
+    RELEASE_CLAIM, BulkUpdateBuffer, LeaseLost, PendingPrefetcher, RunLogAppender,
+    backfill_new_decisions, backfill_summarized_flag, claim_batch, claim_filter, ensure_indexes, missing_indexes, reclaim_decisions,
+    reset_failed_decisions
+)
+from summary_cache import get_summary_cache
+from triage import CRIMINAL_CAPTION_PREFIXES, run_triage, triage_html
+# eyecite, langchain and the Gemini clients are imported where they are first needed,
+# so that 'migrate' and 'health' (and the wait for the first claim) start in well under a second.
+
+# Per-model pricing lives in model_router.py, next to the routing that picks the model.
+
+# Worker pool configuration. Any number of processes/containers can run side by side:
+# documents are claimed atomically with a lease, so no two workers summarize the same one.
+# Claims are made in small batches by a prefetcher (see mongo_io.py) and handed to the workers.
+NUM_WORKERS = int(os.environ.get("NUM_WORKERS", "4"))
+CLAIM_LEASE_SECONDS = int(os.environ.get("CLAIM_LEASE_SECONDS", "900"))
+
+# Batch mode: documents per batch run, and a lease long enough to cover the batch service's turnaround.
+BATCH_SIZE = int(os.environ.get("BATCH_SIZE", "1000"))
+BATCH_LEASE_SECONDS = int(os.environ.get("BATCH_LEASE_SECONDS", str(48 * 3600)))
+BATCH_PRICE_DISCOUNT = 0.5
+
 
 def clean_html(html: str) -> str:
     """
-    Use eyecite's cleaner to strip HTML tags and normalize whitespace.
+    Strip HTML tags and normalize whitespace with the configured cleaner (see cleaners.py; eyecite by default).
+    """
+    return get_cleaner()(html)
+
+
+def check_settings():
+    """
+    Fails fast on a misspelled setting. Otherwise every claimed decision would hit the same
+    error and be marked failed.
+    """
+    try:
+        get_cleaner()
+        check_summary_mode(SUMMARY_MODE)
+        check_quote_sourcing_mode(QUOTE_SOURCING_MODE)
+        check_pipeline_routing(PIPELINE_ROUTING)
+        if COMPACTION_ENABLED:
+            check_rules()
+    except ValueError as e:
+        print(f"FATAL: {e}")
+        raise SystemExit(1)
+
+
+def is_criminal_case(cleaned_text: str) -> bool:
+    """Criminal Case Filter: the caption must start with "People v" or "The People of the State of New York v"."""
+    normalized_start = cleaned_text.strip().lower()
+    return normalized_start.startswith(CRIMINAL_CAPTION_PREFIXES)
+
+
+class RunStats:
+    """Thread-safe counters shared by all workers of one run."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total_cost = 0.0
+        self.decisions_processed = 0
+        self.decisions_skipped = 0
+        self.decisions_failed = 0
+        self.decisions_deferred = 0
+        self.decisions_partial = 0
+        self.usage_by_model = {}
+        self.tokens_before_compaction = 0
+        self.tokens_saved_by_compaction = 0
+
+    def record_skip(self):
+        with self.lock:
+            self.decisions_skipped += 1
+
+    def record_success(self, run_cost: float):
+        with self.lock:
+            self.decisions_processed += 1
+            self.total_cost += run_cost
+
+    def record_partial(self, run_cost: float):
+        with self.lock:
+            self.decisions_partial += 1
+            self.total_cost += run_cost
+
+    def record_model_usage(self, llm_calls, price_factor: float = 1.0):
+        """Adds a document's calls to the per-model totals; `price_factor` scales the cost (batch discount)."""
+        with self.lock:
+            for model, usage in model_usage(llm_calls).items():
+                totals = self.usage_by_model.setdefault(model, {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0})
+                for key, value in usage.items():
+                    totals[key] += value * price_factor if key == "cost_usd" else value
+
+    def record_compaction(self, report):
+        """Adds a document's `trace.extra["compaction"]` report, if it has one."""
+        if report:
+            with self.lock:
+                self.tokens_before_compaction += report["tokens_before"]
+                self.tokens_saved_by_compaction += report["tokens_saved"]
+
+    def record_failure(self):
+        with self.lock:
+            self.decisions_failed += 1
+
+    def record_deferred(self):
+        with self.lock:
+            self.decisions_deferred += 1
+
+
+class RunContext:
+    """Everything a worker needs for one run: the collection, credentials, counters and outputs."""
+
+    def __init__(self, decisions_collection, gemini_api_key, log_filepath, metrics: MetricsRecorder, summary_mode=None):
+        self.decisions_collection = decisions_collection
+        self.gemini_api_key = gemini_api_key
+        self.summary_mode = summary_mode
+        self.run_log = RunLogAppender(log_filepath)
+        self.updates = BulkUpdateBuffer(decisions_collection, on_flush=metrics.record_db_flush)
+        self.metrics = metrics
+        self.stats = RunStats()
+        self.stop_event = threading.Event()
+        self.prefetcher = None
+        # Decisions workers are processing right now, by _id; released on a forced exit.
+        self.in_flight = {}
+        self._in_flight_lock = threading.Lock()
+
+    def start_decision(self, decision):
+        with self._in_flight_lock:
+            self.in_flight[decision["_id"]] = decision
+
+    def finish_decision(self, decision):
+        with self._in_flight_lock:
+            self.in_flight.pop(decision["_id"], None)
+
+    def close(self):
+        """Flushes buffered updates, the run log and the metrics JSONL."""
+        self.updates.close()
+        self.run_log.close()
+        self.metrics.close()
+
+    def abandon(self):
+        """
+        Forced exit: hands every claimed decision back, in flight or still queued, and flushes.
+        Stage checkpoints stay, so the next claim resumes each decision where it stopped.
+        """
+        with self._in_flight_lock:
+            claimed = list(self.in_flight.values())
+        if self.prefetcher:
+            claimed += self.prefetcher.drain_unprocessed()
+        for decision in claimed:
+            self.updates.update_one(claim_filter(decision), RELEASE_CLAIM)
+        print(f"Released {len(claimed)} claimed decisions.")
+        self.close()
+
+
+def process_decision(decision, ctx: RunContext, trace: DocumentTrace):
+    """
+    Filters, summarizes and saves a single claimed decision.
+    Every exit path writes a final status and releases the claim.
     """
-    return clean_text(html, ['html', 'all_whitespace'])
+    doc_id = decision['_id']
+    claim = claim_filter(decision)
+    print(f"Processing document ID: {doc_id}")
+
+    raw_html = decision.get("html")
+    if not raw_html:
+        raise ValueError("Document is missing the 'raw_html_text' field.")
+
+    # Criminal Case Filter, decided from the caption before the whole decision is cleaned
+    with trace.stage("filter"):
+        criminal = triage_html(raw_html)
+
+    if criminal is not False:
+        with trace.stage("clean"):
+            cleaned_text = clean_html(raw_html)
+        if criminal is None:
+            criminal = is_criminal_case(cleaned_text)
+
+    if not criminal:
+        print(f"--> SKIPPING: Document {doc_id} is not a criminal case.")
+        # Buffered: the bulk_write itself is timed as "db_flush" (see BulkUpdateBuffer).
+        ctx.updates.update_one(
+            claim,
+            {"$set": {"is_summarized": True, "summary_status": "skipped_not_criminal", "summarized_at": time.time()}, **RELEASE_CLAIM}
+        )
+        trace.status = "skipped_not_criminal"
+        ctx.stats.record_skip()
+        return
+
+    def save_stages(stages, stage):
+        # Written straight away rather than buffered, so the checkpoint survives a crash in a later stage.
+        # After the brief only the finished stage is set, not the whole checkpoint with every earlier stage.
+        # Each checkpoint also renews the lease, so a long document is not reclaimed while it is still being worked on.
+        update = {f"summary_stages.sourced.{stage}": stages["sourced"][stage]} if stage else {"summary_stages": stages}
+        with trace.stage("db_write"):
+            result = ctx.decisions_collection.update_one(
+                claim, {"$set": {**update, "claimed_until": time.time() + CLAIM_LEASE_SECONDS}}
+            )
+        if not result.matched_count:
+            raise LeaseLost(f"Document {doc_id} was reclaimed by another worker.")
+
+    # Run the AI Pipeline, resuming from the stages an earlier attempt completed
+    from summarizer_logic import generate_structured_brief
+    complete_summary_data, _ = generate_structured_brief(
+        cleaned_text, ctx.gemini_api_key, trace=trace,
+        resume_stages=decision.get("summary_stages"), on_stage_complete=save_stages, summary_mode=ctx.summary_mode
+    )
+
+    if not complete_summary_data:
+        raise Exception("generate_structured_brief returned None or an error.")
+
+    # Cost calculation, per call so each request is billed at its own model's price and tier
+    run_cost = document_cost(trace.llm_calls)
+    trace.extra["cost_usd"] = run_cost
+    ctx.stats.record_model_usage(trace.llm_calls)
+    ctx.stats.record_compaction(trace.extra.get("compaction"))
+
+    # Update database. With failed sourcing stages the document is "partial": the brief is saved,
+    # and the stage checkpoint is kept for 'retry-failed'.
+    failed_stages = trace.extra.get("failed_stages")
+    if failed_stages:
+        update = {"$set": {"is_summarized": True, "summary_status": "partial", "failed_stages": failed_stages,
+                           "summarized_at": time.time(), "ai_generated_brief": complete_summary_data}, **RELEASE_CLAIM}
+    else:
+        update = {"$set": {"is_summarized": True, "summary_status": "success", "summarized_at": time.time(), "ai_generated_brief": complete_summary_data},
+                  "$unset": {**RELEASE_CLAIM["$unset"], "summary_stages": "", "failed_stages": ""}}
+    ctx.updates.update_one(claim, update)
+    if failed_stages:
+        print(f"--> PARTIAL: Saved document ID {doc_id}; sourcing failed for {', '.join(failed_stages)}.")
+    else:
+        print(f"--> SUCCESS: Summarized and saved document ID: {doc_id}")
+
+    ctx.run_log.write_line(str(doc_id))
+
+    if failed_stages:
+        trace.status = "partial"
+        ctx.stats.record_partial(run_cost)
+    else:
+        trace.status = "success"
+        ctx.stats.record_success(run_cost)
+
+
+def worker_loop(worker_id, ctx: RunContext):
+    """
+    Processes prefetched decisions until no claimable work is left or the run is stopped.
+    """
+    while not ctx.stop_event.is_set():
+        decision = ctx.prefetcher.get()
+        if not decision:
+            if not ctx.stop_event.is_set():
+                print(f"[{worker_id}] No new decisions to claim. Worker will exit.")
+            break
+
+        doc_id = decision['_id']
+        trace = DocumentTrace(doc_id)
+        ctx.start_decision(decision)
+        try:
+            process_decision(decision, ctx, trace)
+        except LeaseLost as e:
+            # The decision belongs to another worker now; writing anything would clobber its work.
+            print(f"ABANDONED: {e}")
+            trace.status = "lease_lost"
+        except RateLimitExhausted as e:
+            # Quota pressure is not the document's fault: release it for a later attempt instead of failing it.
+            print(f"DEFERRED: Document {doc_id} is still rate limited after retries: {e}")
+            ctx.updates.update_one(claim_filter(decision), RELEASE_CLAIM)
+            trace.status = "deferred_rate_limited"
+            ctx.stats.record_deferred()
+        except Exception as e:
+            print(f"ERROR processing document {doc_id}: {e}")
+            if "API key not valid" in str(e):
+                print("FATAL: Invalid API Key. The script will now exit.")
+                # Hand the document back untouched so it is not lost to a configuration error.
+                ctx.updates.update_one(claim_filter(decision), RELEASE_CLAIM)
+                ctx.stop_event.set()
+                break
+
+            ctx.updates.update_one(
+                claim_filter(decision),
+                {"$set": {"is_summarized": True, "summary_status": "failed", "error_message": str(e)}, **RELEASE_CLAIM}
+            )
+            trace.status = "failed"
+            ctx.stats.record_failure()
+        finally:
+            ctx.finish_decision(decision)
+            if trace.status:
+                ctx.metrics.record(trace)
+
+
+def run_worker_pool(ctx: RunContext, worker_prefix: str, num_workers: int = NUM_WORKERS, wait_for_work=None):
+    """Starts the prefetcher and runs `num_workers` worker loops until they all exit."""
+    ctx.prefetcher = PendingPrefetcher(
+        ctx.decisions_collection, worker_prefix, CLAIM_LEASE_SECONDS, ctx.stop_event,
+        queue_size=num_workers, wait_for_work=wait_for_work
+    ).start()
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(worker_loop, f"{worker_prefix}:{i}", ctx)
+            for i in range(num_workers)
+        ]
+        for future in futures:
+            future.result()
+
+
+def run_batch_command(ctx: RunContext, args):
+    """
+    Batch mode: claims a block of pending decisions, skips non-criminal ones, summarizes the rest
+    through the batch backend in two waves and writes every result back with one bulk write.
+    With `--resume`, collects the batches of an earlier run that failed or died instead.
+    """
+    from batch_mode import GeminiBatchBackend, LocalFileBatchBackend, load_job, request_key, run_batch_waves, save_job
+    from chunking import choose_pipeline
+
+    decisions_collection = ctx.decisions_collection
+    if args.backend == "local":
+        backend = LocalFileBatchBackend(args.local_batch_dir)
+    else:
+        backend = GeminiBatchBackend(ctx.gemini_api_key)
+
+    if args.resume:
+        work_dir = args.resume
+        job = load_job(work_dir)
+        if not job:
+            print(f"FATAL: No batch job file in {work_dir}.")
+            return
+        claimed = reclaim_decisions(decisions_collection, list(job["keys"].values()), job["claim_token"], BATCH_LEASE_SECONDS)
+        print(f"Resuming batch job {work_dir}: {len(claimed)} of {len(job['keys'])} decisions are still pending.")
+    else:
+        claimed = claim_batch(decisions_collection, f"batch:{socket.gethostname()}:{os.getpid()}", args.limit, BATCH_LEASE_SECONDS)
+        print(f"Claimed {len(claimed)} decisions for batch processing.")
+        if not claimed:
+            return
+        work_dir = os.path.join("batches", datetime.now().strftime('%Y%m%d_%H%M%S'))
+        # Recorded before anything is submitted, so a run that dies mid-poll can be resumed.
+        save_job(work_dir, {"claim_token": claimed[0]["claimed_by"],
+                            "keys": {request_key(d["_id"]): d["_id"] for d in claimed}, "batches": {}})
+
+    release = RELEASE_CLAIM
+    claims = {decision["_id"]: claim_filter(decision) for decision in claimed}
+    operations, documents, resolved = [], {}, set()
+
+    def _write(doc_id, update):
+        operations.append(pymongo.UpdateOne(claims[doc_id], update))
+        resolved.add(doc_id)
+
+    try:
+        for decision in claimed:
+            doc_id = decision["_id"]
+            raw_html = decision.get("html")
+            if not raw_html:
+                _write(doc_id, {"$set": {"is_summarized": True, "summary_status": "failed", "error_message": "Document is missing the 'raw_html_text' field."}, **release})
+                ctx.stats.record_failure()
+                continue
+            try:
+                criminal = triage_html(raw_html)
+                cleaned_text = clean_html(raw_html) if criminal is not False else None
+                if criminal is None:
+                    criminal = is_criminal_case(cleaned_text)
+                chunked = bool(criminal) and choose_pipeline(cleaned_text) == "chunked"
+            except Exception as e:
+                # One unparseable document (eyecite rejects comment-only HTML) must not sink the whole batch,
+                # or every later batch run would claim it again and fail the same way.
+                print(f"ERROR processing document {doc_id}: {e}")
+                _write(doc_id, {"$set": {"is_summarized": True, "summary_status": "failed", "error_message": str(e)}, **release})
+                ctx.stats.record_failure()
+                continue
+            if not criminal:
+                _write(doc_id, {"$set": {"is_summarized": True, "summary_status": "skipped_not_criminal", "summarized_at": time.time()}, **release})
+                ctx.stats.record_skip()
+            elif chunked:
+                # Oversized decisions need the chunked map-reduce path; leave them to the online workers.
+                _write(doc_id, release)
+            else:
+                documents[doc_id] = cleaned_text
+
+        outcomes = run_batch_waves(documents, backend, work_dir) if documents else {}
+        for doc_id, (complete_summary_data, error, trace) in outcomes.items():
+            if complete_summary_data:
+                run_cost = BATCH_PRICE_DISCOUNT * document_cost(trace.llm_calls)
+                trace.extra["cost_usd"] = run_cost
+                ctx.stats.record_model_usage(trace.llm_calls, BATCH_PRICE_DISCOUNT)
+                ctx.stats.record_compaction(trace.extra.get("compaction"))
+                failed_stages = trace.extra.get("failed_stages")
+                if failed_stages:
+                    # No stage checkpoint in batch mode: 'retry-failed' re-runs these online from the start.
+                    trace.status = "partial"
+                    _write(doc_id, {"$set": {"is_summarized": True, "summary_status": "partial", "failed_stages": failed_stages, "summarized_at": time.time(), "ai_generated_brief": complete_summary_data}, **release})
+                    ctx.stats.record_partial(run_cost)
+                else:
+                    trace.status = "success"
+                    _write(doc_id, {"$set": {"is_summarized": True, "summary_status": "success", "summarized_at": time.time(), "ai_generated_brief": complete_summary_data},
+                                    "$unset": {**release["$unset"], "summary_stages": "", "failed_stages": ""}})
+                    ctx.stats.record_success(run_cost)
+                ctx.run_log.write_line(str(doc_id))
+            else:
+                trace.status = "failed"
+                _write(doc_id, {"$set": {"is_summarized": True, "summary_status": "failed", "error_message": error}, **release})
+                ctx.stats.record_failure()
+            ctx.metrics.record(trace)
+    except Exception as e:
+        # Give back every decision without a result, rather than leaving it locked for the whole batch lease.
+        # A resumed run re-claims the ones that are still pending and collects the submitted batches.
+        print(f"ERROR: Batch run failed: {e}")
+        for doc_id in claims:
+            if doc_id not in resolved:
+                operations.append(pymongo.UpdateOne(claims[doc_id], release))
+        print(f"Released the unfinished decisions. Collect submitted batches with 'python main.py batch --resume {work_dir}'.")
+        raise
+    finally:
+        if operations:
+            started = time.perf_counter()
+            result = decisions_collection.bulk_write(operations, ordered=False)
+            ctx.metrics.record_db_flush(time.perf_counter() - started, len(operations))
+            print(f"Bulk-wrote {result.modified_count} batch results.")
+
+
+def run_migrate_command(decisions_collection):
+    """One-time setup: creates the claim indexes and backfills `is_summarized` on older documents."""
+    print("Creating indexes...")
+    for name in ensure_indexes(decisions_collection):
+        print(f"✅ Index ready: {name}")
+    print("Backfilling 'is_summarized' (full collection scan, this can take a while)...")
+    modified = backfill_summarized_flag(decisions_collection)
+    print(f"✅ Updated {modified} documents with 'is_summarized = False'")
+
+
+def run_ab_compare_command(decisions_collection, gemini_api_key, sample_size, report_path):
+    """Compares the summary modes on recently summarized decisions and prints one row per mode."""
+    from ab_compare import run_ab_comparison
+    summary = run_ab_comparison(decisions_collection, gemini_api_key, sample_size, report_path)
+    print("\n--- A/B Comparison: multi-call vs combined ---")
+    for mode, s in summary.items():
+        documents = max(1, s["documents"])
+        print(f"[{mode:>8}] {s['documents']} docs, {s['errors']} errors, {s['partial']} partial, {s['fell_back']} ran multi-call | "
+              f"{s['calls'] / documents:.1f} calls/doc, {s['input_tokens'] / documents:.0f} input + {s['output_tokens'] / documents:.0f} output tokens/doc, "
+              f"${s['cost_usd'] / documents:.6f}/doc | p50 {s['p50_seconds']:.1f}s, max {s['max_seconds']:.1f}s | "
+              f"quote match {s['quote_match_rate']:.1%} of {s['quotes']}")
+    multi, combined = summary["multi"], summary["combined"]
+    if multi["input_tokens"]:
+        print(f"Combined mode used {combined['input_tokens'] / multi['input_tokens']:.0%} of the multi-call input tokens.")
+    print(f"Report saved to: {report_path}")
+
 
 def main():
     """
     Main execution script for the backend summarization process.
     """
+    parser = argparse.ArgumentParser(description="NYPTI AI decision summarizer.")
+    parser.add_argument("command", nargs="?", default="run", choices=["run", "batch", "triage", "retry-failed", "ab-compare", "migrate", "health"],
+                        help="'run' (default) processes decisions with the online worker pool; "
+                             "'batch' submits pending decisions through a batch backend; "
+                             "'triage' marks non-criminal pending decisions as skipped in bulk, from their captions; "
+                             "'retry-failed' queues failed and partial decisions again, keeping their completed stages; "
+                             "'ab-compare' runs the multi-call and combined summary modes on a sample and compares them; "
+                             "'migrate' creates the indexes and backfills 'is_summarized' (run once); "
+                             "'health' checks the database connection and indexes.")
+    parser.add_argument("--daemon", action="store_true",
+                        help="run: keep running once the backlog is drained and summarize new decisions as they arrive.")
+    parser.add_argument("--summary-mode", choices=SUMMARY_MODES,
+                        help="run: 'multi' (brief, then one call per sourcing stage) or 'combined' (one call per decision). "
+                             "Default: SUMMARY_MODE.")
+    parser.add_argument("--sample", type=int, default=20, help="ab-compare: number of summarized decisions to compare on.")
+    parser.add_argument("--limit", type=int, default=BATCH_SIZE, help="batch: maximum decisions per batch run.")
+    parser.add_argument("--backend", choices=["gemini", "local"], default="gemini",
+                        help="batch: 'gemini' for the Gemini Batch API, 'local' for the file-based stand-in.")
+    parser.add_argument("--resume", metavar="WORK_DIR",
+                        help="batch: collect the submitted batches of an earlier run from its work directory (batches/<timestamp>).")
+    parser.add_argument("--local-batch-dir", default=os.path.join("batches", "local_backend"),
+                        help="batch: directory used by the local backend.")
+    args = parser.parse_args()
+    check_settings()
+
     # --- 1. Setup ---
     start_time = datetime.now()
     log_filename = f"run_log_{start_time.strftime('%Y%m%d_%H%M%S')}.txt"
     log_filepath = os.path.join("logs", log_filename)
     os.makedirs("logs", exist_ok=True)
-
-    total_cost = 0.0
-    decisions_processed = 0
-    decisions_skipped = 0
-
-    # Pricing constants
-    TOKEN_THRESHOLD = 128000
-    COST_PER_INPUT_TOKEN_LOW = 1.25 / 1_000_000
-    COST_PER_OUTPUT_TOKEN_LOW = 5.00 / 1_000_000
-    COST_PER_INPUT_TOKEN_HIGH = 2.50 / 1_000_000
-    COST_PER_OUTPUT_TOKEN_HIGH = 10.00 / 1_000_000
+    run_stamp = start_time.strftime('%Y%m%d_%H%M%S')
+    metrics = MetricsRecorder(
+        os.path.join("logs", f"metrics_{run_stamp}.jsonl"),
+        os.path.join("logs", f"metrics_{run_stamp}.prom"),
+    )
 
     # --- 2. Configuration and DB Connection ---
     mongo_url = os.environ.get("MONGO_URL")
     gemini_api_key = os.environ.get("GEMINI_API_KEY")
-    db_name = os.environ.get("MONGO_DB_NAME", "PublicDecisions")   
-    collection_name = os.environ.get("MONGO_COLLECTION", "Documents") 
+    db_name = os.environ.get("MONGO_DB_NAME", "PublicDecisions")
+    collection_name = os.environ.get("MONGO_COLLECTION", "Documents")
 
-    if not mongo_url or not gemini_api_key:
+    if not mongo_url or (not gemini_api_key and args.command in ("run", "batch", "ab-compare")):
         print("FATAL: MONGO_URL and GEMINI_API_KEY environment variables must be set.")
-        return
+        raise SystemExit(1)
 
     try:
         print("Connecting to MongoDB...")
         mongo_client = pymongo.MongoClient(mongo_url)
         db = mongo_client[db_name]
         decisions_collection = db[collection_name]
+        # Reads the collection metadata instead of counting every document.
+        count = decisions_collection.estimated_document_count()
         print("Successfully connected to MongoDB.")
-        count = decisions_collection.count_documents({})
-        print(f"📊 Total records in '{collection_name}' collection: {count}")
-        if count > 0:
-            sample_doc = decisions_collection.find_one()
-            print("🔍 Sample record before update:")
-            print(sample_doc)
-
-            # 👉 Add `is_summarized = False` to all docs that don’t already have it
-            result = decisions_collection.update_many(
-                {"is_summarized": {"$exists": False}},   # filter
-                {"$set": {"is_summarized": False}}       # update
-            )
-            print(f"✅ Updated {result.modified_count} documents with 'is_summarized = False'")
-
-            sample_after = decisions_collection.find_one()
-            print("🔍 Sample record after update:")
-            print(sample_after)
-        else:
-            print("⚠️ No records found in the 'users' collection.")
+        print(f"📊 Approximately {count} records in '{collection_name}' collection.")
     except Exception as e:
         print(f"FATAL: Could not connect to MongoDB. Error: {e}")
+        raise SystemExit(1)
+
+    if args.command == "migrate":
+        run_migrate_command(decisions_collection)
+        return
+    if args.command == "retry-failed":
+        print(f"✅ Queued {reset_failed_decisions(decisions_collection)} failed or partial decisions for another attempt.")
+        return
+    if args.command == "triage":
+        counts = run_triage(decisions_collection)
+        print(f"Triage complete: {counts['skipped']} skipped as not criminal, {counts['criminal']} criminal, "
+              f"{counts['undecided']} left for the workers ({counts['full_reads']} needed the full HTML).")
         return
+    if args.command == "ab-compare":
+        run_ab_compare_command(decisions_collection, gemini_api_key, args.sample, os.path.join("logs", f"ab_compare_{run_stamp}.json"))
+        return
+    missing = missing_indexes(decisions_collection)
+    if args.command == "health":
+        print("OK" if not missing else f"DEGRADED: missing indexes {missing}; run 'python main.py migrate'.")
+        raise SystemExit(1 if missing else 0)
+    if missing:
+        print(f"⚠️ Missing indexes {missing}: claims will scan the collection. Run 'python main.py migrate' once.")
+    # The ingest inserts decisions without 'is_summarized'; flag the ones added since the last run so they can be claimed.
+    backfilled = backfill_new_decisions(decisions_collection)
+    if backfilled:
+        print(f"✅ Flagged {backfilled} newly ingested decisions with 'is_summarized = False'.")
 
     # This outer try/finally ensures the summary report always runs
+    ctx = RunContext(decisions_collection, gemini_api_key, log_filepath, metrics, summary_mode=args.summary_mode)
+    stats = ctx.stats
+    worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
     try:
-        # --- 3. The Main Processing Loop (NOW CORRECTLY INDENTED) ---
-        while True:
-            decision = decisions_collection.find_one({"is_summarized": False})
-            if not decision:
-                print("No new decisions to process. Script will exit.")
-                break
+        if args.command == "batch":
+            run_batch_command(ctx, args)
+            return
 
-            doc_id = decision['_id']
-            print(f"Processing document ID: {doc_id}")
-            
-            try:
-                raw_html = decision.get("html")
-                if not raw_html:
-                    raise ValueError("Document is missing the 'raw_html_text' field.")
-                
-                cleaned_text = clean_html(raw_html)
-                
-                # Criminal Case Filter
-                normalized_start = cleaned_text.strip().lower()
-                is_criminal_case = (
-                    normalized_start.startswith("people v") or 
-                    normalized_start.startswith("the people of the state of new york v")
-                )
-
-                if not is_criminal_case:
-                    print(f"--> SKIPPING: Document {doc_id} is not a criminal case.")
-                    decisions_collection.update_one(
-                        {"_id": doc_id},
-                        {"$set": {"is_summarized": True, "summary_status": "skipped_not_criminal", "summarized_at": time.time()}}
-                    )
-                    decisions_skipped += 1
-                    continue
-                
-                # Run the AI Pipeline
-                complete_summary_data, usage_metadata = generate_structured_brief(cleaned_text, gemini_api_key)
-
-                if complete_summary_data:
-                    # Cost calculation
-                    run_cost = 0.0
-                    if usage_metadata:
-                        input_tokens = usage_metadata.get("prompt_token_count", 0)
-                        output_tokens = usage_metadata.get("candidates_token_count", 0)
-                        if input_tokens <= TOKEN_THRESHOLD:
-                            run_cost = (input_tokens * COST_PER_INPUT_TOKEN_LOW) + (output_tokens * COST_PER_OUTPUT_TOKEN_LOW)
-                        else:
-                            run_cost = (input_tokens * COST_PER_INPUT_TOKEN_HIGH) + (output_tokens * COST_PER_OUTPUT_TOKEN_HIGH)
-                        total_cost += run_cost
-                    
-                    # Update database on success
-                    decisions_collection.update_one(
-                        {"_id": doc_id},
-                        {"$set": { "is_summarized": True, "summary_status": "success", "summarized_at": time.time(), "ai_generated_brief": complete_summary_data }}
-                    )
-                    print(f"--> SUCCESS: Summarized and saved document ID: {doc_id}")
-
-                    with open(log_filepath, "a") as log_file:
-                        log_file.write(f"{doc_id}\n")
-                    
-                    decisions_processed += 1
-                else:
-                    raise Exception("generate_structured_brief returned None or an error.")
-
-            except Exception as e:
-                print(f"ERROR processing document {doc_id}: {e}")
-                if "API key not valid" in str(e):
-                    print("FATAL: Invalid API Key. The script will now exit.")
-                    break
-                
-                decisions_collection.update_one(
-                    {"_id": doc_id},
-                    {"$set": {"is_summarized": True, "summary_status": "failed", "error_message": str(e)}}
-                )
+        # --- 3. The Worker Pool ---
+        print(f"Starting {NUM_WORKERS} workers (lease: {CLAIM_LEASE_SECONDS}s{', daemon mode' if args.daemon else ''})...")
+        install_stop_handlers(ctx.stop_event, on_forced_exit=ctx.abandon)
+        wait_for_work = DecisionWatcher(decisions_collection, ctx.stop_event).start().wait_for_work if args.daemon else None
+        run_worker_pool(ctx, worker_prefix, wait_for_work=wait_for_work)
 
     finally:
+        if ctx.prefetcher:
+            # Decisions claimed but never started go straight back to the queue.
+            for decision in ctx.prefetcher.drain_unprocessed():
+                ctx.updates.update_one(claim_filter(decision), RELEASE_CLAIM)
+        ctx.close()
+
         # --- 4. Final Summary Report ---
         print("\n--- Run Summary ---")
-        print(f"Decisions Summarized: {decisions_processed}")
-        print(f"Decisions Skipped (Not Criminal): {decisions_skipped}")
-        if decisions_processed > 0:
-            average_cost = total_cost / decisions_processed
-            print(f"Total Estimated Cost: ${total_cost:.6f}")
+        print(f"Decisions Summarized: {stats.decisions_processed}")
+        print(f"Decisions Skipped (Not Criminal): {stats.decisions_skipped}")
+        print(f"Decisions Partially Summarized (Sourcing Failed): {stats.decisions_partial}")
+        print(f"Decisions Failed: {stats.decisions_failed}")
+        print(f"Decisions Deferred (Rate Limited): {stats.decisions_deferred} "
+              f"({get_scheduler().quota_errors} quota errors absorbed)")
+        if stats.decisions_processed + stats.decisions_partial > 0:
+            average_cost = stats.total_cost / (stats.decisions_processed + stats.decisions_partial)
+            print(f"Total Estimated Cost: ${stats.total_cost:.6f}")
             print(f"Average Cost Per Decision: ${average_cost:.6f}")
+            for model, usage in sorted(stats.usage_by_model.items()):
+                print(f"Model [{model}]: {usage['calls']} calls, {usage['input_tokens']} input + "
+                      f"{usage['output_tokens']} output tokens, ${usage['cost_usd']:.6f}")
+            if stats.tokens_before_compaction:
+                print(f"Input Compaction: {stats.tokens_saved_by_compaction} of {stats.tokens_before_compaction} decision tokens removed "
+                      f"({stats.tokens_saved_by_compaction / stats.tokens_before_compaction:.1%})")
         else:
             print("No new decisions were summarized in this run.")
+        summary_cache = get_summary_cache()
+        if summary_cache:
+            for stage, counts in summary_cache.stats().items():
+                print(f"Cache [{stage}]: {counts['hits']} hits, {counts['misses']} misses")
+        metrics.write_prometheus()
+        for stage, values in metrics.stage_summary().items():
+            print(f"Stage [{stage}]: p50 {values['p50_seconds']:.2f}s, p95 {values['p95_seconds']:.2f}s, "
+                  f"avg input tokens {values['mean_input_tokens']:.0f}")
+        claim_round_trips = ctx.prefetcher.round_trips if ctx.prefetcher else 0
+        print(f"DB round trips: {claim_round_trips} for claims, {ctx.updates.flushes} bulk update flushes")
         print(f"Log file saved to: {log_filepath}")
+        print(f"Metrics saved to: {metrics.jsonl_path} and {metrics.prometheus_path}")
         print("-------------------\n")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
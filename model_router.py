@@ -0,0 +1,145 @@
+# model_router.py
+"""
+Model tiering: which Gemini model serves each call, and what each call costs.
+
+Quote sourcing is mostly extraction, and short memorandum decisions rarely need the
+strongest model. With MODEL_ROUTING on, a `ModelRoute` picks per document and stage:
+
+- stages in ROUTER_FAST_STAGES (the four sourcing stages by default) use the fast model;
+- documents of at most ROUTER_FAST_MAX_TOKENS tokens use it for every stage;
+- everything else uses the strong model.
+
+A fast-model call whose response does not parse is repeated on the strong model, and so is
+a fast-model stage whose quotes are mostly not found in the decision (see summarizer_logic).
+There is one pooled client per model, shared by every worker thread.
+
+`call_cost` prices a call by its model and prompt size; `model_usage` totals calls, tokens
+and cost per model.
+"""
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+STRONG_MODEL = os.environ.get("ROUTER_STRONG_MODEL", "gemini-1.5-pro")
+FAST_MODEL = os.environ.get("ROUTER_FAST_MODEL", "gemini-1.5-flash")
+MODEL_ROUTING = os.environ.get("MODEL_ROUTING", "true").lower() == "true"
+ROUTER_FAST_STAGES = {s.strip() for s in os.environ.get("ROUTER_FAST_STAGES", "facts,rationale,issues,holdings").split(",") if s.strip()}
+ROUTER_FAST_MAX_TOKENS = int(os.environ.get("ROUTER_FAST_MAX_TOKENS", "8000"))
+# A fast-model stage is escalated when fewer than this share of its quotes are found in the decision.
+ROUTER_MIN_QUOTE_MATCH = float(os.environ.get("ROUTER_MIN_QUOTE_MATCH", "0.8"))
+
+# How many calls produce a brief (overridable per run with `main.py run --summary-mode`):
+#   "multi"    - the step-1 brief, then one call per sourcing stage; the decision text is sent up to five times
+#   "combined" - one call returns the brief with every supporting quote; the decision text is sent once.
+#                Chunked decisions, and documents resuming from a stage checkpoint, still use "multi".
+# Kept here rather than in summarizer_logic so main.py can check it at startup without importing langchain.
+SUMMARY_MODE = os.environ.get("SUMMARY_MODE", "multi").lower()
+SUMMARY_MODES = ("multi", "combined")
+
+# Per-token prices in USD. A request above the threshold is billed at the higher tier.
+PRICE_TIER_TOKEN_THRESHOLD = 128000
+MODEL_PRICING = {
+    "gemini-1.5-pro": {
+        "input_low": 1.25 / 1_000_000, "output_low": 5.00 / 1_000_000,
+        "input_high": 2.50 / 1_000_000, "output_high": 10.00 / 1_000_000,
+    },
+    "gemini-1.5-flash": {
+        "input_low": 0.075 / 1_000_000, "output_low": 0.30 / 1_000_000,
+        "input_high": 0.15 / 1_000_000, "output_high": 0.60 / 1_000_000,
+    },
+}
+# Models missing from the table are priced like this one, so estimates err on the high side.
+_FALLBACK_PRICING = "gemini-1.5-pro"
+
+def check_summary_mode(summary_mode: str) -> str:
+    """Returns `summary_mode` if it is one of SUMMARY_MODES; raises ValueError otherwise."""
+    if summary_mode not in SUMMARY_MODES:
+        raise ValueError(f"Unknown SUMMARY_MODE '{summary_mode}'. Choose one of: {', '.join(SUMMARY_MODES)}.")
+    return summary_mode
+
+
+_clients: Dict[str, Any] = {}
+_client_overrides: Dict[Optional[str], Any] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(model: str, api_key: str):
+    """Returns the pooled client for `model`, creating it on first use."""
+    with _clients_lock:
+        override = _client_overrides.get(model, _client_overrides.get(None))
+        if override is not None:
+            return override
+        if model not in _clients:
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            _clients[model] = ChatGoogleGenerativeAI(
+                model=model,
+                temperature=0.1,
+                google_api_key=api_key,
+                # A single attempt: quota retries are handled by the rate limiter so that every worker backs off together.
+                max_retries=1
+            )
+            print(f"Initialized {model} client.")
+        return _clients[model]
+
+
+def use_client(llm, model: Optional[str] = None):
+    """Serves `model` (or every model, if None) with `llm` instead of a Gemini client, e.g. benchmark.py's fake model."""
+    with _clients_lock:
+        _client_overrides[model] = llm
+
+
+class ModelRoute:
+    """The model choices for one document."""
+
+    def __init__(self, document_tokens: int, api_key: str):
+        self.document_tokens = document_tokens
+        self.api_key = api_key
+
+    def model_for(self, stage: str) -> str:
+        if not MODEL_ROUTING:
+            return STRONG_MODEL
+        if stage in ROUTER_FAST_STAGES or self.document_tokens <= ROUTER_FAST_MAX_TOKENS:
+            return FAST_MODEL
+        return STRONG_MODEL
+
+    def escalation_for(self, model: str) -> Optional[str]:
+        """The model to retry on after `model` failed, or None if it already is the strongest."""
+        return STRONG_MODEL if model != STRONG_MODEL else None
+
+    def client(self, model: str):
+        return get_client(model, self.api_key)
+
+    def cache_tag(self, stages: Iterable[str]) -> str:
+        """Names the models `stages` run on, for cache keys. A single model is just its name, as before routing existed."""
+        stages = list(stages)
+        models = [self.model_for(stage) for stage in stages]
+        if len(set(models)) == 1:
+            return models[0]
+        return ",".join(f"{stage}={model}" for stage, model in zip(stages, models))
+
+
+# --- Cost accounting ---
+
+def call_cost(model: Optional[str], input_tokens: int, output_tokens: int) -> float:
+    """Cost of a single LLM call. The price tier is decided per request by its prompt size."""
+    pricing = MODEL_PRICING.get(model) or MODEL_PRICING[_FALLBACK_PRICING]
+    if input_tokens <= PRICE_TIER_TOKEN_THRESHOLD:
+        return (input_tokens * pricing["input_low"]) + (output_tokens * pricing["output_low"])
+    return (input_tokens * pricing["input_high"]) + (output_tokens * pricing["output_high"])
+
+
+def document_cost(llm_calls: List[Dict[str, Any]]) -> float:
+    """Total cost of a document's calls, as recorded on its DocumentTrace."""
+    return sum(call_cost(c["model"], c["input_tokens"], c["output_tokens"]) for c in llm_calls)
+
+
+def model_usage(llm_calls: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """Calls, tokens and cost per model."""
+    usage: Dict[str, Dict[str, float]] = {}
+    for c in llm_calls:
+        entry = usage.setdefault(c["model"] or "unknown", {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0})
+        entry["calls"] += 1
+        entry["input_tokens"] += c["input_tokens"]
+        entry["output_tokens"] += c["output_tokens"]
+        entry["cost_usd"] += call_cost(c["model"], c["input_tokens"], c["output_tokens"])
+    return usage
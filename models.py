@@ -68,4 +68,31 @@ class LegalBrief(BaseModel):
     brief_step_9_other_opinions_summary: Optional[List[OpinionSummary]] = Field(
         None,
         description="Brief summaries of any concurring or dissenting opinions. Null if none."
-    )
\ No newline at end of file
+    )
+
+class CombinedLegalBrief(BaseModel):
+    """A `LegalBrief` whose facts, issues, holdings and rationale already carry their supporting quotes (single-call mode)."""
+    brief_step_1_format_note: str = Field(description="Note about the format being used.")
+    brief_step_2_caption: CaptionDetails = Field(description="Case caption details (name, court, year, citation).")
+    brief_step_3_key_facts_sourced: List[SourcedTakeaway] = Field(
+        description="Key legally relevant facts, each a distinct takeaway with its verbatim supporting quote."
+    )
+    brief_step_4_procedural_history: str = Field(
+        description="A concise narrative of the procedural history from trial court to the current court."
+    )
+    brief_step_5_issues_sourced: List[SourcedIssue] = Field(
+        description="The questions the court had to decide, each with the verbatim quote that frames it."
+    )
+    brief_step_6_holdings_sourced: List[SourcedHolding] = Field(
+        description="The holdings, each with the verbatim quote that supports its legal principle."
+    )
+    brief_step_7_rationale_sourced: List[SourcedTakeaway] = Field(
+        description="Key points of the court's reasoning, each with its verbatim supporting quote."
+    )
+    brief_step_8_disposition: str = Field(
+        description="The final disposition of the case (e.g., Affirmed, Reversed, Remanded), stated succinctly."
+    )
+    brief_step_9_other_opinions_summary: Optional[List[OpinionSummary]] = Field(
+        None,
+        description="Brief summaries of any concurring or dissenting opinions. Null if none."
+    )
@@ -0,0 +1,373 @@
+# mongo_io.py
+"""
+Bulk MongoDB I/O for the worker pool.
+
+- `claim_batch` claims a block of decisions with two round trips and reads back only the fields workers need.
+  Every later write for a claimed decision filters on its claim token (`claim_filter`).
+- `PendingPrefetcher` keeps about one claimed decision per worker ready, so no claim waits long for a worker.
+- `BulkUpdateBuffer` collects status updates and flushes them with one unordered `bulk_write`.
+- `RunLogAppender` keeps the run log open as a single buffered file.
+- `ensure_indexes` and `backfill_summarized_flag` are the one-time setup run by `main.py migrate`;
+  `backfill_new_decisions` gives the flag to decisions ingested since, at the start of every run.
+- `reset_failed_decisions` queues failed and partial decisions again (`main.py retry-failed`).
+"""
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Callable, List, Optional
+
+import pymongo
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from daemon import DAEMON_CHECKPOINT_COLLECTION
+
+PREFETCH_BATCH_SIZE = int(os.environ.get("PREFETCH_BATCH_SIZE", "16"))
+BULK_FLUSH_MAX_OPS = int(os.environ.get("BULK_FLUSH_MAX_OPS", "100"))
+BULK_FLUSH_MAX_SECONDS = float(os.environ.get("BULK_FLUSH_MAX_SECONDS", "2"))
+
+# Only these fields are needed to process a decision; the rest (e.g. an old ai_generated_brief) stays on the server.
+# `summary_stages` is the stage checkpoint of an earlier, incomplete attempt; `claimed_by` is this run's claim token.
+DECISION_PROJECTION = {"_id": 1, "html": 1, "summary_stages": 1, "claimed_by": 1}
+
+RELEASE_CLAIM = {"$unset": {"claimed_by": "", "claimed_until": ""}}
+
+
+class LeaseLost(Exception):
+    """The decision's lease expired and another worker has claimed it since."""
+
+
+def claim_filter(decision: dict) -> dict:
+    """
+    Matches a claimed decision only while it is still held under the claim it was read with, so a worker
+    whose lease expired cannot overwrite the result of the worker that reclaimed the decision.
+    """
+    return {"_id": decision["_id"], "claimed_by": decision["claimed_by"]}
+
+
+def claimable_filter(now: float) -> dict:
+    """Unsummarized decisions that were never claimed or whose lease has expired."""
+    return {"is_summarized": False, "claimed_until": {"$not": {"$gt": now}}}
+
+
+# --- Indexes and one-time bootstrap ---
+
+# Serves the claim query: only pending decisions are indexed, so it stays small as the backlog clears.
+PENDING_CLAIM_INDEX = "pending_claim"
+# Serves the read-back of a claimed batch by its token. Sparse, since only claimed decisions carry the field.
+CLAIMED_BY_INDEX = "claimed_by"
+
+
+def ensure_indexes(decisions_collection) -> List[str]:
+    """Creates the indexes the claim path relies on. Safe to run repeatedly."""
+    return [
+        decisions_collection.create_index(
+            [("is_summarized", pymongo.ASCENDING), ("claimed_until", pymongo.ASCENDING)],
+            name=PENDING_CLAIM_INDEX,
+            partialFilterExpression={"is_summarized": False},
+        ),
+        decisions_collection.create_index([("claimed_by", pymongo.ASCENDING)], name=CLAIMED_BY_INDEX, sparse=True),
+    ]
+
+
+def backfill_summarized_flag(decisions_collection) -> int:
+    """Sets `is_summarized = False` on decisions that predate the flag. A collection scan, so it only runs on `migrate`."""
+    newest = _newest_id(decisions_collection)
+    result = decisions_collection.update_many({"is_summarized": {"$exists": False}}, {"$set": {"is_summarized": False}})
+    if newest is not None:
+        _save_backfill_watermark(decisions_collection, newest["_id"])
+    return result.modified_count
+
+
+def backfill_new_decisions(decisions_collection) -> int:
+    """
+    Sets `is_summarized = False` on decisions inserted since the last backfill, which the ingest
+    does not flag. Only `_id`s above the stored watermark are examined (a range of the `_id`
+    index), so this is cheap enough for the start of every run. It relies on increasing `_id`s
+    (ObjectIds). Without a watermark, i.e. before the first `migrate`, it does the full backfill once.
+    """
+    checkpoint = decisions_collection.database[DAEMON_CHECKPOINT_COLLECTION].find_one({"_id": _backfill_checkpoint_id(decisions_collection)})
+    if checkpoint is None:
+        print("No backfill watermark yet: backfilling 'is_summarized' over the whole collection once.")
+        return backfill_summarized_flag(decisions_collection)
+    newest = _newest_id(decisions_collection)
+    if newest is None or newest["_id"] == checkpoint["last_id"]:
+        return 0
+    result = decisions_collection.update_many(
+        {"_id": {"$gt": checkpoint["last_id"], "$lte": newest["_id"]}, "is_summarized": {"$exists": False}},
+        {"$set": {"is_summarized": False}}
+    )
+    _save_backfill_watermark(decisions_collection, newest["_id"])
+    return result.modified_count
+
+
+def _newest_id(decisions_collection) -> Optional[dict]:
+    return decisions_collection.find_one({}, {"_id": 1}, sort=[("_id", pymongo.DESCENDING)])
+
+
+def _backfill_checkpoint_id(decisions_collection) -> str:
+    return f"{decisions_collection.name}:backfill"
+
+
+def _save_backfill_watermark(decisions_collection, last_id):
+    decisions_collection.database[DAEMON_CHECKPOINT_COLLECTION].update_one(
+        {"_id": _backfill_checkpoint_id(decisions_collection)},
+        {"$set": {"last_id": last_id, "updated_at": time.time()}},
+        upsert=True
+    )
+
+
+def reset_failed_decisions(decisions_collection) -> int:
+    """
+    Marks failed and partial decisions as pending again. Their `summary_stages` checkpoints are kept,
+    so the workers only re-run the stages that are missing.
+    """
+    result = decisions_collection.update_many(
+        {"is_summarized": True, "summary_status": {"$in": ["failed", "partial"]}},
+        {"$set": {"is_summarized": False}, "$unset": {"summary_status": "", "error_message": "", "failed_stages": ""}}
+    )
+    return result.modified_count
+
+
+def missing_indexes(decisions_collection) -> List[str]:
+    existing = decisions_collection.index_information()
+    return [name for name in (PENDING_CLAIM_INDEX, CLAIMED_BY_INDEX) if name not in existing]
+
+
+def claim_batch(decisions_collection, claim_prefix: str, limit: int, lease_seconds: int) -> List[dict]:
+    """
+    Claims up to `limit` claimable decisions under a fresh claim token and returns them (see DECISION_PROJECTION).
+    The update re-checks claimability, so documents claimed by someone else in between are not taken.
+    """
+    now = time.time()
+    claim_token = f"{claim_prefix}:{uuid.uuid4().hex[:12]}"
+    ids = [doc["_id"] for doc in decisions_collection.find(claimable_filter(now), {"_id": 1}).limit(limit)]
+    if not ids:
+        return []
+    decisions_collection.update_many(
+        {"_id": {"$in": ids}, **claimable_filter(now)},
+        {"$set": {"claimed_by": claim_token, "claimed_until": now + lease_seconds}}
+    )
+    return list(decisions_collection.find({"claimed_by": claim_token}, DECISION_PROJECTION))
+
+
+def reclaim_decisions(decisions_collection, ids: List, claim_token: str, lease_seconds: int) -> List[dict]:
+    """
+    Claims the still-pending decisions among `ids` under an existing claim token (`main.py batch --resume`).
+    Decisions that are still held under that token are taken over with a fresh lease.
+    """
+    now = time.time()
+    decisions_collection.update_many(
+        {"_id": {"$in": ids}, "is_summarized": False,
+         "$or": [{"claimed_until": {"$not": {"$gt": now}}}, {"claimed_by": claim_token}]},
+        {"$set": {"claimed_by": claim_token, "claimed_until": now + lease_seconds}}
+    )
+    return list(decisions_collection.find({"_id": {"$in": ids}, "claimed_by": claim_token}, DECISION_PROJECTION))
+
+
+class BulkUpdateBuffer:
+    """Thread-safe buffer of write operations, flushed as one unordered bulk_write by size or age."""
+
+    def __init__(self, decisions_collection, max_ops: int = BULK_FLUSH_MAX_OPS, max_seconds: float = BULK_FLUSH_MAX_SECONDS,
+                 on_flush: Optional[Callable[[float, int], None]] = None):
+        self.decisions_collection = decisions_collection
+        self.max_ops = max_ops
+        self.max_seconds = max_seconds
+        # Receives (seconds, operations) after every bulk_write, e.g. MetricsRecorder.record_db_flush.
+        self.on_flush = on_flush
+        self.flushes = 0
+        self._ops = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._timer = threading.Thread(target=self._flush_periodically, name="bulk-flush", daemon=True)
+        self._timer.start()
+
+    def add(self, operation):
+        with self._lock:
+            self._ops.append(operation)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            full = len(self._ops) >= self.max_ops
+        if full:
+            self.flush()
+
+    def update_one(self, filter_doc: dict, update_doc: dict):
+        self.add(pymongo.UpdateOne(filter_doc, update_doc))
+
+    def flush(self) -> bool:
+        """Writes the buffered operations. Returns False if they could not be sent and were put back."""
+        with self._lock:
+            ops, oldest = self._ops, self._oldest
+            self._ops, self._oldest = [], None
+        if not ops:
+            return True
+        started = time.perf_counter()
+        try:
+            self.decisions_collection.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            # Unordered: the other writes went through. Documents whose write failed keep their
+            # claim until the lease expires and are then picked up again.
+            print(f"ERROR: {len(e.details.get('writeErrors', []))} of {len(ops)} buffered updates failed: {e.details.get('writeErrors', [])[:3]}")
+        except PyMongoError as e:
+            # A dropped connection or failover: put the operations back for the next flush. They are
+            # $set/$unset updates filtered on the claim token, so writing one twice does no harm.
+            with self._lock:
+                self._ops = ops + self._ops
+                self._oldest = oldest if self._oldest is None else min(oldest, self._oldest)
+            print(f"ERROR: Bulk write of {len(ops)} buffered updates failed ({e}); retrying on the next flush.")
+            return False
+        self.flushes += 1
+        if self.on_flush:
+            self.on_flush(time.perf_counter() - started, len(ops))
+        return True
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.max_seconds / 2):
+            with self._lock:
+                due = self._oldest is not None and time.monotonic() - self._oldest >= self.max_seconds
+            if due:
+                self.flush()
+
+    def close(self):
+        self._closed.set()
+        if not self.flush():
+            print(f"ERROR: {len(self._ops)} buffered updates were not written. Their decisions are picked up again "
+                  f"once their leases expire.")
+
+
+class RunLogAppender:
+    """The run log, opened once and shared by every worker."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", buffering=64 * 1024)
+        self._lock = threading.Lock()
+
+    def write_line(self, line: str):
+        with self._lock:
+            self._file.write(f"{line}\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class PendingPrefetcher:
+    """
+    Claims pending decisions on a background thread and hands them to workers through a
+    bounded queue. `get()` returns None once no claimable work is left or the run is stopping.
+    With `wait_for_work` (daemon mode) an empty claim does not end the run: the prefetcher
+    calls it, which blocks until new work may have arrived, and claims again.
+
+    A lease starts when a decision is claimed, not when a worker starts on it, so the queue
+    holds at most `queue_size` decisions (one per worker by default) and each claim only
+    fills the free slots, up to `batch_size`. `get()` also renews the lease as it hands a
+    decision out, and skips decisions that were reclaimed while they waited.
+    """
+
+    def __init__(self, decisions_collection, claim_prefix: str, lease_seconds: int, stop_event: threading.Event,
+                 queue_size: int, batch_size: int = PREFETCH_BATCH_SIZE, wait_for_work: Optional[Callable[[], None]] = None):
+        self.decisions_collection = decisions_collection
+        self.claim_prefix = claim_prefix
+        self.lease_seconds = lease_seconds
+        self.stop_event = stop_event
+        self.batch_size = batch_size
+        self.wait_for_work = wait_for_work
+        self.round_trips = 0
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._taken = threading.Event()
+        self._exhausted = threading.Event()
+        self._stranded: List[dict] = []
+        self._thread = threading.Thread(target=self._run, name="prefetcher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            while not self.stop_event.is_set():
+                free_slots = self._wait_for_free_slots()
+                if not free_slots:
+                    break
+                try:
+                    batch = claim_batch(self.decisions_collection, self.claim_prefix, min(self.batch_size, free_slots), self.lease_seconds)
+                except PyMongoError as e:
+                    if not self.wait_for_work:
+                        raise
+                    # A daemon outlives database hiccups: wait and claim again.
+                    print(f"ERROR claiming decisions, will retry: {e}")
+                    self.wait_for_work()
+                    continue
+                self.round_trips += 3 if batch else 1
+                if not batch:
+                    if not self.wait_for_work:
+                        break
+                    self.wait_for_work()
+                    continue
+                for position, decision in enumerate(batch):
+                    while not self._put(decision):
+                        if self.stop_event.is_set():
+                            self._stranded.extend(batch[position:])
+                            return
+        except Exception as e:
+            print(f"ERROR in prefetcher, no more decisions will be claimed: {e}")
+        finally:
+            self._exhausted.set()
+
+    def _wait_for_free_slots(self) -> int:
+        """Blocks until the queue has room, and returns how many decisions fit (0 if the run is stopping)."""
+        while not self.stop_event.is_set():
+            # Only this thread adds to the queue, so the free slots can only grow until the next claim.
+            free_slots = self._queue.maxsize - self._queue.qsize()
+            if free_slots > 0:
+                return free_slots
+            self._taken.wait(1)
+            self._taken.clear()
+        return 0
+
+    def _renew_lease(self, decision) -> bool:
+        """Restarts the lease as a worker picks the decision up. False if it was reclaimed while queued."""
+        try:
+            result = self.decisions_collection.update_one(
+                claim_filter(decision), {"$set": {"claimed_until": time.time() + self.lease_seconds}}
+            )
+        except PyMongoError as e:
+            # The claim itself still stands; the checkpoints renew the lease later on.
+            print(f"ERROR renewing the lease of {decision['_id']}: {e}")
+            return True
+        self.round_trips += 1
+        return result.matched_count > 0
+
+    def _put(self, decision) -> bool:
+        try:
+            self._queue.put(decision, timeout=1)
+            return True
+        except queue.Full:
+            return False
+
+    def get(self) -> Optional[dict]:
+        while not self.stop_event.is_set():
+            try:
+                decision = self._queue.get(timeout=1)
+            except queue.Empty:
+                if self._exhausted.is_set() and self._queue.empty():
+                    return None
+                continue
+            self._taken.set()
+            if self._renew_lease(decision):
+                return decision
+            print(f"Skipping document {decision['_id']}: it was reclaimed by another worker while queued.")
+        return None
+
+    def drain_unprocessed(self) -> List[dict]:
+        """Decisions that were claimed but never handed to a worker (after a stop)."""
+        self._thread.join(timeout=5)
+        leftover, self._stranded = self._stranded, []
+        while True:
+            try:
+                leftover.append(self._queue.get_nowait())
+            except queue.Empty:
+                return leftover
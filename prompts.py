@@ -4,7 +4,7 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
 from models import (
     CaptionDetails, LegalBrief, SourcedTakeawaysList,
-    SourcedIssuesList, SourcedHoldingsList
+    SourcedIssuesList, SourcedHoldingsList, CombinedLegalBrief
 )
 
 # --- Parsers ---
@@ -14,6 +14,7 @@ legal_brief_parser = PydanticOutputParser(pydantic_object=LegalBrief)
 sourcing_parser = PydanticOutputParser(pydantic_object=SourcedTakeawaysList)
 issues_sourcing_parser = PydanticOutputParser(pydantic_object=SourcedIssuesList)
 holdings_sourcing_parser = PydanticOutputParser(pydantic_object=SourcedHoldingsList)
+combined_brief_parser = PydanticOutputParser(pydantic_object=CombinedLegalBrief)
 
 
 # --- NEW, MORE DIRECT PROMPT TEMPLATES ---
@@ -108,4 +109,30 @@ Respond with ONLY a single valid JSON object. It must contain one key: `sourced_
 """
 holdings_sourcing_prompt = ChatPromptTemplate.from_template(template=holdings_sourcing_prompt_template_text)
 
+# 6. Combined Brief and Sourcing Prompt (single-call mode)
+# The brief and every supporting quote in one request, so the decision text is only sent once.
+combined_brief_prompt_template_text = """You are a highly skilled AI legal analyst. Read the following court decision and generate a comprehensive legal brief based on the 9 steps outlined below. Every fact, issue, holding and rationale point must be backed by a single, verbatim quote from the decision.
+
+--- BEGIN COURT DECISION TEXT ---
+{court_decision_full_text}
+--- END COURT DECISION TEXT ---
+
+Your entire output MUST be a single, valid JSON object. Do not include any other text, explanations, or markdown formatting. The JSON object must contain keys corresponding to these 9 steps:
+1.  `brief_step_1_format_note`: (string) A note about the format.
+2.  `brief_step_2_caption`: (JSON object) An object with keys `case_name`, `court`, `year_decided`, `ny_slip_op_citation`, and `official_reporter_citation`.
+3.  `brief_step_3_key_facts_sourced`: (list of JSON objects) The key facts. Each object must have keys `takeaway` (the fact) and `supporting_quote`.
+4.  `brief_step_4_procedural_history`: (string) A narrative of the case history.
+5.  `brief_step_5_issues_sourced`: (list of JSON objects) The legal questions. Each object must have keys `issue_question` (the question) and `supporting_quote` (the quote that frames the issue).
+6.  `brief_step_6_holdings_sourced`: (list of JSON objects) Each object must have keys `issue_question`, `answer`, `legal_principle`, and `supporting_quote` (the quote that supports the legal principle).
+7.  `brief_step_7_rationale_sourced`: (list of JSON objects) Key points from the court's reasoning. Each object must have keys `takeaway` (the point) and `supporting_quote`.
+8.  `brief_step_8_disposition`: (string) The final outcome (e.g., "Affirmed").
+9.  `brief_step_9_other_opinions_summary`: (list of JSON objects or null) If present, provide a list of summaries for any concurring or dissenting opinions.
+    - Each summary object MUST contain the keys `opinion_type`, `author_judge`, and `summary_of_analysis`.
+    - The value for `summary_of_analysis` MUST be a list of strings.
+    - If no other opinions exist, this entire field MUST be `null`.
+
+Every `supporting_quote` MUST be copied verbatim from the decision text. If no quote is found, use the string "No direct supporting quote found in the text." for the quote.
+"""
+combined_brief_prompt = ChatPromptTemplate.from_template(template=combined_brief_prompt_template_text)
+
 print("Prompts and parsers initialized with DIRECT instructions.")
\ No newline at end of file
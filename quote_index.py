@@ -0,0 +1,260 @@
+# quote_index.py
+"""
+A small local index over one cleaned decision, used to check and find verbatim quotes
+without another round trip to the LLM.
+
+The index keeps a normalized copy of the text (lowercased, whitespace collapsed,
+typographic quotes and dashes folded) with a map from every normalized character back
+to its offset in the original text, so matches are always reported against the
+original `clean_html` output.
+"""
+import difflib
+import math
+import os
+import re
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+NO_QUOTE_FOUND = "No direct supporting quote found in the text."
+
+# How supporting quotes are found:
+#   "llm"     - send the full decision text to every sourcing call (original behaviour)
+#   "windows" - send only the candidate passages the local quote index picks for the stage's items
+#   "local"   - skip the LLM entirely and use the best-matching sentence from the local index
+# In every mode, returned quotes are checked against the text and annotated with their offsets.
+QUOTE_SOURCING_MODE = os.environ.get("QUOTE_SOURCING_MODE", "llm").lower()
+QUOTE_SOURCING_MODES = ("llm", "windows", "local")
+
+# Fraction of a quote's characters that must align with the text for a fuzzy match.
+FUZZY_MATCH_THRESHOLD = 0.9
+
+_CHAR_FOLDS = {
+    "\u2018": "'", "\u2019": "'", "\u201a": "'", "\u201b": "'",
+    "\u201c": '"', "\u201d": '"', "\u201e": '"', "\u201f": '"',
+    "\u2013": "-", "\u2014": "-", "\u2212": "-", "\xa0": " ",
+}
+_SENTENCE_END = re.compile(r"(?<=[.?!])[\"')\]]*\s+")
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be been by for from had has have he her his in is it its of on or "
+    "that the their there they this to was were which who with would".split()
+)
+
+
+class QuoteMatch(NamedTuple):
+    start: int
+    end: int
+    score: float
+    exact: bool
+
+
+def check_quote_sourcing_mode(mode: str) -> str:
+    """Returns `mode` if it is one of QUOTE_SOURCING_MODES; raises ValueError otherwise."""
+    if mode not in QUOTE_SOURCING_MODES:
+        raise ValueError(f"Unknown QUOTE_SOURCING_MODE '{mode}'. Choose one of: {', '.join(QUOTE_SOURCING_MODES)}.")
+    return mode
+
+
+def normalize_with_offsets(text: str) -> Tuple[str, List[int]]:
+    """
+    Normalizes `text` in a single pass and returns (normalized, offsets), where
+    offsets[i] is the index in `text` of normalized character i.
+    """
+    chars: List[str] = []
+    offsets: List[int] = []
+    pending_space = False
+    for i, ch in enumerate(text):
+        ch = _CHAR_FOLDS.get(ch, ch)
+        if ch.isspace():
+            pending_space = bool(chars)
+            continue
+        if pending_space:
+            chars.append(" ")
+            offsets.append(i - 1)
+            pending_space = False
+        for lowered in ch.lower():
+            chars.append(lowered)
+            offsets.append(i)
+    return "".join(chars), offsets
+
+
+def normalize(text: str) -> str:
+    return normalize_with_offsets(text)[0]
+
+
+def _tokens(normalized_text: str) -> List[str]:
+    return [t for t in _WORD.findall(normalized_text) if t not in _STOPWORDS]
+
+
+class QuoteIndex:
+    """Index over a single decision's text. Build once per decision and reuse for every stage."""
+
+    def __init__(self, text: str, to_original: Optional[Callable[[int, int], Tuple[int, int]]] = None,
+                 original_text: Optional[str] = None):
+        self.text = text
+        # Maps spans of a compacted text back to `original_text`, the text it was compacted from (see compaction.py).
+        self.to_original = to_original
+        self.original_text = original_text
+        self.normalized, self._offsets = normalize_with_offsets(text)
+        self.sentences = self._split_sentences(text)
+        self._sentence_tokens = [Counter(_tokens(normalize(text[s:e]))) for s, e in self.sentences]
+        doc_freq = Counter()
+        for counts in self._sentence_tokens:
+            doc_freq.update(counts.keys())
+        n = max(len(self.sentences), 1)
+        self._idf = {t: math.log(1 + n / df) for t, df in doc_freq.items()}
+
+    @staticmethod
+    def _split_sentences(text: str) -> List[Tuple[int, int]]:
+        spans = []
+        start = 0
+        for m in _SENTENCE_END.finditer(text):
+            if m.start() > start:
+                spans.append((start, m.start()))
+            start = m.end()
+        if start < len(text) and text[start:].strip():
+            spans.append((start, len(text)))
+        return spans
+
+    def _to_original(self, norm_start: int, norm_end: int) -> Tuple[int, int]:
+        return self._offsets[norm_start], self._offsets[norm_end - 1] + 1
+
+    def is_verbatim(self, quote: str) -> bool:
+        """True if `quote` occurs in the text, up to case, whitespace and typographic quotes."""
+        match = self.locate(quote)
+        return bool(match and match.exact)
+
+    def locate(self, quote: str) -> Optional[QuoteMatch]:
+        """
+        Finds `quote` in the text and returns its original character offsets, or None.
+        Exact (normalized) matches are tried first. If that fails, the quote is aligned
+        against its best candidate sentences so small LLM copy errors still resolve.
+        """
+        if not quote or quote.strip() == NO_QUOTE_FOUND:
+            return None
+        needle = normalize(quote).strip(" \"'")
+        if not needle:
+            return None
+
+        pos = self.normalized.find(needle)
+        if pos != -1:
+            start, end = self._to_original(pos, pos + len(needle))
+            return QuoteMatch(start, end, 1.0, True)
+
+        best = None
+        for s_start, s_end, _ in self.best_passages(quote, k=3, neighbours=1):
+            match = self._align(needle, s_start, s_end)
+            if match and (best is None or match.score > best.score):
+                best = match
+        if best and best.score >= FUZZY_MATCH_THRESHOLD:
+            return best
+        return None
+
+    def _align(self, needle: str, start: int, end: int) -> Optional[QuoteMatch]:
+        norm_start = self._norm_index(start)
+        norm_end = self._norm_index(end)
+        haystack = self.normalized[norm_start:norm_end]
+        matcher = difflib.SequenceMatcher(None, haystack, needle, autojunk=False)
+        blocks = [b for b in matcher.get_matching_blocks() if b.size]
+        if not blocks:
+            return None
+        matched = sum(b.size for b in blocks)
+        first, last = blocks[0], blocks[-1]
+        # Scattered character matches across a long window must not count as a quote.
+        span = last.a + last.size - first.a
+        orig_start, orig_end = self._to_original(norm_start + first.a, norm_start + last.a + last.size)
+        return QuoteMatch(orig_start, orig_end, matched / max(len(needle), span), False)
+
+    def _norm_index(self, original_offset: int) -> int:
+        # Offsets are sorted, so a binary search finds the first normalized char at or after the offset.
+        lo, hi = 0, len(self._offsets)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._offsets[mid] < original_offset:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def best_passages(self, query: str, k: int = 3, neighbours: int = 0) -> List[Tuple[int, int, float]]:
+        """
+        Returns up to `k` (start, end, score) passages that best support `query`, ranked by
+        idf-weighted term overlap. `neighbours` widens each passage by that many sentences on each side.
+        """
+        query_terms = set(_tokens(normalize(query)))
+        if not query_terms or not self.sentences:
+            return []
+        scored = []
+        for i, counts in enumerate(self._sentence_tokens):
+            overlap = query_terms.intersection(counts)
+            if overlap:
+                score = sum(self._idf[t] for t in overlap) / math.sqrt(1 + sum(counts.values()))
+                scored.append((score, i))
+        scored.sort(reverse=True)
+        passages = []
+        for score, i in scored[:k]:
+            lo = max(0, i - neighbours)
+            hi = min(len(self.sentences) - 1, i + neighbours)
+            passages.append((self.sentences[lo][0], self.sentences[hi][1], score))
+        return passages
+
+    def best_quote(self, query: str) -> str:
+        """The single best supporting sentence for `query`, or NO_QUOTE_FOUND."""
+        passages = self.best_passages(query, k=1)
+        if not passages:
+            return NO_QUOTE_FOUND
+        start, end, _ = passages[0]
+        return self.text[start:end].strip()
+
+    def candidate_context(self, queries: Iterable[str], k_per_query: int = 3, neighbours: int = 1,
+                          max_chars: int = 20000) -> str:
+        """
+        Builds a reduced "decision text" for a sourcing prompt: the best candidate windows
+        for every query, merged and kept in document order. Falls back to the full text
+        when the windows would not be meaningfully smaller.
+        """
+        spans = []
+        for query in queries:
+            spans.extend((s, e) for s, e, _ in self.best_passages(query, k=k_per_query, neighbours=neighbours))
+        if not spans:
+            return self.text
+
+        spans.sort()
+        merged = [list(spans[0])]
+        for s, e in spans[1:]:
+            if s <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], e)
+            else:
+                merged.append([s, e])
+
+        windows, total = [], 0
+        for s, e in merged:
+            if total + (e - s) > max_chars:
+                break
+            windows.append(self.text[s:e].strip())
+            total += e - s
+        if not windows or total >= 0.8 * len(self.text):
+            return self.text
+        return "\n[...]\n".join(windows)
+
+    def annotate(self, sourced_items: List[Dict]) -> List[Dict]:
+        """
+        Adds `quote_verified`, `quote_start` and `quote_end` to each sourced item dict.
+        Offsets refer to the cleaned decision text, before any compaction. A quote that spans
+        text compaction removed is replaced by the original passage its offsets cover.
+
+        Only exact (normalized) matches are verified. A fuzzy match still gets the offsets of the
+        closest passage, but a few changed characters can invert a holding ("did not have").
+        """
+        for item in sourced_items:
+            match = self.locate(item.get("supporting_quote", ""))
+            start, end = (match.start, match.end) if match else (None, None)
+            if match and self.to_original:
+                start, end = self.to_original(start, end)
+                # Compaction only deletes, so the span only grows when it crosses removed text.
+                if match.exact and end - start != match.end - match.start:
+                    item["supporting_quote"] = self.original_text[start:end]
+            item["quote_verified"] = bool(match and match.exact)
+            item["quote_start"] = start
+            item["quote_end"] = end
+        return sourced_items
@@ -0,0 +1,182 @@
+# rate_limiter.py
+"""
+Admission control for Gemini calls.
+
+Every LLM call estimates its input tokens up front and waits for room in two token
+buckets, one for requests per minute and one for tokens per minute, before it is sent.
+Quota errors (429 / ResourceExhausted) are retried with exponential backoff and full
+jitter. They also halve the admitted rate for the whole process, which then recovers
+gradually as calls succeed. This keeps throughput at the quota ceiling instead of
+bursting and collapsing.
+"""
+import os
+import random
+import threading
+import time
+from typing import Callable, Optional, TypeVar
+
+GEMINI_RPM_LIMIT = int(os.environ.get("GEMINI_RPM_LIMIT", "150"))
+GEMINI_TPM_LIMIT = int(os.environ.get("GEMINI_TPM_LIMIT", "2000000"))
+RATE_LIMIT_MAX_RETRIES = int(os.environ.get("RATE_LIMIT_MAX_RETRIES", "8"))
+BACKOFF_BASE_SECONDS = float(os.environ.get("RATE_LIMIT_BACKOFF_BASE_SECONDS", "2"))
+BACKOFF_MAX_SECONDS = float(os.environ.get("RATE_LIMIT_BACKOFF_MAX_SECONDS", "120"))
+
+# Adaptive rate: multiplied by this on every quota error, raised by the step on every success.
+_DECREASE_FACTOR = 0.5
+_INCREASE_STEP = 0.05
+_MIN_RATE_SCALE = 0.1
+
+# HTTP status of a quota error. Errors are classified by type and status, never by message text:
+# a parser error carries the model's output, and New York citations ("130 AD3d 1429") contain "429".
+_QUOTA_STATUS_CODE = 429
+
+_encoding = None
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+T = TypeVar("T")
+
+
+class RateLimitExhausted(Exception):
+    """Raised when a call still hits quota errors after every retry. The document should be retried later, not failed."""
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the token count of `text` with tiktoken's cl100k_base encoding.
+    Gemini uses its own tokenizer, so this is an approximation, but it is close enough for admission control.
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"WARNING: tiktoken unavailable ({e}); estimating tokens from character count.")
+            _encoding = False
+    if _encoding is False:
+        return len(text) // 4
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def _quota_error_types() -> tuple:
+    # Imported here, so that commands which never call the LLM do not load the client libraries.
+    types = []
+    try:
+        from google.api_core.exceptions import ResourceExhausted, TooManyRequests
+        types += [ResourceExhausted, TooManyRequests]
+    except ImportError:
+        pass
+    try:
+        from langchain_core.exceptions import ModelRateLimitError
+        types.append(ModelRateLimitError)
+    except ImportError:
+        pass
+    return tuple(types)
+
+
+def is_quota_error(error: Exception) -> bool:
+    """
+    True if `error`, or an exception it was raised from, is a quota error: google.api_core's
+    ResourceExhausted, LangChain's rate limit error, or a google-genai error with status 429.
+    """
+    quota_types = _quota_error_types()
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, quota_types) or getattr(error, "code", None) == _QUOTA_STATUS_CODE:
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class TokenBucket:
+    """Classic token bucket that refills continuously at `capacity` units per minute."""
+
+    def __init__(self, capacity_per_minute: float):
+        self.capacity = float(capacity_per_minute)
+        self.available = self.capacity
+        self._updated = time.monotonic()
+
+    def refill(self, now: float, rate_scale: float):
+        elapsed = now - self._updated
+        self._updated = now
+        self.available = min(self.capacity, self.available + elapsed * self.capacity * rate_scale / 60.0)
+
+    def seconds_until(self, amount: float, rate_scale: float) -> float:
+        deficit = min(amount, self.capacity) - self.available
+        if deficit <= 0:
+            return 0.0
+        return deficit / (self.capacity * rate_scale / 60.0)
+
+
+class LLMScheduler:
+    """Process-wide RPM/TPM admission control with adaptive backoff on quota errors."""
+
+    def __init__(self, rpm_limit: int, tpm_limit: int, max_retries: int = RATE_LIMIT_MAX_RETRIES):
+        self.requests = TokenBucket(rpm_limit)
+        self.tokens = TokenBucket(tpm_limit)
+        self.max_retries = max_retries
+        self.rate_scale = 1.0
+        self.quota_errors = 0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, estimated_tokens: int):
+        """Blocks until one request and `estimated_tokens` tokens can be admitted, then reserves them."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.requests.refill(now, self.rate_scale)
+                self.tokens.refill(now, self.rate_scale)
+                wait = max(
+                    self._paused_until - now,
+                    self.requests.seconds_until(1, self.rate_scale),
+                    self.tokens.seconds_until(estimated_tokens, self.rate_scale),
+                )
+                if wait <= 0:
+                    self.requests.available -= 1
+                    self.tokens.available -= min(estimated_tokens, self.tokens.capacity)
+                    return
+            time.sleep(min(wait, BACKOFF_MAX_SECONDS))
+
+    def _on_success(self):
+        with self._lock:
+            self.rate_scale = min(1.0, self.rate_scale + _INCREASE_STEP)
+
+    def _on_quota_error(self, attempt: int) -> float:
+        delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+        with self._lock:
+            self.quota_errors += 1
+            self.rate_scale = max(_MIN_RATE_SCALE, self.rate_scale * _DECREASE_FACTOR)
+            # Every worker waits out the cooldown, not just the one that saw the error.
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+    def call(self, fn: Callable[[], T], estimated_tokens: int, label: Optional[str] = None) -> T:
+        """Runs `fn` once admitted, retrying quota errors. Other errors are raised immediately."""
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            self.acquire(estimated_tokens)
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_quota_error(e):
+                    raise
+                last_error = e
+                delay = self._on_quota_error(attempt)
+                print(f"Quota error on {label or 'LLM call'} (attempt {attempt + 1}/{self.max_retries + 1}); "
+                      f"backing off {delay:.1f}s, rate scale now {self.rate_scale:.2f}.")
+                continue
+            self._on_success()
+            return result
+        raise RateLimitExhausted(f"{label or 'LLM call'} still rate limited after {self.max_retries + 1} attempts: {last_error}")
+
+
+def get_scheduler() -> LLMScheduler:
+    """Returns the process-wide scheduler shared by every worker and sourcing thread."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler(GEMINI_RPM_LIMIT, GEMINI_TPM_LIMIT)
+    return _scheduler
@@ -1,122 +1,371 @@
 import json
-from typing import Optional, List, Dict, Any, Tuple
-from langchain_google_genai import ChatGoogleGenerativeAI
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, List, Dict, Any, Tuple, Callable, NamedTuple
+from langchain_core.callbacks import BaseCallbackHandler
 
 # Local imports
-from models import LegalBrief, SourcedTakeaway, HoldingDetail, SourcedIssue, SourcedHolding
+from models import CombinedLegalBrief, LegalBrief, SourcedTakeaway, HoldingDetail, SourcedIssue, SourcedHolding
 from prompts import (
     legal_brief_prompt, legal_brief_parser,
     sourcing_prompt, sourcing_parser,
     issues_sourcing_prompt, issues_sourcing_parser,
-    holdings_sourcing_prompt, holdings_sourcing_parser
+    holdings_sourcing_prompt, holdings_sourcing_parser,
+    combined_brief_prompt, combined_brief_parser,
+    legal_brief_prompt_template_text, sourcing_prompt_template_text,
+    issues_sourcing_prompt_template_text, holdings_sourcing_prompt_template_text,
+    combined_brief_prompt_template_text
 )
+from chunking import CHUNK_TOKEN_BUDGET, choose_pipeline, merge_briefs, split_into_chunks
+from compaction import COMPACTION_ENABLED, COMPACTION_FINGERPRINT, CompactedText, compact
+from instrumentation import DocumentTrace
+from model_router import ROUTER_MIN_QUOTE_MATCH, SUMMARY_MODE, ModelRoute, check_summary_mode
+from quote_index import QUOTE_SOURCING_MODE, QuoteIndex
+from rate_limiter import RateLimitExhausted, estimate_tokens, get_scheduler
+from summary_cache import cache_key, get_summary_cache
 
-llm_instance = None
+_llm_lock = threading.Lock()
 
-def get_llm_instance(api_key: str):
-    """Initializes and returns a reusable LLM instance."""
-    global llm_instance
-    if llm_instance is None:
-        llm_instance = ChatGoogleGenerativeAI(
-            model="gemini-1.5-pro",
-            temperature=0.1,
-            google_api_key=api_key
-        )
-        print("Initialized Gemini 1.5 Pro client.")
-    return llm_instance
+# The four quote-sourcing calls only depend on the step-1 brief, so they can overlap.
+# The pool is shared by every worker thread, which also caps total in-flight sourcing calls.
+PARALLEL_SOURCING = os.environ.get("PARALLEL_SOURCING", "true").lower() == "true"
+SOURCING_CONCURRENCY = int(os.environ.get("SOURCING_CONCURRENCY", "8"))
+_sourcing_executor = None
 
-# --- Helper functions are modified to return usage data ---
 
-def _source_takeaways(takeaways: List[str], full_text: str, llm_instance) -> Tuple[Optional[List[SourcedTakeaway]], dict]:
+def _stage_fingerprint(template_text: str, parser) -> str:
+    """Hash of a stage's prompt template and output schema; changes whenever either is edited."""
+    schema = json.dumps(parser.pydantic_object.model_json_schema(), sort_keys=True)
+    return cache_key(template_text, schema)
+
+STAGE_FINGERPRINTS = {
+    "brief": _stage_fingerprint(legal_brief_prompt_template_text, legal_brief_parser),
+    "facts": _stage_fingerprint(sourcing_prompt_template_text, sourcing_parser),
+    "rationale": _stage_fingerprint(sourcing_prompt_template_text, sourcing_parser),
+    "issues": _stage_fingerprint(issues_sourcing_prompt_template_text, issues_sourcing_parser),
+    "holdings": _stage_fingerprint(holdings_sourcing_prompt_template_text, holdings_sourcing_parser),
+}
+# Kept out of STAGE_FINGERPRINTS so that adding the combined mode left the multi-call cache keys unchanged.
+COMBINED_FINGERPRINT = _stage_fingerprint(combined_brief_prompt_template_text, combined_brief_parser)
+
+def get_sourcing_executor() -> ThreadPoolExecutor:
+    """Returns the process-wide thread pool used to fan out the sourcing stages."""
+    global _sourcing_executor
+    with _llm_lock:
+        if _sourcing_executor is None:
+            _sourcing_executor = ThreadPoolExecutor(max_workers=SOURCING_CONCURRENCY, thread_name_prefix="sourcing")
+    return _sourcing_executor
+
+# --- Usage tracking ---
+
+class _UsageCallback(BaseCallbackHandler):
+    """Records token usage from the raw LLM response, before the output parser discards it."""
+
+    def __init__(self, trace: DocumentTrace, stage: str, model: str):
+        self.trace = trace
+        self.stage = stage
+        self.model = model
+
+    def on_llm_end(self, response, **kwargs):
+        input_tokens = output_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+        self.trace.record_llm_call(self.stage, input_tokens, output_tokens, model=self.model)
+
+def _invoke_traced(prompt, parser, inputs: Dict[str, Any], trace: DocumentTrace, stage: str, route: ModelRoute,
+                   model: Optional[str] = None):
+    """
+    Invokes `prompt | model | parser` through the rate limiter, timing it as `stage` and recording its token usage on `trace`.
+    The input size is estimated up front so the call is only sent once the TPM budget has room for it.
+    `model` defaults to the route's choice for the stage; if the call fails (e.g. the response does not parse),
+    it is repeated once on the route's stronger model.
+    """
+    model = model or route.model_for(stage)
+    estimated = estimate_tokens("".join(str(value) for value in inputs.values()))
+
+    def _call(call_model: str):
+        chain = prompt | route.client(call_model) | parser
+        with trace.stage(stage):
+            return get_scheduler().call(
+                lambda: chain.invoke(inputs, config={"callbacks": [_UsageCallback(trace, stage, call_model)]}),
+                estimated_tokens=estimated,
+                label=stage,
+            )
+
+    try:
+        return _call(model)
+    except RateLimitExhausted:
+        raise
+    except Exception as e:
+        stronger = route.escalation_for(model)
+        if not stronger:
+            raise
+        print(f"Stage {stage} failed on {model} ({e}); retrying on {stronger}.")
+        _record_escalation(trace, stage)
+        return _call(stronger)
+
+def _record_escalation(trace: DocumentTrace, stage: str):
+    with _llm_lock:
+        trace.extra.setdefault("escalated_stages", []).append(stage)
+
+def _was_escalated(trace: DocumentTrace, stage: str) -> bool:
+    """Whether a call of `stage` already had to move to the stronger model (e.g. after a parse failure)."""
+    with _llm_lock:
+        return stage in trace.extra.get("escalated_stages", ())
+
+def _quote_match_rate(sourced_items: list, index: QuoteIndex) -> float:
+    """Share of the items' supporting quotes found verbatim in the decision text."""
+    if not sourced_items:
+        return 1.0
+    return sum(1 for item in sourced_items if index.is_verbatim(item.supporting_quote)) / len(sourced_items)
+
+# --- Sourcing stages ---
+# The public part is shared with batch_mode.py, so both paths ask for and build quotes the same way.
+
+class SourcingStage(NamedTuple):
+    """How one quote-sourcing stage is prompted and parsed."""
+    prompt: Any
+    parser: Any
+    items_variable: str  # prompt variable that receives the items as JSON
+    attribute: str       # attribute of the parsed response holding the sourced items
+    model: type          # the Sourced* model of one item
+
+SOURCING_STAGES = {
+    "facts": SourcingStage(sourcing_prompt, sourcing_parser, "takeaways_json_list", "sourced_takeaways", SourcedTakeaway),
+    "rationale": SourcingStage(sourcing_prompt, sourcing_parser, "takeaways_json_list", "sourced_takeaways", SourcedTakeaway),
+    "issues": SourcingStage(issues_sourcing_prompt, issues_sourcing_parser, "issues_json_list", "sourced_issues", SourcedIssue),
+    "holdings": SourcingStage(holdings_sourcing_prompt, holdings_sourcing_parser, "holdings_json_list", "sourced_holdings", SourcedHolding),
+}
+
+def stage_items(brief: LegalBrief) -> Dict[str, list]:
+    """The items of the step-1 brief that each sourcing stage finds quotes for."""
+    return {
+        "facts": brief.brief_step_3_key_facts_takeaways,
+        "rationale": brief.brief_step_7_rationale_takeaways,
+        "issues": brief.brief_step_5_issues_as_questions,
+        "holdings": brief.brief_step_6_holdings_summary,
+    }
+
+def sourcing_items_json(items: list) -> str:
+    """A stage's items as the JSON list its prompt expects."""
+    return json.dumps([i.model_dump() if isinstance(i, HoldingDetail) else i for i in items or []])
+
+def sourcing_text(items: list, search_text: str, index: QuoteIndex) -> str:
+    """The decision text sent to a sourcing call: the opinion (or its chunk), or only the candidate windows."""
+    if QUOTE_SOURCING_MODE != "windows" or not items:
+        return search_text
+    return index.candidate_context(_sourcing_query(item) for item in items)
+
+def source_locally(stage: str, items: list, index: QuoteIndex) -> list:
+    """Builds the same Sourced* objects as the LLM calls, using the local index's best sentence."""
+    label = _stage_label(stage)
+    model = SOURCING_STAGES[label].model
+    sourced = []
+    for item in items or []:
+        quote = index.best_quote(_sourcing_query(item))
+        if label == "holdings":
+            sourced.append(model(**item.model_dump(), supporting_quote=quote))
+        elif label == "issues":
+            sourced.append(model(issue_question=item, supporting_quote=quote))
+        else:
+            sourced.append(model(takeaway=item, supporting_quote=quote))
+    return sourced
+
+# --- Sourcing helpers ---
+
+def _source_takeaways(takeaways: List[str], full_text: str, route: ModelRoute, trace: DocumentTrace, stage: str,
+                      model: Optional[str] = None) -> Optional[List[SourcedTakeaway]]:
     if not takeaways:
-        return [], {}
+        return []
     try:
         print(f"Sourcing quotes for {len(takeaways)} takeaways...")
-        sourcing_chain = sourcing_prompt | llm_instance | sourcing_parser
-        response_obj = sourcing_chain.invoke({ "full_text": full_text, "takeaways_json_list": json.dumps(takeaways) })
-        usage = getattr(response_obj, 'response_metadata', {})
+        response_obj = _invoke_traced(sourcing_prompt, sourcing_parser, { "full_text": full_text, "takeaways_json_list": json.dumps(takeaways) }, trace, stage, route, model)
         print("Sourcing successful.")
-        return response_obj.sourced_takeaways, usage
+        return response_obj.sourced_takeaways
+    except RateLimitExhausted:
+        raise
     except Exception as e:
         print(f"ERROR during quote sourcing: {e}")
-        return None, {}
+        return None
 
-def _source_issues(issues: List[str], full_text: str, llm_instance) -> Tuple[Optional[List[SourcedIssue]], dict]:
+def _source_issues(issues: List[str], full_text: str, route: ModelRoute, trace: DocumentTrace, stage: str,
+                   model: Optional[str] = None) -> Optional[List[SourcedIssue]]:
     if not issues:
-        return [], {}
+        return []
     try:
         print(f"Sourcing quotes for {len(issues)} issues...")
-        sourcing_chain = issues_sourcing_prompt | llm_instance | issues_sourcing_parser
-        response_obj = sourcing_chain.invoke({ "full_text": full_text, "issues_json_list": json.dumps(issues) })
-        usage = getattr(response_obj, 'response_metadata', {})
+        response_obj = _invoke_traced(issues_sourcing_prompt, issues_sourcing_parser, { "full_text": full_text, "issues_json_list": json.dumps(issues) }, trace, stage, route, model)
         print("Issue sourcing successful.")
-        return response_obj.sourced_issues, usage
+        return response_obj.sourced_issues
+    except RateLimitExhausted:
+        raise
     except Exception as e:
         print(f"ERROR during issue sourcing: {e}")
-        return None, {}
+        return None
 
-def _source_holdings(holdings: List[HoldingDetail], full_text: str, llm_instance) -> Tuple[Optional[List[SourcedHolding]], dict]:
+def _source_holdings(holdings: List[HoldingDetail], full_text: str, route: ModelRoute, trace: DocumentTrace, stage: str,
+                     model: Optional[str] = None) -> Optional[List[SourcedHolding]]:
     if not holdings:
-        return [], {}
+        return []
     try:
         print(f"Sourcing quotes for {len(holdings)} holdings...")
         holdings_as_dict = [h.model_dump() for h in holdings]
-        sourcing_chain = holdings_sourcing_prompt | llm_instance | holdings_sourcing_parser
-        response_obj = sourcing_chain.invoke({ "full_text": full_text, "holdings_json_list": json.dumps(holdings_as_dict) })
-        usage = getattr(response_obj, 'response_metadata', {})
+        response_obj = _invoke_traced(holdings_sourcing_prompt, holdings_sourcing_parser, { "full_text": full_text, "holdings_json_list": json.dumps(holdings_as_dict) }, trace, stage, route, model)
         print("Holding sourcing successful.")
-        return response_obj.sourced_holdings, usage
+        return response_obj.sourced_holdings
+    except RateLimitExhausted:
+        raise
     except Exception as e:
         print(f"ERROR during holding sourcing: {e}")
-        return None, {}
-
-# --- The main function, now corrected and with better cost tracking ---
+        return None
 
-def generate_structured_brief(full_text: str, api_key: str) -> Tuple[Optional[Dict[str, Any]], Dict[str, int]]:
+def _run_sourcing_stages(stages: Dict[str, tuple], full_text: str, route: ModelRoute, index: QuoteIndex, text_hash: str,
+                         trace: DocumentTrace, on_result: Optional[Callable[[str, Optional[list]], None]] = None) -> Dict[str, Optional[list]]:
     """
-    Takes raw text, runs the full AI pipeline, and returns a tuple containing:
-    1. The final structured data dictionary.
-    2. A dictionary with the TOTAL token usage for all calls.
+    Runs each sourcing stage and returns {stage_name: sourced items, or None if the stage failed}.
+    `stages` maps a stage name to (helper, items, text to search); in chunked mode a stage is
+    split into "facts#0", "facts#1", ... parts, one per chunk. Stages already in the summary cache are not re-run. The rest run concurrently
+    unless PARALLEL_SOURCING is off. Each helper already catches its own errors, and
+    a stage that still raises is recorded as failed (None) without affecting the others.
+    `on_result(name, items)` is called as each LLM-sourced stage finishes.
     """
-    llm = get_llm_instance(api_key)
-    
-    total_usage = {"prompt_token_count": 0, "candidates_token_count": 0}
+    if QUOTE_SOURCING_MODE == "local":
+        with trace.stage("local_sourcing"):
+            return {name: source_locally(name, items, index) for name, (_, items, _) in stages.items()}
 
-    def _accumulate_usage(usage: dict):
-        total_usage["prompt_token_count"] += usage.get("prompt_token_count", 0)
-        total_usage["candidates_token_count"] += usage.get("candidates_token_count", 0)
+    cache = get_summary_cache()
+    results, keys, jobs = {}, {}, {}
+    for name, (helper, items, search_text) in stages.items():
+        keys[name] = _sourcing_cache_key(name, items, text_hash, route)
+        cached = cache.get(_stage_label(name), keys[name]) if cache and items else None
+        if cached is not None:
+            model = SOURCING_STAGES[_stage_label(name)].model
+            results[name] = [model(**entry) for entry in cached]
+        else:
+            jobs[name] = (helper, items, sourcing_text(items, search_text, index), route, trace, name, index)
+
+    def _finished(name, sourced_items):
+        results[name] = sourced_items
+        if cache and sourced_items:
+            cache.put(_stage_label(name), keys[name], [item.model_dump() for item in sourced_items])
+        if on_result:
+            on_result(name, sourced_items)
+
+    if not PARALLEL_SOURCING:
+        for name, job in jobs.items():
+            _finished(name, _run_isolated(*job))
+    else:
+        executor = get_sourcing_executor()
+        futures = {executor.submit(_run_isolated, *job): name for name, job in jobs.items()}
+        for future in as_completed(futures):
+            _finished(futures[future], future.result())
+    # Back in stage order, which _combine_stage_parts relies on for chunk order.
+    return {name: results[name] for name in stages}
+
+def _stage_label(name: str) -> str:
+    """Stage name without the chunk suffix, e.g. "facts#2" -> "facts"."""
+    return name.split("#", 1)[0]
+
+def _combine_stage_parts(results: Dict[str, Optional[list]], stage: str) -> Optional[list]:
+    """Concatenates a stage's per-chunk results in chunk order. The stage failed if any part failed."""
+    parts = [value for name, value in results.items() if _stage_label(name) == stage]
+    if any(part is None for part in parts):
+        return None
+    return [item for part in parts for item in part]
+
+def _sourcing_cache_key(stage: str, items: list, text_hash: str, route: ModelRoute) -> str:
+    label = _stage_label(stage)
+    return cache_key(stage, text_hash, route.model_for(label), STAGE_FINGERPRINTS[label], QUOTE_SOURCING_MODE,
+                     sourcing_items_json(items))
+
+def _run_isolated(helper, items, stage_text: str, route: ModelRoute, trace: DocumentTrace, stage: str,
+                  index: QuoteIndex) -> Optional[list]:
+    """Runs one sourcing stage. A stage whose quotes are mostly not in the text is repeated on the stronger model."""
+    label = _stage_label(stage)
+    try:
+        model = route.model_for(label)
+        sourced = helper(items, stage_text, route, trace, label)
+        stronger = route.escalation_for(model)
+        if not sourced or not stronger or _was_escalated(trace, label):
+            return sourced
+        match_rate = _quote_match_rate(sourced, index)
+        if match_rate >= ROUTER_MIN_QUOTE_MATCH:
+            return sourced
+        print(f"Only {match_rate:.0%} of the {stage} quotes from {model} were found in the text; retrying on {stronger}.")
+        _record_escalation(trace, label)
+        retried = helper(items, stage_text, route, trace, label, model=stronger)
+        if retried and _quote_match_rate(retried, index) >= match_rate:
+            return retried
+        return sourced
+    except RateLimitExhausted:
+        raise
+    except Exception as e:
+        print(f"ERROR during sourcing stage {stage}: {e}")
+        return None
+
+# The online LLM call of each sourcing stage.
+_SOURCING_HELPERS = {
+    "facts": _source_takeaways,
+    "rationale": _source_takeaways,
+    "issues": _source_issues,
+    "holdings": _source_holdings,
+}
+
+def _sourcing_query(item) -> str:
+    """The text a supporting quote has to back up: the legal principle for holdings, the item itself otherwise."""
+    return item.legal_principle if isinstance(item, HoldingDetail) else item
+
+def _generate_chunk_brief(text: str, route: ModelRoute, trace: DocumentTrace) -> Optional[LegalBrief]:
+    """Step-1 brief for one text (the whole decision, or a single chunk), served from the cache when possible."""
+    cache = get_summary_cache()
+    brief_key = cache_key("brief", cache_key(text), route.model_for("brief"), STAGE_FINGERPRINTS["brief"])
+    cached_brief = cache.get("brief", brief_key) if cache else None
+    if cached_brief is not None:
+        print("Summary cache hit: reusing the stored main legal brief.")
+        return LegalBrief(**cached_brief)
 
-    # STEP 1: Generate the main brief (unsourced)
     print("Generating main legal brief...")
-    brief_generation_chain = legal_brief_prompt | llm | legal_brief_parser
-    response_obj = brief_generation_chain.invoke({"court_decision_full_text": full_text})
-    
-    unsourced_brief = response_obj
-    brief_usage = getattr(response_obj, 'response_metadata', {})
-    _accumulate_usage(brief_usage)
-
-    if not unsourced_brief:
-        print("ERROR: Main brief generation failed, returned None.")
-        return None, total_usage
-    
-    # Update the format note using the court name that was already extracted
-    court_name = unsourced_brief.brief_step_2_caption.court
-    dynamic_format_note = f"This is an AI generated summary of a decision from {court_name}."
-    unsourced_brief.brief_step_1_format_note = dynamic_format_note
-    print(f"Updated format note: {dynamic_format_note}")
-    
-    # STEP 2: Source quotes and accumulate usage from each call
-    sourced_facts, facts_usage = _source_takeaways(unsourced_brief.brief_step_3_key_facts_takeaways, full_text, llm)
-    _accumulate_usage(facts_usage)
-    
-    sourced_rationale, rationale_usage = _source_takeaways(unsourced_brief.brief_step_7_rationale_takeaways, full_text, llm)
-    _accumulate_usage(rationale_usage)
-    
-    sourced_issues, issues_usage = _source_issues(unsourced_brief.brief_step_5_issues_as_questions, full_text, llm)
-    _accumulate_usage(issues_usage)
-    
-    sourced_holdings, holdings_usage = _source_holdings(unsourced_brief.brief_step_6_holdings_summary, full_text, llm)
-    _accumulate_usage(holdings_usage)
+    brief = _invoke_traced(legal_brief_prompt, legal_brief_parser, {"court_decision_full_text": text}, trace, "brief", route)
+    if cache and brief:
+        cache.put("brief", brief_key, brief.model_dump())
+    return brief
+
+def _generate_brief(chunks: List[str], route: ModelRoute, trace: DocumentTrace) -> Tuple[Optional[LegalBrief], Optional[Dict[str, List[int]]]]:
+    """
+    Returns (brief, origins). For a single chunk origins is None; otherwise the chunks
+    are briefed separately (map) and merged (reduce), and origins records which chunk
+    each merged item came from.
+    """
+    if len(chunks) == 1:
+        return _generate_chunk_brief(chunks[0], route, trace), None
+
+    print(f"Decision split into {len(chunks)} chunks; briefing each chunk...")
+    if PARALLEL_SOURCING:
+        executor = get_sourcing_executor()
+        futures = [executor.submit(_generate_chunk_brief, chunk, route, trace) for chunk in chunks]
+        partials = [future.result() for future in futures]
+    else:
+        partials = [_generate_chunk_brief(chunk, route, trace) for chunk in chunks]
+    if any(partial is None for partial in partials):
+        return None, None
+    return merge_briefs(partials)
+
+def assemble_structured_data(unsourced_brief: LegalBrief, sourced: Dict[str, Optional[list]], quote_index: QuoteIndex,
+                             trace: Optional[DocumentTrace] = None) -> Dict[str, Any]:
+    """
+    Builds the `ai_generated_brief` dictionary from the step-1 brief and the sourced lists
+    ({"facts", "rationale", "issues", "holdings"}; a failed stage is None), and checks every
+    quote against the decision text.
+    """
+    trace = trace or DocumentTrace()
+    sourced_facts = sourced["facts"]
+    sourced_rationale = sourced["rationale"]
+    sourced_issues = sourced["issues"]
+    sourced_holdings = sourced["holdings"]
 
     # STEP 3: Assemble the final, complete dictionary
     final_structured_data = {
@@ -127,4 +376,223 @@ def generate_structured_brief(full_text: str, api_key: str) -> Tuple[Optional[Di
         "sourced_holdings": [sh.model_dump() for sh in sourced_holdings] if sourced_holdings else [],
     }
 
-    return final_structured_data, total_usage
\ No newline at end of file
+    # Check every returned quote against the decision text and record where it appears.
+    with trace.stage("quote_verification"):
+        for key in ("sourced_facts", "sourced_rationale", "sourced_issues", "sourced_holdings"):
+            quote_index.annotate(final_structured_data[key])
+    return final_structured_data
+
+def set_format_note(unsourced_brief: LegalBrief):
+    """Replaces the model's format note with one naming the court that was already extracted."""
+    court_name = unsourced_brief.brief_step_2_caption.court
+    dynamic_format_note = f"This is an AI generated summary of a decision from {court_name}."
+    unsourced_brief.brief_step_1_format_note = dynamic_format_note
+    print(f"Updated format note: {dynamic_format_note}")
+
+# --- Single-call mode ---
+
+def split_combined_brief(combined: CombinedLegalBrief) -> Tuple[LegalBrief, Dict[str, list]]:
+    """Splits a combined response into the step-1 brief and the sourced lists the multi-call pipeline would have produced."""
+    brief = LegalBrief(
+        brief_step_1_format_note=combined.brief_step_1_format_note,
+        brief_step_2_caption=combined.brief_step_2_caption,
+        brief_step_3_key_facts_takeaways=[f.takeaway for f in combined.brief_step_3_key_facts_sourced],
+        brief_step_4_procedural_history=combined.brief_step_4_procedural_history,
+        brief_step_5_issues_as_questions=[i.issue_question for i in combined.brief_step_5_issues_sourced],
+        brief_step_6_holdings_summary=[
+            HoldingDetail(issue_question=h.issue_question, answer=h.answer, legal_principle=h.legal_principle)
+            for h in combined.brief_step_6_holdings_sourced
+        ],
+        brief_step_7_rationale_takeaways=[r.takeaway for r in combined.brief_step_7_rationale_sourced],
+        brief_step_8_disposition=combined.brief_step_8_disposition,
+        brief_step_9_other_opinions_summary=combined.brief_step_9_other_opinions_summary,
+    )
+    sourced = {
+        "facts": combined.brief_step_3_key_facts_sourced,
+        "rationale": combined.brief_step_7_rationale_sourced,
+        "issues": combined.brief_step_5_issues_sourced,
+        "holdings": combined.brief_step_6_holdings_sourced,
+    }
+    return brief, sourced
+
+def _generate_combined(compacted: CompactedText, route: ModelRoute, trace: DocumentTrace, final_key: str) -> Optional[Dict[str, Any]]:
+    """
+    The whole brief from one call. Returns None if the call or its parsing failed. A response whose
+    quotes are mostly not in the text is requested again from the stronger model.
+    """
+    print("Generating legal brief and supporting quotes in a single call...")
+    inputs = {"court_decision_full_text": compacted.text}
+    try:
+        combined = _invoke_traced(combined_brief_prompt, combined_brief_parser, inputs, trace, "combined", route)
+    except RateLimitExhausted:
+        raise
+    except Exception as e:
+        print(f"ERROR during combined brief generation: {e}")
+        return None
+
+    with trace.stage("quote_index"):
+        quote_index = QuoteIndex(compacted.text, compacted.to_original_span, compacted.original)
+    unsourced_brief, sourced = split_combined_brief(combined)
+    model = route.model_for("combined")
+    stronger = route.escalation_for(model)
+    match_rate = _quote_match_rate([item for items in sourced.values() for item in items], quote_index)
+    if stronger and match_rate < ROUTER_MIN_QUOTE_MATCH and not _was_escalated(trace, "combined"):
+        print(f"Only {match_rate:.0%} of the quotes from {model} were found in the text; retrying on {stronger}.")
+        _record_escalation(trace, "combined")
+        try:
+            retried = _invoke_traced(combined_brief_prompt, combined_brief_parser, inputs, trace, "combined", route, stronger)
+            retried_brief, retried_sourced = split_combined_brief(retried)
+            if _quote_match_rate([item for items in retried_sourced.values() for item in items], quote_index) >= match_rate:
+                unsourced_brief, sourced = retried_brief, retried_sourced
+        except RateLimitExhausted:
+            raise
+        except Exception as e:
+            print(f"ERROR during combined brief escalation, keeping the first response: {e}")
+
+    set_format_note(unsourced_brief)
+    final_structured_data = assemble_structured_data(unsourced_brief, sourced, quote_index, trace)
+    cache = get_summary_cache()
+    if cache:
+        cache.put("final", final_key, final_structured_data)
+    return final_structured_data
+
+# --- The main function, now corrected and with better cost tracking ---
+
+def generate_structured_brief(full_text: str, api_key: str, trace: Optional[DocumentTrace] = None,
+                              resume_stages: Optional[Dict[str, Any]] = None,
+                              on_stage_complete: Optional[Callable[[Dict[str, Any], Optional[str]], None]] = None,
+                              summary_mode: Optional[str] = None) -> Tuple[Optional[Dict[str, Any]], Dict[str, int]]:
+    """
+    Takes raw text, runs the full AI pipeline, and returns a tuple containing:
+    1. The final structured data dictionary.
+    2. A dictionary with the TOTAL token usage for all calls.
+    Pass a `trace` to also collect per-stage latency and per-call token usage. Sourcing stages
+    that failed are listed in `trace.extra["failed_stages"]`.
+
+    Stage checkpointing: `on_stage_complete(checkpoint, stage)` receives the checkpoint (a
+    JSON-serializable dict) after the brief, with `stage` None, and after every sourcing stage,
+    with `stage` naming the entry just added to `checkpoint["sourced"]`. Passing the checkpoint back
+    later as `resume_stages` re-runs only the stages missing from it, provided it was made for the
+    same text, prompts and model.
+
+    `summary_mode` ("multi" or "combined", default SUMMARY_MODE) picks how many calls are made;
+    the returned dictionary has the same shape either way. If the combined call fails, the
+    document falls back to the multi-call pipeline.
+
+    With COMPACTION_ENABLED the model only sees the compacted text; the tokens saved are in
+    `trace.extra["compaction"]`, and quote offsets still refer to `full_text`.
+    """
+    summary_mode = check_summary_mode(summary_mode or SUMMARY_MODE)
+    trace = trace or DocumentTrace()
+
+    # Boilerplate, page markers and repeated sentences are dropped before anything reaches the model.
+    with trace.stage("compaction"):
+        compacted = compact(full_text)
+        if COMPACTION_ENABLED:
+            trace.extra["compaction"] = compacted.report()
+    original_text, full_text = full_text, compacted.text
+
+    # Oversized decisions are briefed chunk by chunk so every call stays under the cheaper price tier.
+    pipeline = choose_pipeline(full_text)
+    trace.extra["pipeline"] = pipeline
+    # Short decisions and the sourcing stages can go to the cheaper model (see model_router.py).
+    route = ModelRoute(estimate_tokens(full_text), api_key)
+
+    # Results are cached by content: the cleaned text, every stage's prompt/schema fingerprint and the model.
+    # Compaction settings are part of the text's key, and only when compaction is on, so older entries stay valid without it.
+    cache = get_summary_cache()
+    text_hash = cache_key(original_text, COMPACTION_FINGERPRINT) if COMPACTION_ENABLED else cache_key(original_text)
+
+    if summary_mode == "combined" and pipeline == "single" and not resume_stages:
+        trace.extra["summary_mode"] = "combined"
+        combined_key = cache_key("final", text_hash, route.model_for("combined"), "combined", COMBINED_FINGERPRINT)
+        cached_final = cache.get("final", combined_key) if cache else None
+        if cached_final is not None:
+            print("Summary cache hit: reusing the stored structured brief.")
+            trace.extra["cache_hit"] = True
+            return cached_final, trace.totals()
+        final_structured_data = _generate_combined(compacted, route, trace, combined_key)
+        if final_structured_data is not None:
+            return final_structured_data, trace.totals()
+        print("Falling back to the multi-call pipeline for this document.")
+        trace.extra["combined_fallback"] = True
+    trace.extra["summary_mode"] = "multi"
+    final_key = cache_key("final", text_hash, route.cache_tag(STAGE_FINGERPRINTS), QUOTE_SOURCING_MODE, pipeline, str(CHUNK_TOKEN_BUDGET),
+                          *STAGE_FINGERPRINTS.values())
+    if cache:
+        cached_final = cache.get("final", final_key)
+        if cached_final is not None:
+            print("Summary cache hit: reusing the stored structured brief.")
+            trace.extra["cache_hit"] = True
+            return cached_final, trace.totals()
+
+    # The checkpoint shares the final cache key, so it is only reused for the same text, prompts and model.
+    checkpoint = resume_stages if resume_stages and resume_stages.get("key") == final_key else None
+    if resume_stages and checkpoint is None:
+        print("Stage checkpoint was made for a different text, prompt or model; starting over.")
+
+    # STEP 1: Generate the main brief (unsourced)
+    if pipeline == "chunked":
+        with trace.stage("chunking"):
+            chunks = split_into_chunks(full_text)
+        trace.extra["chunks"] = len(chunks)
+    else:
+        chunks = [full_text]
+    if checkpoint:
+        print(f"Resuming from stage checkpoint: reusing the main legal brief and {len(checkpoint['sourced'])} sourced stage(s).")
+        unsourced_brief, origins = LegalBrief(**checkpoint["brief"]), checkpoint["origins"]
+        trace.extra["resumed"] = True
+    else:
+        unsourced_brief, origins = _generate_brief(chunks, route, trace)
+
+        if not unsourced_brief:
+            print("ERROR: Main brief generation failed, returned None.")
+            return None, trace.totals()
+
+        # Update the format note using the court name that was already extracted
+        set_format_note(unsourced_brief)
+        checkpoint = {"key": final_key, "brief": unsourced_brief.model_dump(), "origins": origins, "sourced": {}}
+        if on_stage_complete:
+            on_stage_complete(checkpoint, None)
+
+    # STEP 2: Source quotes; usage is recorded on the trace by each call.
+    # In chunked mode each item is only sourced against the chunk it was extracted from.
+    sourcing_stages = {}
+    for name, items in stage_items(unsourced_brief).items():
+        helper = _SOURCING_HELPERS[name]
+        if origins is None:
+            sourcing_stages[name] = (helper, items, full_text)
+            continue
+        for chunk_no, chunk in enumerate(chunks):
+            chunk_items = [item for item, origin in zip(items, origins[name]) if origin == chunk_no]
+            if chunk_items:
+                sourcing_stages[f"{name}#{chunk_no}"] = (helper, chunk_items, chunk)
+
+    resumed = {
+        name: [SOURCING_STAGES[_stage_label(name)].model(**entry) for entry in entries]
+        for name, entries in checkpoint["sourced"].items() if name in sourcing_stages
+    }
+
+    def _checkpoint_stage(name, sourced_items):
+        if sourced_items is not None:
+            checkpoint["sourced"][name] = [item.model_dump() for item in sourced_items]
+            on_stage_complete(checkpoint, name)
+
+    with trace.stage("quote_index"):
+        quote_index = QuoteIndex(full_text, compacted.to_original_span, compacted.original)
+    pending = {name: stage for name, stage in sourcing_stages.items() if name not in resumed}
+    results = _run_sourcing_stages(pending, full_text, route, quote_index, text_hash, trace,
+                                   on_result=_checkpoint_stage if on_stage_complete else None)
+    results = {name: resumed[name] if name in resumed else results[name] for name in sourcing_stages}
+    sourced = {name: _combine_stage_parts(results, name) for name in SOURCING_STAGES}
+    failed_stages = [name for name, result in sourced.items() if result is None]
+    if failed_stages:
+        trace.extra["failed_stages"] = failed_stages
+
+    final_structured_data = assemble_structured_data(unsourced_brief, sourced, quote_index, trace)
+
+    # Only cache complete results, so a failed sourcing stage is retried next time.
+    if cache and not failed_stages:
+        cache.put("final", final_key, final_structured_data)
+
+    return final_structured_data, trace.totals()
@@ -0,0 +1,129 @@
+# summary_cache.py
+"""
+Persistent, content-addressed cache for pipeline results.
+
+Keys are hashes of everything that determines a result (cleaned text, prompt and
+schema fingerprint, model name, stage inputs), so a duplicate opinion stored under a
+different `_id`, or a document reset for reprocessing, is served from the cache. After
+a prompt or schema change to one stage, only that stage and the stages after it miss.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+SUMMARY_CACHE_ENABLED = os.environ.get("SUMMARY_CACHE_ENABLED", "true").lower() == "true"
+SUMMARY_CACHE_PATH = os.environ.get("SUMMARY_CACHE_PATH", os.path.join("cache", "summary_cache.sqlite3"))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.environ.get("SUMMARY_CACHE_MAX_ENTRIES", "200000"))
+SUMMARY_CACHE_MAX_AGE_DAYS = float(os.environ.get("SUMMARY_CACHE_MAX_AGE_DAYS", "90"))
+
+# Eviction runs once every this many writes, rather than on every put.
+_EVICT_EVERY_N_PUTS = 500
+
+_summary_cache = None
+_summary_cache_lock = threading.Lock()
+
+
+def cache_key(*parts: str) -> str:
+    """Stable sha256 key over the given string parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+class SummaryCache:
+    """SQLite-backed key/value store with age and size based eviction and per-stage hit/miss counters."""
+
+    def __init__(self, path: str, max_entries: int, max_age_seconds: float):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.hits = Counter()
+        self.misses = Counter()
+        self._lock = threading.Lock()
+        self._puts_since_evict = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, stage TEXT NOT NULL, value TEXT NOT NULL,"
+            " created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_last_used ON cache (last_used)")
+        self.evict()
+
+    def get(self, stage: str, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.max_age_seconds:
+                self.misses[stage] += 1
+                return None
+            self._conn.execute("UPDATE cache SET last_used = ? WHERE key = ?", (now, key))
+            self.hits[stage] += 1
+        return json.loads(row[0])
+
+    def put(self, stage: str, key: str, value: Any):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, stage, value, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, stage, json.dumps(value, default=str), now, now),
+            )
+            self._puts_since_evict += 1
+            should_evict = self._puts_since_evict >= _EVICT_EVERY_N_PUTS
+        if should_evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """Drops expired entries, then the least recently used ones beyond max_entries. Returns rows removed."""
+        with self._lock:
+            self._puts_since_evict = 0
+            removed = self._conn.execute(
+                "DELETE FROM cache WHERE created_at < ?", (time.time() - self.max_age_seconds,)
+            ).rowcount
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+            if count > self.max_entries:
+                removed += self._conn.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                ).rowcount
+        return removed
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Hit/miss counts per stage since this process started."""
+        with self._lock:
+            stages = set(self.hits) | set(self.misses)
+            return {stage: {"hits": self.hits[stage], "misses": self.misses[stage]} for stage in sorted(stages)}
+
+
+def get_summary_cache() -> Optional[SummaryCache]:
+    """Returns the process-wide cache, or None when SUMMARY_CACHE_ENABLED is off."""
+    global _summary_cache
+    if not SUMMARY_CACHE_ENABLED:
+        return None
+    with _summary_cache_lock:
+        if _summary_cache is None:
+            _summary_cache = SummaryCache(
+                SUMMARY_CACHE_PATH,
+                max_entries=SUMMARY_CACHE_MAX_ENTRIES,
+                max_age_seconds=SUMMARY_CACHE_MAX_AGE_DAYS * 86400,
+            )
+            print(f"Opened summary cache at {SUMMARY_CACHE_PATH}.")
+    return _summary_cache
+
+
+def disable_summary_cache():
+    """Turns the cache off for the rest of the process, e.g. for comparisons that must reach the model."""
+    global SUMMARY_CACHE_ENABLED
+    SUMMARY_CACHE_ENABLED = False
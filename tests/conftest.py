@@ -0,0 +1,12 @@
+# tests/conftest.py
+import pytest
+
+from benchmark import open_collection
+
+
+@pytest.fixture
+def collection():
+    """A fresh, empty decisions collection in mongomock (the benchmark's offline database)."""
+    client, decisions = open_collection(None)
+    yield decisions
+    client.close()
@@ -0,0 +1,139 @@
+# tests/test_claims.py
+"""No decision is summarized twice: claims are exclusive, leases expire, and stale workers write nothing."""
+import threading
+import time
+
+import pytest
+
+import main
+import summarizer_logic
+from instrumentation import MetricsRecorder
+from mongo_io import LeaseLost, PendingPrefetcher, claim_batch, claim_filter
+
+LEASE = 900
+CRIMINAL_HTML = "<html><head><title>People v Smith</title></head><body><p>People v Smith</p><p>The stop was lawful.</p></body></html>"
+
+
+def _insert(collection, count):
+    collection.insert_many([{"_id": i, "is_summarized": False, "html": CRIMINAL_HTML} for i in range(count)])
+
+
+def _expire(collection, ids):
+    collection.update_many({"_id": {"$in": ids}}, {"$set": {"claimed_until": time.time() - 1}})
+
+
+class InterleavingCollection:
+    """Runs `between` after the claim query has picked its decisions and before they are updated."""
+
+    def __init__(self, collection, between):
+        self.collection = collection
+        self.between = between
+
+    def find(self, *args, **kwargs):
+        return self.collection.find(*args, **kwargs)
+
+    def update_many(self, *args, **kwargs):
+        if self.between:
+            self.between, between = None, self.between
+            between()
+        return self.collection.update_many(*args, **kwargs)
+
+
+@pytest.fixture
+def ctx(collection, tmp_path):
+    metrics = MetricsRecorder(str(tmp_path / "metrics.jsonl"), str(tmp_path / "metrics.prom"))
+    ctx = main.RunContext(collection, "key", str(tmp_path / "run_log.txt"), metrics)
+    yield ctx
+    ctx.close()
+
+
+def test_two_claimers_never_take_the_same_decision(collection):
+    _insert(collection, 10)
+    first = claim_batch(collection, "a", 4, LEASE)
+    second = claim_batch(collection, "b", 10, LEASE)
+    assert len(first) == 4 and len(second) == 6
+    assert not {d["_id"] for d in first} & {d["_id"] for d in second}
+    assert claim_batch(collection, "c", 10, LEASE) == []
+    assert {d["claimed_by"] for d in first} != {d["claimed_by"] for d in second}
+
+
+def test_claim_skips_decisions_taken_after_it_queried(collection):
+    _insert(collection, 4)
+    taken = []
+    racing = InterleavingCollection(collection, lambda: taken.extend(claim_batch(collection, "b", 2, LEASE)))
+    mine = claim_batch(racing, "a", 4, LEASE)
+    assert len(taken) == 2 and len(mine) == 2
+    assert not {d["_id"] for d in mine} & {d["_id"] for d in taken}
+
+
+def test_expired_lease_is_reclaimed(collection):
+    _insert(collection, 2)
+    first = claim_batch(collection, "a", 2, LEASE)
+    assert claim_batch(collection, "b", 2, LEASE) == []
+    _expire(collection, [0])
+    second = claim_batch(collection, "b", 2, LEASE)
+    assert [d["_id"] for d in second] == [0]
+    assert second[0]["claimed_by"] != first[0]["claimed_by"]
+
+
+def test_stale_worker_write_matches_nothing(collection):
+    _insert(collection, 1)
+    [stale] = claim_batch(collection, "a", 1, LEASE)
+    _expire(collection, [0])
+    [current] = claim_batch(collection, "b", 1, LEASE)
+    result = collection.update_one(claim_filter(stale), {"$set": {"is_summarized": True, "summary_status": "success"}})
+    assert result.matched_count == 0
+    assert collection.find_one({"_id": 0})["claimed_by"] == current["claimed_by"]
+    assert collection.update_one(claim_filter(current), {"$set": {"summary_status": "success"}}).matched_count == 1
+
+
+def test_stale_worker_abandons_at_its_next_checkpoint(collection, ctx, monkeypatch):
+    _insert(collection, 1)
+    [stale] = claim_batch(collection, "a", 1, LEASE)
+
+    def generate_structured_brief(text, api_key, trace=None, resume_stages=None, on_stage_complete=None, summary_mode=None):
+        # The lease runs out mid-document and another worker reclaims it before the first checkpoint.
+        _expire(collection, [0])
+        claim_batch(collection, "b", 1, LEASE)
+        on_stage_complete({"key": "k", "brief": {}, "origins": None, "sourced": {}}, None)
+        return {"brief": "written by the stale worker"}, {}
+
+    monkeypatch.setattr(summarizer_logic, "generate_structured_brief", generate_structured_brief)
+    with pytest.raises(LeaseLost):
+        main.process_decision(stale, ctx, main.DocumentTrace(0))
+
+    class OneDecision:
+        def __init__(self, decision):
+            self.decisions = [decision]
+
+        def get(self):
+            return self.decisions.pop() if self.decisions else None
+
+    _expire(collection, [0])
+    [stale] = claim_batch(collection, "a", 1, LEASE)
+    ctx.prefetcher = OneDecision(stale)
+    main.worker_loop("a:0", ctx)
+    ctx.updates.flush()
+    document = collection.find_one({"_id": 0})
+    assert document["claimed_by"] != stale["claimed_by"]
+    assert document["is_summarized"] is False and "summary_stages" not in document and "summary_status" not in document
+    assert ctx.stats.decisions_failed == 0 and ctx.stats.decisions_processed == 0
+
+
+def test_prefetcher_skips_decisions_reclaimed_while_queued(collection):
+    _insert(collection, 2)
+    stop = threading.Event()
+    prefetcher = PendingPrefetcher(collection, "a", LEASE, stop, queue_size=2).start()
+    deadline = time.monotonic() + 5
+    while collection.count_documents({"claimed_by": {"$exists": True}}) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    _expire(collection, [0])
+    claim_batch(collection, "b", 1, LEASE)
+    renewed_after = time.time() + LEASE - 1
+
+    decision = prefetcher.get()
+    assert decision["_id"] == 1
+    assert collection.find_one({"_id": 1})["claimed_until"] >= renewed_after
+    assert prefetcher.get() is None
+    stop.set()
+    assert prefetcher.drain_unprocessed() == []
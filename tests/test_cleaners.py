@@ -0,0 +1,29 @@
+# tests/test_cleaners.py
+"""The streaming cleaner must produce exactly what eyecite's cleaner produces."""
+import pytest
+
+from bench_cleaners import EDGE_CASES, fixture_corpus
+from cleaners import clean_html_eyecite, clean_html_streaming, get_cleaner
+
+
+def _outcome(cleaner, html):
+    """The cleaned text, or the type of the exception raised, so both backends must also fail alike."""
+    try:
+        return cleaner(html)
+    except Exception as e:
+        return f"<raised {type(e).__name__}>"
+
+
+@pytest.mark.parametrize("html", EDGE_CASES)
+def test_streaming_matches_eyecite_on_edge_cases(html):
+    assert _outcome(clean_html_streaming, html) == _outcome(clean_html_eyecite, html)
+
+
+@pytest.mark.parametrize("html", fixture_corpus())
+def test_streaming_matches_eyecite_on_fixture_corpus(html):
+    assert _outcome(clean_html_streaming, html) == _outcome(clean_html_eyecite, html)
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        get_cleaner("streamin")
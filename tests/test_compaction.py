@@ -0,0 +1,102 @@
+# tests/test_compaction.py
+"""Every offset in a compacted text must map back to the same character of the original."""
+import pytest
+
+import compaction
+from bench_cleaners import EDGE_CASES, fixture_corpus
+from compaction import compact
+from main import clean_html
+from quote_index import QuoteIndex
+
+ALL_RULES = ["boilerplate", "markers", "repeats", "citations"]
+HEADER = "People v Smith, 2024 NY Slip Op 01234 (App Div, 2d Dept 2024)."
+STRING_CITE = (
+    "The stop was unlawful (see People v De Bour, 40 NY2d 210, 223 [1976]; People v Hollman, 79 NY2d 181 [1992]; "
+    "People v Garcia, 20 NY3d 317 [2012]; see also People v Moore, 6 NY3d 496 [2006]). "
+)
+HAND_WRITTEN = [
+    "",
+    "Return to Decision List",
+    f"{HEADER} The facts [*2] are not in dispute. {HEADER} Defendant [FN1] appeals. {HEADER} {STRING_CITE}"
+    "This opinion is uncorrected and subject to revision before publication in the Official Reports.",
+    f"{STRING_CITE}{STRING_CITE}[*7] [*8]",
+]
+
+
+def _texts():
+    # The synthetic decisions only, and not the longest, which take eyecite seconds each to scan for citations.
+    cleaned = [clean_html(html) for html in fixture_corpus(documents=10)[len(EDGE_CASES):]]
+    return HAND_WRITTEN + [text for text in cleaned if len(text) < 200_000]
+
+
+TEXTS = _texts()
+
+
+@pytest.fixture(autouse=True)
+def all_rules(monkeypatch):
+    monkeypatch.setattr(compaction, "COMPACTION_RULES", ALL_RULES)
+
+
+@pytest.fixture(scope="module")
+def compacted_texts():
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(compaction, "COMPACTION_RULES", ALL_RULES)
+        return [compact(text, enabled=True) for text in TEXTS]
+
+
+@pytest.mark.parametrize("n", range(len(TEXTS)))
+def test_every_compacted_character_maps_back(compacted_texts, n):
+    text, compacted = TEXTS[n], compacted_texts[n]
+    assert len(compacted.text) <= len(text)
+    mapped = "".join(text[compacted.to_original(offset)] for offset in range(len(compacted.text)))
+    assert mapped == compacted.text
+
+
+@pytest.mark.parametrize("n", range(len(TEXTS)))
+def test_spans_within_a_kept_span_round_trip(compacted_texts, n):
+    compacted = compacted_texts[n]
+    position = 0
+    for start, end in compacted.spans:
+        length = end - start
+        for a, b in [(0, length), (0, 1), (length // 3, length // 2 + 1), (length - 1, length)]:
+            if a < b:
+                assert compacted.to_original_span(position + a, position + b) == (start + a, start + b)
+        position += length
+
+
+def test_rules_remove_what_they_target():
+    compacted = compact(HAND_WRITTEN[2], enabled=True)
+    assert "[*2]" not in compacted.text and "[FN1]" not in compacted.text
+    assert compacted.text.count(HEADER) == 1
+    assert "Official Reports" not in compacted.text
+    assert "Hollman" in compacted.text and "Garcia" not in compacted.text and "Moore" not in compacted.text
+    assert set(compacted.removed_chars) == set(ALL_RULES)
+
+
+def test_disabled_compaction_keeps_the_text_whole():
+    text = HAND_WRITTEN[2]
+    compacted = compact(text, enabled=False)
+    assert compacted.text == text and compacted.removed_chars == {}
+
+
+def test_quote_across_removed_text_is_replaced_by_the_original_passage():
+    text = "Officers approached the car [*4] without any founded suspicion. The judgment is reversed."
+    compacted = compact(text, enabled=True)
+    index = QuoteIndex(compacted.text, compacted.to_original_span, compacted.original)
+    crossing, inside = index.annotate([
+        {"supporting_quote": "approached the car without any founded suspicion"},
+        {"supporting_quote": "The judgment is reversed."},
+    ])
+    for item in (crossing, inside):
+        assert item["quote_verified"]
+        assert text[item["quote_start"]:item["quote_end"]] == item["supporting_quote"]
+    assert crossing["supporting_quote"] == "approached the car [*4] without any founded suspicion"
+    assert inside["supporting_quote"] == "The judgment is reversed."
+
+
+def test_unknown_rule_is_rejected(monkeypatch):
+    monkeypatch.setattr(compaction, "COMPACTION_RULES", ["boilerplat"])
+    with pytest.raises(ValueError):
+        compaction.check_rules()
+    with pytest.raises(ValueError):
+        compact("text", enabled=True)
@@ -0,0 +1,70 @@
+# tests/test_mongo_io.py
+"""Buffered status updates must survive a transient database error."""
+import time
+
+from pymongo.errors import AutoReconnect
+
+from mongo_io import BulkUpdateBuffer
+
+
+class FlakyCollection:
+    """Forwards to `collection`, but the first `failures` bulk writes lose the connection."""
+
+    def __init__(self, collection, failures):
+        self.collection = collection
+        self.failures = failures
+
+    def bulk_write(self, requests, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect("connection reset")
+        return self.collection.bulk_write(requests, ordered=ordered)
+
+
+def _statuses(collection):
+    return {d["_id"]: d.get("summary_status") for d in collection.find()}
+
+
+def test_failed_flush_keeps_the_operations_for_the_next_one(collection):
+    collection.insert_many([{"_id": i} for i in range(3)])
+    flushes = []
+    buffer = BulkUpdateBuffer(FlakyCollection(collection, failures=1), max_ops=100, max_seconds=60,
+                              on_flush=lambda seconds, operations: flushes.append(operations))
+    for i in range(3):
+        buffer.update_one({"_id": i}, {"$set": {"summary_status": "success"}})
+    assert buffer.flush() is False
+    assert _statuses(collection) == {0: None, 1: None, 2: None}
+    buffer.update_one({"_id": 0}, {"$set": {"summary_status": "failed"}})
+    assert buffer.flush() is True
+    # The retried operations are written first, so the newer update to the same document wins.
+    assert _statuses(collection) == {0: "failed", 1: "success", 2: "success"}
+    assert flushes == [4]
+    buffer.close()
+
+
+def test_add_does_not_raise_when_its_flush_fails(collection):
+    collection.insert_one({"_id": 1})
+    buffer = BulkUpdateBuffer(FlakyCollection(collection, failures=1), max_ops=1, max_seconds=60)
+    buffer.update_one({"_id": 1}, {"$set": {"summary_status": "success"}})
+    buffer.close()
+    assert _statuses(collection) == {1: "success"}
+
+
+def test_timer_thread_retries_after_a_failed_flush(collection):
+    collection.insert_one({"_id": 1})
+    buffer = BulkUpdateBuffer(FlakyCollection(collection, failures=2), max_ops=100, max_seconds=0.1)
+    buffer.update_one({"_id": 1}, {"$set": {"summary_status": "success"}})
+    deadline = time.monotonic() + 5
+    while _statuses(collection)[1] is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert _statuses(collection) == {1: "success"}
+    assert buffer._timer.is_alive()
+    buffer.close()
+
+
+def test_close_reports_updates_it_could_not_write(collection, capsys):
+    collection.insert_one({"_id": 1})
+    buffer = BulkUpdateBuffer(FlakyCollection(collection, failures=5), max_ops=100, max_seconds=60)
+    buffer.update_one({"_id": 1}, {"$set": {"summary_status": "success"}})
+    buffer.close()
+    assert "1 buffered updates were not written" in capsys.readouterr().out
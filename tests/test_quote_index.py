@@ -0,0 +1,33 @@
+# tests/test_quote_index.py
+"""Only quotes that occur verbatim in the decision may be marked verified."""
+from quote_index import QuoteIndex
+
+TEXT = (
+    "The People appeal from an order granting suppression. The officers did not have reasonable suspicion "
+    "to stop the vehicle. Accordingly, the order is affirmed."
+)
+
+
+def test_near_match_that_inverts_the_holding_is_not_verified():
+    index = QuoteIndex(TEXT)
+    match = index.locate("officers did have reasonable suspicion")
+    assert match is not None and not match.exact
+    [item] = index.annotate([{"supporting_quote": "officers did have reasonable suspicion"}])
+    assert item["quote_verified"] is False
+    assert item["supporting_quote"] == "officers did have reasonable suspicion"
+    assert "did not have" in TEXT[item["quote_start"]:item["quote_end"]]
+    assert not index.is_verbatim("officers did have reasonable suspicion")
+
+
+def test_exact_match_is_verified_up_to_case_whitespace_and_typographic_quotes():
+    index = QuoteIndex(TEXT.replace("did not", "did not"))
+    [item] = index.annotate([{"supporting_quote": "“The officers  DID NOT have reasonable suspicion”"}])
+    assert item["quote_verified"] is True
+    assert index.text[item["quote_start"]:item["quote_end"]].lower().startswith("the officers did")
+    assert index.is_verbatim("the order is affirmed")
+
+
+def test_missing_quote_has_no_offsets():
+    [item] = QuoteIndex(TEXT).annotate([{"supporting_quote": "No direct supporting quote found in the text."}])
+    assert item == {"supporting_quote": "No direct supporting quote found in the text.",
+                    "quote_verified": False, "quote_start": None, "quote_end": None}
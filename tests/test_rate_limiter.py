@@ -0,0 +1,71 @@
+# tests/test_rate_limiter.py
+"""Only real quota errors may be retried and slow the process down."""
+import pytest
+from google.api_core.exceptions import InvalidArgument, ResourceExhausted
+from google.genai.errors import ClientError
+from langchain_core.exceptions import OutputParserException
+
+import rate_limiter
+from rate_limiter import LLMScheduler, RateLimitExhausted, is_quota_error
+
+# A parse failure echoes the model's output, which can contain "429" and "quota" in a citation.
+PARSE_FAILURE = OutputParserException(
+    "Invalid json output: see People v Ramos, 130 AD3d 1429 [4th Dept 2015] (the quota of evidence)"
+)
+
+
+def _client_error(code):
+    return ClientError(code, {"error": {"code": code, "message": "Resource has been exhausted", "status": "RESOURCE_EXHAUSTED"}})
+
+
+def _raised_from(error, cause):
+    try:
+        raise error from cause
+    except Exception as e:
+        return e
+
+
+@pytest.mark.parametrize("error", [
+    ResourceExhausted("Resource has been exhausted (e.g. check quota)."),
+    _client_error(429),
+    _raised_from(RuntimeError("Error calling model"), _client_error(429)),
+])
+def test_quota_errors_are_recognized(error):
+    assert is_quota_error(error)
+
+
+@pytest.mark.parametrize("error", [
+    PARSE_FAILURE,
+    ValueError("429 quota rate limit resource_exhausted"),
+    InvalidArgument("quota"),
+    _client_error(400),
+    _raised_from(PARSE_FAILURE, ValueError("1429")),
+])
+def test_other_errors_are_not_quota_errors(error):
+    assert not is_quota_error(error)
+
+
+def test_parse_failure_is_raised_without_backoff():
+    scheduler = LLMScheduler(1000, 1_000_000)
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise PARSE_FAILURE
+
+    with pytest.raises(OutputParserException):
+        scheduler.call(fail, 10)
+    assert len(calls) == 1
+    assert scheduler.quota_errors == 0 and scheduler.rate_scale == 1.0
+
+
+def test_quota_errors_are_retried_until_exhausted(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "BACKOFF_BASE_SECONDS", 0.0)
+    scheduler = LLMScheduler(1000, 1_000_000, max_retries=2)
+
+    def fail():
+        raise _client_error(429)
+
+    with pytest.raises(RateLimitExhausted):
+        scheduler.call(fail, 10)
+    assert scheduler.quota_errors == 3 and scheduler.rate_scale < 1.0
@@ -0,0 +1,61 @@
+# tests/test_triage.py
+"""triage_html must agree with is_criminal_case(clean_html(html)) whenever it decides."""
+import random
+
+import pytest
+
+import triage
+from bench_cleaners import EDGE_CASES, fixture_corpus
+from main import clean_html, is_criminal_case
+from triage import triage_html
+
+CAPTION_CASES = [
+    "<p>People v Smith</p>", "<p>The People of the State of New York v Jones</p>", "<p>Matter of Doe</p>",
+    "<p>  people   v​ smith</p>", "<p>People</p><p>v Smith</p>", "<i>People</i> v. Smith", "<p>People vs Smith</p>",
+    "<title>People v Doe</title><p>Matter of Doe</p>", "<span class='star-pagination'>*1</span>People v Smith",
+    "<script>People v Smith</script><p>Matter of X</p>", "<p>The People</p>", "<p>P</p>",
+]
+FUZZ_PIECES = [
+    "<html>", "<head>", "<title>", "</title>", "</head>", "<body>", "<p>", "</p>", "<div class=\"star-pagination\">", "</div>",
+    "<script>", "</script>", "<style>", "</style>", "<page-number>", "</page-number>", "<!-- note -->", "<br>",
+    "People v Smith", "The People of the State of New York v Jones", "people", " v ", "Matter of X", "&amp;", "&nbsp;", " ",
+    "​", "  \n\t ", "The People", " of the State of New York", "<b>", "</b>", "<i>People</i> v.", "P", "eople v", "x" * 50,
+]
+
+
+def _fuzz_cases(seed: int = 11, count: int = 300):
+    rng = random.Random(seed)
+    return ["".join(rng.choice(FUZZ_PIECES) for _ in range(rng.randint(0, 25))) for _ in range(count)]
+
+
+CORPUS = EDGE_CASES + CAPTION_CASES + fixture_corpus(documents=10) + _fuzz_cases()
+
+
+def _truth(html):
+    try:
+        return is_criminal_case(clean_html(html))
+    except Exception:
+        return None
+
+
+@pytest.mark.parametrize("html", CORPUS)
+@pytest.mark.parametrize("feed_chars", [1, 7, 4096])
+def test_triage_matches_full_clean(html, feed_chars, monkeypatch):
+    monkeypatch.setattr(triage, "TRIAGE_FEED_CHARS", feed_chars)
+    decision = triage_html(html)
+    if decision is not None:
+        assert decision == _truth(html)
+
+
+@pytest.mark.parametrize("html", CORPUS)
+def test_triage_of_prefix_matches_full_clean(html):
+    truth = _truth(html)
+    for cut in sorted({0, len(html) // 3, len(html) // 2, len(html)}):
+        decision = triage_html(html[:cut], complete=False)
+        if decision is not None:
+            assert decision == truth, f"decided {decision} from the first {cut} characters"
+
+
+def test_triage_decides_plain_captions():
+    assert triage_html("<p>People v Smith</p>") is True
+    assert triage_html("<p>Matter of Doe</p>") is False
@@ -0,0 +1,131 @@
+# triage.py
+"""
+Cheap criminal-case triage from the start of a decision's HTML.
+
+The criminal filter only looks at how the cleaned text begins ("People v ..."), so the
+HTML is parsed incrementally and parsing stops as soon as the caption settles the
+question. The visible text comes from the same parser target as the streaming cleaner
+(see cleaners.py), which keeps exactly the text nodes eyecite's `html` cleaner keeps, so the answer
+is the same as `is_criminal_case(clean_html(html))`. When the start of the document does
+not settle it, the result is None and the caller falls back to the full cleaner.
+
+`run_triage` applies this to the whole backlog: it reads only an HTML prefix of each
+pending decision (`$substrCP`) and marks the non-criminal ones as skipped in bulk.
+"""
+import os
+import time
+from typing import Optional
+
+import pymongo
+
+from cleaners import WHITESPACE, VisibleTextTarget
+from mongo_io import claimable_filter
+
+# Captions that mark a criminal case (see main.is_criminal_case).
+CRIMINAL_CAPTION_PREFIXES = ("people v", "the people of the state of new york v")
+
+TRIAGE_FEED_CHARS = 4096
+# How much HTML the bulk triage reads per decision before falling back to the full document.
+TRIAGE_PREFIX_CHARS = int(os.environ.get("TRIAGE_PREFIX_CHARS", "16384"))
+TRIAGE_BATCH_SIZE = int(os.environ.get("TRIAGE_BATCH_SIZE", "500"))
+
+def caption_decision(visible_text: str, complete: bool) -> Optional[bool]:
+    """
+    Classifies from the visible text seen so far: True/False once settled, otherwise None.
+    An empty complete document is left undecided, since eyecite raises on it.
+    """
+    start = WHITESPACE.sub(" ", visible_text).strip().lower()
+    if start.startswith(CRIMINAL_CAPTION_PREFIXES):
+        return True
+    if complete:
+        return False if start else None
+    if any(prefix.startswith(start) for prefix in CRIMINAL_CAPTION_PREFIXES):
+        return None
+    return False
+
+
+def triage_html(html: str, complete: bool = True) -> Optional[bool]:
+    """
+    Returns whether the decision is a criminal case, parsing only as much of `html` as needed.
+    Pass `complete=False` when `html` is only a prefix of the document.
+    Returns None when undecided (or unparseable); the caller then uses the full cleaner.
+    """
+    from lxml import etree
+
+    target = VisibleTextTarget()
+    parser = etree.HTMLParser(target=target)
+    try:
+        for offset in range(0, len(html), TRIAGE_FEED_CHARS):
+            parser.feed(html[offset:offset + TRIAGE_FEED_CHARS])
+            decision = caption_decision(" ".join(target.nodes), complete=False)
+            if decision is not None:
+                return decision
+        if not complete:
+            return None
+        return caption_decision(parser.close(), complete=True)
+    except Exception:
+        return None
+
+
+# --- Bulk triage ---
+
+def _prefix_pipeline(last_id, batch_size: int, prefix_chars: int):
+    match = claimable_filter(time.time())
+    if last_id is not None:
+        match["_id"] = {"$gt": last_id}
+    return [
+        {"$match": match},
+        {"$sort": {"_id": 1}},
+        {"$limit": batch_size},
+        # A missing `html` gives an empty prefix, which triage leaves undecided (the workers fail those documents).
+        {"$project": {"html_prefix": {"$substrCP": [{"$ifNull": ["$html", ""]}, 0, prefix_chars]}}},
+    ]
+
+
+def run_triage(decisions_collection, batch_size: int = TRIAGE_BATCH_SIZE, prefix_chars: int = TRIAGE_PREFIX_CHARS) -> dict:
+    """
+    Walks every pending, unclaimed decision in `_id` order and marks non-criminal ones as
+    `skipped_not_criminal` with one unordered bulk write per batch. Criminal and undecided
+    decisions are left for the workers. Returns counts by outcome.
+    """
+    counts = {"skipped": 0, "criminal": 0, "undecided": 0, "full_reads": 0}
+    last_id = None
+    while True:
+        batch = list(decisions_collection.aggregate(_prefix_pipeline(last_id, batch_size, prefix_chars)))
+        if not batch:
+            return counts
+        last_id = batch[-1]["_id"]
+
+        skips, needs_full = [], []
+        for decision in batch:
+            prefix = decision["html_prefix"]
+            verdict = triage_html(prefix, complete=len(prefix) < prefix_chars)
+            if verdict is None and len(prefix) >= prefix_chars:
+                needs_full.append(decision["_id"])
+            else:
+                _tally(counts, skips, decision["_id"], verdict)
+
+        if needs_full:
+            counts["full_reads"] += len(needs_full)
+            for decision in decisions_collection.find({"_id": {"$in": needs_full}}, {"html": 1}):
+                _tally(counts, skips, decision["_id"], triage_html(decision["html"]))
+
+        if skips:
+            now = time.time()
+            # Re-checks claimability, so a decision a worker claimed in the meantime is left to it.
+            decisions_collection.bulk_write([
+                pymongo.UpdateOne(
+                    {"_id": doc_id, **claimable_filter(now)},
+                    {"$set": {"is_summarized": True, "summary_status": "skipped_not_criminal", "summarized_at": now}}
+                )
+                for doc_id in skips
+            ], ordered=False)
+            counts["skipped"] += len(skips)
+        print(f"Triage: {counts['skipped']} skipped, {counts['criminal']} criminal, {counts['undecided']} undecided so far.")
+
+
+def _tally(counts: dict, skips: list, doc_id, verdict: Optional[bool]):
+    if verdict is False:
+        skips.append(doc_id)
+    else:
+        counts["criminal" if verdict else "undecided"] += 1